@@ -0,0 +1,61 @@
+"""
+Micro-benchmark of parse_vmknic_table() against the regex parser it replaced.
+
+Usage: python benchmarks/bench_parse_vmknic.py [rows ...]
+"""
+
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from parse_vmknic import cmd_out, parse_vmknic_table
+
+def legacy_parse_vmknic(port_key, cmd_out):
+  """
+  The regex based parser parse_vmknic_table() replaced, kept for comparison.
+  """
+  VMKNIC_TABLE_ROW_RE = re.compile(r"^(vmk\d+)\s+(.*\S+)\s*IPv[46]\s+"
+                                   r"(\d+\.\d+\.\d+\.\d+)\s+"
+                                   r"(\d+\.\d+\.\d+\.\d+).*(true|false)"
+                                   r"\s+(\w+)")
+  matches = []
+  vmknic_list = cmd_out.strip().split("\n")[1:-1]
+  for device_config_line in vmknic_list:
+    match = VMKNIC_TABLE_ROW_RE.search(device_config_line)
+    if not match:
+      continue
+    matches.append((match.group(1), match.group(2)))
+  return matches
+
+def make_table(num_rows):
+  """
+  Returns esxcfg-vmknic -l output with num_rows rows, built by renumbering
+  the rows of the sample output.
+  """
+  lines = cmd_out.strip().splitlines()
+  prompt, header, rows = lines[0], lines[1], lines[2:]
+  out = [prompt, header]
+  for index in range(num_rows):
+    row = rows[index % len(rows)]
+    out.append(("vmk%-7d" % index) + row[len("vmk0      "):])
+  out.append("")
+  return "\n".join(out)
+
+def main(sizes):
+  print("%8s %14s %14s %8s" % ("rows", "regex (ms)", "columnar (ms)",
+                               "speedup"))
+  for size in sizes:
+    table = make_table(size)
+    number = max(1, 20000 // size)
+    legacy = min(timeit.repeat(lambda: legacy_parse_vmknic(None, table),
+                               number=number, repeat=3)) / number
+    columnar = min(timeit.repeat(lambda: parse_vmknic_table(table),
+                                 number=number, repeat=3)) / number
+    print("%8d %14.3f %14.3f %7.1fx" % (size, legacy * 1e3, columnar * 1e3,
+                                        legacy / columnar))
+
+if __name__ == "__main__":
+  main([int(arg) for arg in sys.argv[1:]] or [8, 128, 1024, 8192])
@@ -0,0 +1,99 @@
+"""
+Benchmark of the esxcli output formatters on large interface lists.
+
+Renders interface lists of several sizes, built from the captured
+network_ip_interface_list.xml rows, with the xml, json and csv formatters
+and reports the bytes each one transfers and the time the esxcli query layer
+takes to decode it. Exits with status 1 if the formatters decode to
+different rows.
+
+Usage:
+  python benchmarks/esxcli_formats.py [--rows 100,500,2000] [--repeat 5]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+import fakes
+from esxcli_query import FORMATTERS, decode_esxcli_output
+from interface_table import INTERFACE_LIST_QUERY
+
+CAPTURED = "network_ip_interface_list.xml"
+DEFAULT_ROWS = [100, 500, 2000]
+
+
+def interface_rows(num_rows):
+  """
+  Returns num_rows distinct interface rows modelled on the captured ones.
+  """
+  captured = fakes.esxcli_rows(CAPTURED)
+  rows = []
+  for index in range(num_rows):
+    row = dict(captured[index % len(captured)])
+    row["Name"] = "vmk%d" % index
+    row["MAC Address"] = "00:50:56:%02x:%02x:%02x" % (
+        index >> 16 & 0xff, index >> 8 & 0xff, index & 0xff)
+    row["External ID"] = "e05d2b07-346f-48cc-b3b6-%012x" % index
+    row["Port ID"] = 67108864 + index
+    rows.append(row)
+  return rows
+
+
+def measure(output, formatter, repeat):
+  """
+  Returns the decoded rows and the best decode time in ms of repeat runs.
+  """
+  best = None
+  for _ in range(repeat):
+    start = time.time()
+    rows = decode_esxcli_output(output, INTERFACE_LIST_QUERY.schema,
+                                INTERFACE_LIST_QUERY.fields,
+                                formatter=formatter)
+    elapsed = time.time() - start
+    best = elapsed if best is None else min(best, elapsed)
+  return rows, best * 1e3
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+  parser.add_argument("--rows", default=",".join(map(str, DEFAULT_ROWS)),
+                      help="Comma separated interface list sizes")
+  parser.add_argument("--repeat", type=int, default=5,
+                      help="Decode runs per output, the best is reported")
+  args = parser.parse_args(argv)
+
+  columns = fakes.esxcli_columns(CAPTURED)
+  mismatches = []
+  print("%6s %-6s %10s %10s %10s" % ("rows", "format", "bytes", "decode ms",
+                                     "vs xml"))
+  for num_rows in [int(size) for size in args.rows.split(",")]:
+    rows = interface_rows(num_rows)
+    decoded = {}
+    xml_ms = None
+    for formatter in FORMATTERS[::-1]:
+      output = fakes.render_esxcli(rows, columns, "NetworkInterface",
+                                   formatter)
+      decoded[formatter], decode_ms = measure(output, formatter, args.repeat)
+      if xml_ms is None:
+        xml_ms = decode_ms
+      print("%6d %-6s %10d %10.2f %9.1fx" % (
+          num_rows, formatter, len(output.encode("utf-8")), decode_ms,
+          xml_ms / decode_ms if decode_ms else 0))
+    for formatter in FORMATTERS:
+      if decoded[formatter] != decoded["xml"]:
+        mismatches.append("%d rows: %s rows differ from xml" %
+                          (num_rows, formatter))
+
+  for mismatch in mismatches:
+    print(mismatch)
+  return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -0,0 +1,811 @@
+"""
+Local stand-ins for vSphere and SSH used by the offline benchmarks.
+
+install() registers fake pyVmomi, pyVim, gflags, util.* and cluster.* modules
+so client.py and its helpers import without the real build environment. The
+fakes model a vCenter with one distributed switch, a set of portgroups and
+any number of hosts (created on first use by IP). Every managed object
+property read or method call counts as one SOAP round trip, every SSHClient
+as one SSH session, and each of them sleeps for the configured latency.
+
+Commands sent over SSH are answered from captured esxcli outputs such as
+network_ip_interface_list.xml and ipv4_addr.xml, rendered in the formatter
+the command asks for.
+"""
+
+import csv
+import io
+import json
+import os
+import re
+import sys
+import threading
+import time
+import types
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Injected latencies in seconds.
+LATENCY = {
+  "soap": 0.001,
+  "login": 0.010,
+  "ssh_connect": 0.010,
+  "ssh_command": 0.002,
+}
+
+
+class Counters(object):
+  """
+  Thread safe counters of the calls made to the fakes.
+  """
+  NAMES = ("soap_round_trips", "logins", "ssh_sessions", "ssh_commands",
+           "ssh_transfers")
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    self.reset()
+
+  def reset(self):
+    with self._lock:
+      self.values = dict((name, 0) for name in self.NAMES)
+
+  def inc(self, name):
+    with self._lock:
+      self.values[name] += 1
+
+  def snapshot(self):
+    with self._lock:
+      return dict(self.values)
+
+
+COUNTERS = Counters()
+
+
+def _soap_round_trip():
+  COUNTERS.inc("soap_round_trips")
+  if LATENCY["soap"]:
+    time.sleep(LATENCY["soap"])
+
+
+class _Data(object):
+  """
+  vSphere data object: plain attributes, reading them is free.
+  """
+  def __init__(self, **kwargs):
+    self.__dict__.update(kwargs)
+
+  def __repr__(self):
+    return "%s(%s)" % (type(self).__name__, self.__dict__)
+
+
+# -----------------------------------------------------------------------------
+# Managed objects.
+# -----------------------------------------------------------------------------
+
+class _ManagedObject(object):
+  """
+  Managed object reference bound to a stub. Reading a property of the
+  object it refers to is a SOAP round trip.
+  """
+  def __init__(self, moid, stub, props=None):
+    object.__setattr__(self, "_moId", moid)
+    object.__setattr__(self, "_stub", stub)
+    object.__setattr__(self, "_props", props if props is not None else {})
+
+  def __getattr__(self, name):
+    props = object.__getattribute__(self, "_props")
+    if name.startswith("_") or name not in props:
+      raise AttributeError(name)
+    _soap_round_trip()
+    return _bind(props[name], self._stub)
+
+  def __eq__(self, other):
+    return (isinstance(other, _ManagedObject) and
+            self._moId == other._moId)
+
+  def __ne__(self, other):
+    return not self == other
+
+  def __hash__(self):
+    return hash(self._moId)
+
+  def __repr__(self):
+    return "'%s:%s'" % (type(self).__name__, self._moId)
+
+
+def _bind(value, stub):
+  """
+  Rebinds managed object references found in value to stub.
+  """
+  if isinstance(value, _ManagedObject):
+    return value._rebind(stub)
+  if isinstance(value, list):
+    return [_bind(item, stub) for item in value]
+  return value
+
+
+def _mo_rebind(self, stub):
+  return type(self)(self._moId, stub, self._props)
+
+_ManagedObject._rebind = _mo_rebind
+
+
+class HostSystem(_ManagedObject):
+  pass
+
+
+class DistributedVirtualSwitch(_ManagedObject):
+  pass
+
+
+class DistributedVirtualPortgroup(_ManagedObject):
+  pass
+
+
+class Network(_ManagedObject):
+  pass
+
+
+class Folder(_ManagedObject):
+  pass
+
+
+class Datacenter(_ManagedObject):
+  pass
+
+
+class ComputeResource(_ManagedObject):
+  pass
+
+
+class ContainerView(_ManagedObject):
+  def Destroy(self):
+    _soap_round_trip()
+
+
+class ViewManager(_ManagedObject):
+  def CreateContainerView(self, container, type, recursive):
+    _soap_round_trip()
+    objects = [obj for obj in self._stub.env.all_objects(self._stub)
+               if isinstance(obj, tuple(type))]
+    return ContainerView("view-%d" % id(objects), self._stub,
+                         {"view": objects})
+
+
+class HostNetworkSystem(_ManagedObject):
+  def AddVirtualNic(self, portgroup, nic):
+    _soap_round_trip()
+    # Nested references are not bound to a stub, use the environment.
+    return ENV.add_vnic(self._props["host"], nic)
+
+  def UpdateVirtualNic(self, device, nic):
+    _soap_round_trip()
+    ENV.update_vnic(self._props["host"], device, nic)
+
+  def RemoveVirtualNic(self, device):
+    _soap_round_trip()
+    ENV.remove_vnic(self._props["host"], device)
+
+
+class ServiceInstance(_ManagedObject):
+  def __init__(self, moid, stub, props=None):
+    _ManagedObject.__init__(self, moid, stub, props)
+    self._props.setdefault("content", stub.env.service_content(stub))
+
+  def RetrieveContent(self):
+    _soap_round_trip()
+    return self._props["content"]
+
+  def CurrentTime(self):
+    _soap_round_trip()
+    return time.time()
+
+
+class InvalidProperty(Exception):
+  pass
+
+
+class PropertyCollector(_ManagedObject):
+  """
+  Evaluates the filter specs used by the client against the fake inventory.
+  """
+  TraversalSpec = type("TraversalSpec", (_Data,), {})
+  ObjectSpec = type("ObjectSpec", (_Data,), {})
+  PropertySpec = type("PropertySpec", (_Data,), {})
+  FilterSpec = type("FilterSpec", (_Data,), {})
+  WaitOptions = type("WaitOptions", (_Data,), {})
+
+  def __init__(self, moid, stub, props=None):
+    _ManagedObject.__init__(self, moid, stub, props)
+    object.__setattr__(self, "_filters", [])
+    object.__setattr__(self, "_cancelled", threading.Event())
+
+  def RetrieveContents(self, specs):
+    _soap_round_trip()
+    contents = []
+    for spec in specs:
+      for obj, props in self._evaluate(spec):
+        contents.append(_Data(obj=obj, propSet=[
+            _Data(name=name, val=val) for name, val in props.items()]))
+    return contents
+
+  def CreatePropertyCollector(self):
+    _soap_round_trip()
+    return PropertyCollector("session[%d]" % id(self), self._stub)
+
+  def CreateFilter(self, spec, partialUpdates):
+    _soap_round_trip()
+    self._filters.append(spec)
+
+  def Destroy(self):
+    _soap_round_trip()
+    self._cancelled.set()
+
+  def CancelWaitForUpdates(self):
+    _soap_round_trip()
+    self._cancelled.set()
+
+  def WaitForUpdatesEx(self, version, options=None):
+    _soap_round_trip()
+    env = self._stub.env
+    if version:
+      max_wait = getattr(options, "maxWaitSeconds", None) or 60
+      deadline = time.time() + max_wait
+      with env.changed:
+        while (self._next_change(int(version)) is None and
+               not self._cancelled.is_set() and time.time() < deadline):
+          env.changed.wait(min(0.1, max(0, deadline - time.time())))
+        current = self._next_change(int(version))
+      if self._cancelled.is_set():
+        raise Exception("RequestCanceled")
+      if current is None:
+        return None
+    else:
+      with env.changed:
+        current = env.version
+    object_set = []
+    for spec in self._filters:
+      for obj, props in self._evaluate(spec):
+        object_set.append(_Data(
+            kind="enter" if not version else "modify", obj=obj,
+            changeSet=[_Data(name=name, op="assign", val=val)
+                       for name, val in props.items()]))
+    return _Data(version=str(current), truncated=False,
+                 filterSet=[_Data(objectSet=object_set)])
+
+  def _next_change(self, version):
+    """
+    Returns the first version after version an object a filter starts from
+    changed at, or None. Like vCenter, filters are not woken up by changes
+    of other hosts. Every change is reported by its own update set, however
+    quickly the next one follows, so the number of calls does not depend on
+    when the caller wakes up.
+    """
+    changed_at = self._stub.env.changed_at
+    versions = [changed for spec in self._filters
+                for obj_spec in spec.objectSet
+                for changed in changed_at.get(obj_spec.obj._moId, ())
+                if changed > version]
+    return min(versions) if versions else None
+
+  def _evaluate(self, spec):
+    """
+    Yields (object, props) for the objects and properties selected by spec.
+    """
+    objects = []
+    for obj_spec in spec.objectSet:
+      self._collect(obj_spec.obj, getattr(obj_spec, "selectSet", None) or [],
+                    not getattr(obj_spec, "skip", False), objects)
+    # Objects reached on several paths are reported once.
+    seen = set()
+    for obj in objects:
+      if obj._moId in seen:
+        continue
+      seen.add(obj._moId)
+      for prop_spec in spec.propSet:
+        if isinstance(obj, prop_spec.type):
+          props = {}
+          for path in prop_spec.pathSet:
+            found, value = _resolve_path(obj, path)
+            if found and value is not None:
+              props[path] = _bind(value, self._stub)
+          yield obj, props
+          break
+
+  def _collect(self, obj, select_set, include, objects):
+    if include:
+      objects.append(obj)
+    for traversal in select_set:
+      if isinstance(obj, traversal.type):
+        for child in obj._props.get(traversal.path) or []:
+          self._collect(_bind(child, self._stub),
+                        getattr(traversal, "selectSet", None) or [],
+                        not getattr(traversal, "skip", False), objects)
+
+
+def _resolve_path(obj, path):
+  """
+  Resolves a dotted property path without counting round trips.
+  """
+  names = path.split(".")
+  if names[0] not in obj._props:
+    return (False, None)
+  value = obj._props[names[0]]
+  for name in names[1:]:
+    if value is None:
+      return (True, None)
+    if isinstance(value, _ManagedObject):
+      value = value._props.get(name)
+    elif hasattr(value, name):
+      value = getattr(value, name)
+    else:
+      raise InvalidProperty(path)
+  return (True, value)
+
+
+# -----------------------------------------------------------------------------
+# Inventory.
+# -----------------------------------------------------------------------------
+
+class FakeStub(object):
+  """
+  Connection to the fake vCenter or to one fake host.
+  """
+  def __init__(self, env, host):
+    self.env = env
+    self.host = host
+    self.schemeArgs = {}
+    self.pool = []
+
+  def DropConnections(self):
+    pass
+
+
+class FakeVSphere(object):
+  """
+  A vCenter with one distributed switch, the portgroups below plus
+  extra_portgroups filler portgroups, and hosts created on first use.
+  """
+  # name, backing type, transport zone uuid
+  PORTGROUPS = [
+    ("DPG-HOST-BP", "standard", None),
+    ("DPG-HOST-VXLAM", "nsx", "tz-overlay"),
+    ("DPG-HOST-VLAN", "nsx", "tz-vlan"),
+  ]
+  TRANSPORT_ZONES = [("tz-overlay", "overlay"), ("tz-vlan", "vlan")]
+  SWITCH_UUID = "50 3b 67 f5 e9 7e cd ee-72 3b 23 55 48 7d d3 3b"
+
+  def __init__(self, extra_portgroups=200):
+    self.changed = threading.Condition()
+    self.version = 1
+    # Map of moid to the versions it changed at, in order.
+    self.changed_at = {}
+    self._lock = threading.Lock()
+    self._hosts = {}
+    self.switch = DistributedVirtualSwitch("dvs-1", None,
+                                           {"uuid": self.SWITCH_UUID})
+    self.portgroups = []
+    specs = list(self.PORTGROUPS) + [
+        ("DPG-FILLER-%d" % index, "standard", None)
+        for index in range(extra_portgroups)]
+    for index, (name, backing, tz_uuid) in enumerate(specs):
+      config = _Data(distributedVirtualSwitch=self.switch, backingType=backing,
+                     transportZoneUuid=tz_uuid)
+      self.portgroups.append(DistributedVirtualPortgroup(
+          "dvportgroup-%d" % index, None,
+          {"name": name, "key": "dvportgroup-%d" % index, "config": config}))
+    self.vm_network = Network("network-1", None, {"name": "VM Network"})
+
+  def portgroup(self, name):
+    for portgroup in self.portgroups:
+      if portgroup._props["name"] == name:
+        return portgroup
+    return None
+
+  def host(self, host_ip):
+    """
+    Returns the HostSystem of host_ip, creating it on first use.
+    """
+    with self._lock:
+      host = self._hosts.get(host_ip)
+      if host:
+        return host
+      props = {"name": host_ip}
+      host = HostSystem("host-%d" % (len(self._hosts) + 1), None, props)
+      bp = self.portgroup("DPG-HOST-BP")
+      vnics = [
+        self._make_vnic("vmk0", host_ip, "255.255.240.0", None),
+        self._make_vnic("vmk1", "172.16.%d.1" % (len(self._hosts) % 250),
+                        "255.255.0.0", bp, port_key="%d" % len(self._hosts)),
+      ]
+      proxy_switch = _Data(transportZones=[
+          _Data(uuid=uuid, type=tz_type)
+          for uuid, tz_type in self.TRANSPORT_ZONES])
+      network_info = _Data(vnic=vnics, proxySwitch=[proxy_switch])
+      vnic_manager_info = _Data(netConfig=[_Data(
+          nicType="management", candidateVnic=vnics,
+          selectedVnic=["management.%s" % vnics[0].key])])
+      network_system = HostNetworkSystem(
+          "networkSystem-%s" % host._moId, None,
+          {"networkInfo": network_info, "host": host})
+      props.update({
+        "network": list(self.portgroups) + [self.vm_network],
+        "config": _Data(network=network_info,
+                        virtualNicManagerInfo=vnic_manager_info),
+        "configManager": _Data(networkSystem=network_system),
+        "summary": _Data(managementServerIp="10.0.0.100"),
+        "hardware": _Data(systemInfo=_Data(uuid="uuid-%s" % host_ip)),
+      })
+      self._hosts[host_ip] = host
+      return host
+
+  def _make_vnic(self, device, ip, netmask, portgroup, port_key=None,
+                 external_id=None):
+    dvs_port = None
+    if portgroup is not None:
+      dvs_port = _Data(switchUuid=self.SWITCH_UUID,
+                       portgroupKey=portgroup._props["key"], portKey=port_key)
+    spec = _Data(ip=_Data(ipAddress=ip, subnetMask=netmask),
+                 distributedVirtualPort=dvs_port, externalId=external_id,
+                 mtu=1500, netStackInstanceKey="defaultTcpipStack")
+    return _Data(device=device, key="key-vim.host.VirtualNic-%s" % device,
+                 portgroup="", spec=spec)
+
+  def add_vnic(self, host, nic):
+    network_info = host._props["config"].network
+    with self.changed:
+      used = set(vnic.device for vnic in network_info.vnic)
+      number = 0
+      while "vmk%d" % number in used:
+        number += 1
+      device = "vmk%d" % number
+      for name, default in (("mtu", 1500),
+                            ("netStackInstanceKey", "defaultTcpipStack"),
+                            ("externalId", None)):
+        if not hasattr(nic, name):
+          setattr(nic, name, default)
+      vnic = _Data(device=device, key="key-vim.host.VirtualNic-%s" % device,
+                   portgroup="", spec=nic)
+      nic.distributedVirtualPort.portKey = str(100 + number)
+      network_info.vnic = network_info.vnic + [vnic]
+      self._changed_locked(host)
+    return device
+
+  def update_vnic(self, host, device, nic):
+    network_info = host._props["config"].network
+    with self.changed:
+      vnic = self._find_vnic(network_info, device)
+      for name, value in nic.__dict__.items():
+        if name == "distributedVirtualPort":
+          value.portKey = str(200 + len(network_info.vnic))
+        setattr(vnic.spec, name, value)
+      self._changed_locked(host)
+
+  def remove_vnic(self, host, device):
+    network_info = host._props["config"].network
+    with self.changed:
+      vnic = self._find_vnic(network_info, device)
+      network_info.vnic = [other for other in network_info.vnic
+                           if other is not vnic]
+      self._changed_locked(host)
+
+  @staticmethod
+  def _find_vnic(network_info, device):
+    for vnic in network_info.vnic:
+      if vnic.device == device:
+        return vnic
+    raise Exception("NotFound: %s" % device)
+
+  def _changed_locked(self, host):
+    self.version += 1
+    self.changed_at.setdefault(host._moId, []).append(self.version)
+    self.changed.notify_all()
+
+  def all_objects(self, stub):
+    with self._lock:
+      hosts = list(self._hosts.values())
+    return [_bind(obj, stub) for obj in
+            [self.switch] + self.portgroups + hosts]
+
+  def service_content(self, stub):
+    host = self.host(stub.host) if stub.host != "vcenter" else None
+    compute = ComputeResource("domain-c1", stub, {"host": [host] if host
+                                                  else []})
+    datacenter = Datacenter("datacenter-1", stub, {
+        "hostFolder": Folder("group-h1", stub, {"childEntity": [compute]})})
+    root = Folder("group-d1", stub, {"childEntity": [datacenter]})
+    return _Data(rootFolder=root,
+                 propertyCollector=PropertyCollector("propertyCollector",
+                                                     stub),
+                 viewManager=ViewManager("ViewManager", stub))
+
+  def connect(self, host_ip, user, pwd):
+    COUNTERS.inc("logins")
+    _soap_round_trip()
+    if LATENCY["login"]:
+      time.sleep(LATENCY["login"])
+    self.host(host_ip)
+    return ServiceInstance("ServiceInstance", FakeStub(self, host_ip))
+
+
+class FakeVCenter(object):
+  """
+  Stand-in for the vCenter wrapper returned by esx_dvs_helper.
+  """
+  def __init__(self, env):
+    self.env = env
+    self.stub = FakeStub(env, "vcenter")
+
+  def lookup_host_by_ip(self, host_ip):
+    _soap_round_trip()
+    return _bind(self.env.host(host_ip), self.stub)
+
+
+# -----------------------------------------------------------------------------
+# SSH.
+# -----------------------------------------------------------------------------
+
+def _read(name):
+  with open(os.path.join(REPO_DIR, name)) as fd:
+    return fd.read()
+
+# esxcli commands answered from captured XML output, with the type name of
+# their rows.
+ESXCLI_OUTPUTS = {
+  "network ip interface list": ("network_ip_interface_list.xml",
+                                "NetworkInterface"),
+  "network ip interface ipv4 get": ("ipv4_addr.xml", "IPv4Interface"),
+}
+# Formatters the fake localcli supports.
+ESXCLI_FORMATTERS = set(["xml", "json", "csv"])
+_FORMATTER_RE = re.compile(r"--formatter=(\w+)")
+_rendered = {}
+
+
+def esxcli_columns(name):
+  """
+  Returns the field names of the captured output name, from its
+  meta-data-field.
+  """
+  match = re.search(r'<meta-data-field name="fields:\w+" value="([^"]*)"',
+                    _read(name))
+  return match.group(1).split(",")
+
+
+def esxcli_rows(name):
+  """
+  Returns the rows of the captured output name.
+  """
+  from xml_parse_interface_list import iter_esxcli_structures
+  return list(iter_esxcli_structures(_read(name)))
+
+
+def _xml_value(value):
+  if isinstance(value, bool):
+    return "<boolean>%s</boolean>" % ("true" if value else "false")
+  if isinstance(value, int):
+    return "<integer>%d</integer>" % value
+  return "<string>%s</string>" % (value or "")
+
+
+def _csv_value(value):
+  if isinstance(value, bool):
+    return "true" if value else "false"
+  return "" if value is None else str(value)
+
+
+def render_esxcli(rows, columns, type_name, formatter):
+  """
+  Returns rows, dicts of field name to value, as esxcli prints them with
+  formatter "xml", "json" or "csv".
+  """
+  if formatter == "json":
+    return json.dumps([dict((field.replace(" ", ""), row.get(field))
+                            for field in columns if field in row)
+                       for row in rows])
+  if formatter == "csv":
+    out = io.StringIO()
+    writer = csv.writer(out, lineterminator="\n")
+    writer.writerow([field.replace(" ", "") for field in columns] + [""])
+    for row in rows:
+      writer.writerow([_csv_value(row.get(field)) for field in columns] + [""])
+    return out.getvalue()
+  out = ['<?xml version="1.0"?>\n'
+         '<output xmlns:esxcli="http://www.vmware.com/Products/ESX/5.0/'
+         'esxcli">\n   <meta-data>\n'
+         '      <meta-data-field name="fields:%s" value="%s"/>\n'
+         '   </meta-data>\n   <root>\n      <list type="structure">\n' %
+         (type_name, ",".join(columns))]
+  for row in rows:
+    out.append('            <structure typeName="%s">\n' % type_name)
+    for field in sorted(row):
+      out.append('               <field name="%s">\n                  %s\n'
+                 '               </field>\n' % (field, _xml_value(row[field])))
+    out.append("            </structure>\n")
+  out.append("      </list>\n   </root>\n</output>\n")
+  return "".join(out)
+
+
+def _esxcli_output(command, formatter):
+  key = (command, formatter)
+  if key not in _rendered:
+    name, type_name = ESXCLI_OUTPUTS[command]
+    if formatter == "xml":
+      _rendered[key] = _read(name)
+    else:
+      _rendered[key] = render_esxcli(esxcli_rows(name), esxcli_columns(name),
+                                     type_name, formatter)
+  return _rendered[key]
+
+
+_BATCH_CMD_RE = re.compile(r"echo '@@(\w+) (\d+) OUT'; \( (.*?)\n\) 2>",
+                           re.DOTALL)
+
+
+class FakeSSHClient(object):
+  """
+  SSHClient stand-in replaying captured esxcli outputs.
+  """
+  def __init__(self, host_ip, username, private_key=None, password=None):
+    COUNTERS.inc("ssh_sessions")
+    if LATENCY["ssh_connect"]:
+      time.sleep(LATENCY["ssh_connect"])
+    self.host_ip = host_ip
+
+  def execute(self, cmd, escape_cmd=False, timeout_secs=None):
+    COUNTERS.inc("ssh_commands")
+    if LATENCY["ssh_command"]:
+      time.sleep(LATENCY["ssh_command"])
+    if "@@" in cmd:
+      return self._execute_batch(cmd)
+    return self.respond(cmd)
+
+  def transfer_to(self, src, dst):
+    COUNTERS.inc("ssh_transfers")
+    if LATENCY["ssh_command"]:
+      time.sleep(LATENCY["ssh_command"])
+    return True
+
+  def _execute_batch(self, script):
+    out = []
+    for match in _BATCH_CMD_RE.finditer(script):
+      token, index, cmd = match.group(1), match.group(2), match.group(3)
+      ret, stdout, stderr = self.respond(cmd)
+      out.append("@@%s %s OUT\n%s\n@@%s %s RC %d\n%s\n@@%s %s END\n" %
+                 (token, index, stdout, token, index, ret, stderr, token,
+                  index))
+    return (0, "".join(out), "")
+
+  def respond(self, cmd):
+    cmd = cmd.strip()
+    if cmd == "echo 1":
+      return (0, "1\n", "")
+    if cmd.startswith("md5sum"):
+      return (0, "%s  %s\n" % ("0" * 32, cmd.split()[-1]), "")
+    if "sched group" in cmd:
+      return (0, "", "")
+    if "get_one_time_password.py" in cmd:
+      return (0, json.dumps({"username": "vpxuser",
+                             "password": "otp-%s" % self.host_ip}), "")
+    for command in ESXCLI_OUTPUTS:
+      if command in cmd:
+        match = _FORMATTER_RE.search(cmd)
+        formatter = match.group(1) if match else "xml"
+        if formatter not in ESXCLI_FORMATTERS:
+          return (1, "", "Error: Invalid formatter: %s" % formatter)
+        return (0, _esxcli_output(command, formatter), "")
+    if "esxcfg-vmknic -l" in cmd:
+      from parse_vmknic import cmd_out
+      return (0, cmd_out, "")
+    return (127, "", "sh: %s: not found" % cmd.split()[0])
+
+
+# -----------------------------------------------------------------------------
+# Module registration.
+# -----------------------------------------------------------------------------
+
+ENV = None
+
+
+def _noop(*args, **kwargs):
+  pass
+
+
+def _module(name, **attrs):
+  module = types.ModuleType(name)
+  module.__dict__.update(attrs)
+  sys.modules[name] = module
+  return module
+
+
+class FakeFlags(types.SimpleNamespace):
+  """
+  gflags FLAGS. Calling it parses --name=value arguments of defined flags
+  and returns the other arguments.
+  """
+  def __call__(self, argv):
+    unparsed = []
+    for arg in argv:
+      name, _, value = arg.lstrip("-").partition("=")
+      if arg.startswith("--") and hasattr(self, name):
+        setattr(self, name, type(getattr(self, name))(value))
+      else:
+        unparsed.append(arg)
+    return unparsed
+
+
+def new_environment(extra_portgroups=200):
+  """
+  Replaces the fake vSphere inventory with a fresh one.
+  """
+  global ENV
+  ENV = FakeVSphere(extra_portgroups=extra_portgroups)
+  return ENV
+
+
+def install():
+  """
+  Registers the fake modules in sys.modules. Must run before client.py or
+  any module depending on pyVmomi is imported.
+  """
+  new_environment()
+
+  vim = types.SimpleNamespace(
+    HostSystem=HostSystem,
+    DistributedVirtualSwitch=DistributedVirtualSwitch,
+    Network=Network,
+    ServiceInstance=ServiceInstance,
+    dvs=types.SimpleNamespace(DistributedVirtualPortgroup=
+                              DistributedVirtualPortgroup,
+                              PortConnection=type("PortConnection", (_Data,),
+                                                  {})),
+    host=types.SimpleNamespace(
+        VirtualNic=types.SimpleNamespace(
+            Specification=type("Specification", (_Data,), {})),
+        IpConfig=type("IpConfig", (_Data,), {})),
+    view=types.SimpleNamespace(ContainerView=ContainerView),
+    fault=types.SimpleNamespace(
+        InvalidLogin=type("InvalidLogin", (Exception,), {"msg": ""}),
+        HostConnectFault=type("HostConnectFault", (Exception,), {"msg": ""})),
+  )
+  vmodl = types.SimpleNamespace(query=types.SimpleNamespace(
+      PropertyCollector=PropertyCollector, InvalidProperty=InvalidProperty))
+  _module("pyVmomi", vim=vim, vmodl=vmodl)
+  _module("pyVim")
+  _module("pyVim.connect",
+          SmartConnectNoSSL=lambda user, pwd, host, socketTimeout=None:
+              ENV.connect(host, user, pwd),
+          Disconnect=lambda si: _soap_round_trip())
+
+  flags = FakeFlags(
+    hypervisor_internal_ip="192.168.5.1",
+    hypervisor_username="root",
+    host_ssh_key="/dev/null",
+    default_cvm_password="",
+    nutanix_resource_pool_on_esx="host/user/nutanix",
+    nutanix_resource_pool_size_in_mb=256,
+    nutanix_resource_pool_min_size_in_mb=64,
+    nutanix_resource_pool_min_limit_size_in_mb=64,
+    esx_retry_slot_time_ms=10,
+    esx_retry_max_delay_ms=100,
+    esx_retry_max_retries=3,
+    esx_port_key_external_id_marker="extId:",
+  )
+  _module("env")
+  _module("gflags", FLAGS=flags, DEFINE_string=_noop, DEFINE_integer=_noop,
+          DEFINE_bool=_noop, DEFINE_boolean=_noop)
+  log = types.SimpleNamespace(INFO=_noop, WARNING=_noop, ERROR=_noop,
+                              DEBUG=_noop, FATAL=_noop)
+  for name in ("util", "util.cluster", "util.cluster.consts", "util.hypervisor",
+               "util.hypervisor.base", "util.hypervisor.base.esx_flags",
+               "util.net", "util.misc", "cluster", "cluster.client",
+               "cluster.client.genesis", "cluster.client.genesis.networking"):
+    _module(name)
+  _module("util.base", log=log)
+  _module("util.net.ssh_client", SSHClient=FakeSSHClient)
+  _module("util.hypervisor.esx_host", get_vcenter=lambda *a, **kw:
+          FakeVCenter(ENV))
+  sys.modules["cluster.client"].genesis_utils = _module(
+      "cluster.client.genesis_utils")
+  _module("cluster.client.genesis.networking.esx_dvs_helper",
+          get_vcenter_object=lambda: (True, FakeVCenter(ENV)))
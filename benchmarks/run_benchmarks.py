@@ -0,0 +1,311 @@
+"""
+Offline benchmark suite for the client entry points.
+
+Runs each scenario against the local vSphere and SSH stand-ins in fakes.py at
+several cluster sizes and reports wall time, SOAP round trips, SSH sessions
+and peak Python memory. Results are compared with a stored baseline and
+regressions are reported; the exit status is 1 if any were found.
+
+Usage:
+  python benchmarks/run_benchmarks.py [--hosts 1,8,32,128]
+      [--scenario NAME ...] [--soap-latency-ms 1] [--login-latency-ms 10]
+      [--ssh-connect-latency-ms 10] [--ssh-command-latency-ms 2]
+      [--baseline benchmarks/baseline.json] [--update-baseline]
+      [--metrics metrics.json]
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+import fakes
+fakes.install()
+
+import circuit_breaker
+import client
+import credential_cache
+import esxcli_query
+import fleet_ingest
+import host_inventory
+import instrumentation
+import portgroup_index
+import session_pool
+import singleflight
+import snapshot_store
+import ssh_scheduler
+from fanout import validate_portgroups_on_hosts
+from interface_table import HostInterfaceTable
+from parse_vmknic import cmd_out as vmknic_cmd_out, parse_vmknic_table
+from vnic_reconciler import VnicSpec
+
+DEFAULT_HOSTS = [1, 8, 32, 128]
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, "baseline.json")
+VALIDATE_PORTGROUPS = ["DPG-HOST-VXLAM", "DPG-HOST-BP", "DPG-HOST-VLAN",
+                       "VM Network"]
+EXTERNAL_ID = "e05d2b07-346f-48cc-b3b6-a58e48f92bcd"
+
+STORE_DIR = os.path.join(tempfile.gettempdir(),
+                         "vmware_client_bench_%d" % os.getpid())
+snapshot_store.snapshot_store_path = os.path.join(STORE_DIR, "snapshots.db")
+
+# Wall time and memory may grow by this factor before being reported.
+REGRESSION_TOLERANCE = 1.5
+
+
+def host_ips(num_hosts):
+  return ["10.1.%d.%d" % (index // 250, index % 250 + 1)
+          for index in range(num_hosts)]
+
+
+def reset_process_state():
+  """
+  Drops the process wide caches of the client, so scenarios do not benefit
+  from each other.
+  """
+  with host_inventory._inventories_lock:
+    for inventory in host_inventory._inventories.values():
+      inventory.stop()
+    host_inventory._inventories.clear()
+    host_inventory._inventory_keys_by_ip.clear()
+    host_inventory._inventory_start_locks.clear()
+  if session_pool._session_pool is not None:
+    session_pool._session_pool.close_all()
+  session_pool._session_pool = None
+  if ssh_scheduler._ssh_scheduler is not None:
+    ssh_scheduler._ssh_scheduler.close_all()
+  ssh_scheduler._ssh_scheduler = None
+  credential_cache._credential_cache = None
+  circuit_breaker._host_breakers.clear()
+  portgroup_index._indexes.clear()
+  singleflight._flights.clear()
+  esxcli_query._xml_only.clear()
+  fleet_ingest.shutdown_parse_pool()
+  instrumentation.reset()
+  # Every run starts cold, with an empty snapshot store.
+  snapshot_store.wait_for_refreshes()
+  snapshot_store._fresh.clear()
+  if snapshot_store._snapshot_store is not None:
+    snapshot_store._snapshot_store.close()
+  snapshot_store._snapshot_store = None
+  shutil.rmtree(STORE_DIR, ignore_errors=True)
+  fakes.new_environment()
+
+
+def scenario_connect_with_retries(hosts):
+  # Two objects per host, the second one is served from the session pool.
+  for _ in range(2):
+    for host_ip in hosts:
+      obj = client.BaseEsxHostObject(host_ip)
+      assert obj.is_connected()
+      obj.disconnect()
+
+
+def scenario_get_user_credentials(hosts):
+  for _ in range(2):
+    for host_ip in hosts:
+      assert client.get_user_credentials(host_ip)
+
+
+def scenario_validate_nsx_t_portgroup(hosts):
+  results = list(validate_portgroups_on_hosts(
+      hosts, VALIDATE_PORTGROUPS, validate_func=client.validate_nsx_t_portgroup))
+  assert len(results) == len(hosts) * len(VALIDATE_PORTGROUPS)
+
+
+def scenario_validate_cluster_matrix(hosts):
+  for host_ip in hosts:
+    fakes.ENV.host(host_ip)
+  ret, results = client.validate_nsx_t_portgroups_in_cluster(
+      hosts, VALIDATE_PORTGROUPS)
+  assert ret and len(results) == len(hosts) * len(VALIDATE_PORTGROUPS)
+
+
+def scenario_get_portkey_of_host_interface(hosts):
+  for host_ip in hosts:
+    ret, _ = client.get_portkey_of_host_interface(host_ip, "DPG-HOST-BP")
+    assert ret
+
+
+def scenario_create_vnic(hosts):
+  for index, host_ip in enumerate(hosts):
+    ret, _ = client.create_vnic(host_ip, "172.20.%d.%d" % (index // 250,
+                                                           index % 250 + 1),
+                                "255.255.0.0", "DPG-HOST-VXLAM")
+    assert ret
+
+
+def scenario_reconcile_vnics(hosts):
+  # The second run finds nothing to change.
+  desired = dict((host_ip, [
+      VnicSpec("DPG-HOST-BP", "172.16.%d.1" % (index % 250), "255.255.0.0",
+               mtu=9000),
+      VnicSpec("DPG-HOST-VXLAM", "172.20.%d.%d" % (index // 250,
+                                                   index % 250 + 1),
+               "255.255.0.0")]) for index, host_ip in enumerate(hosts))
+  for expected_changes in (2, 0):
+    for ret, plan in client.reconcile_vnics(desired).values():
+      assert ret and len(plan) == expected_changes
+
+
+def scenario_ingest_fleet_interfaces(hosts):
+  index, stats = client.get_fleet_interface_index(hosts)
+  assert len(index) == len(hosts) and not index.errors
+  assert len(index.lookup("external_id", EXTERNAL_ID)) == len(hosts)
+  assert stats["index"].items == len(hosts)
+
+
+def scenario_parsers(hosts):
+  ssh_client = fakes.FakeSSHClient("parser", "root")
+  _, interface_list_xml, _ = ssh_client.respond(
+      "localcli --formatter=xml network ip interface list")
+  _, ipv4_xml, _ = ssh_client.respond(
+      "localcli --formatter=xml network ip interface ipv4 get")
+  for _ in hosts:
+    table = HostInterfaceTable.from_esxcli_output(interface_list_xml, ipv4_xml)
+    assert table.resolve_external_ids([EXTERNAL_ID])[EXTERNAL_ID]
+    assert parse_vmknic_table(vmknic_cmd_out)
+
+
+SCENARIOS = [
+  ("connect_with_retries", scenario_connect_with_retries),
+  ("get_user_credentials", scenario_get_user_credentials),
+  ("validate_nsx_t_portgroup", scenario_validate_nsx_t_portgroup),
+  ("validate_cluster_matrix", scenario_validate_cluster_matrix),
+  ("get_portkey_of_host_interface", scenario_get_portkey_of_host_interface),
+  ("create_vnic", scenario_create_vnic),
+  ("reconcile_vnics", scenario_reconcile_vnics),
+  ("ingest_fleet_interfaces", scenario_ingest_fleet_interfaces),
+  ("parsers", scenario_parsers),
+]
+
+
+def run_scenario(func, num_hosts):
+  """
+  Runs func on num_hosts fresh hosts and returns its metrics.
+  """
+  reset_process_state()
+  hosts = host_ips(num_hosts)
+  fakes.COUNTERS.reset()
+  tracemalloc.start()
+  start = time.time()
+  try:
+    func(hosts)
+  finally:
+    wall_secs = time.time() - start
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+  counters = fakes.COUNTERS.snapshot()
+  return {
+    "wall_ms": round(wall_secs * 1e3, 1),
+    "soap_round_trips": counters["soap_round_trips"],
+    "ssh_sessions": counters["ssh_sessions"],
+    "peak_kb": peak_bytes // 1024,
+  }
+
+
+def find_regressions(name, result, baseline):
+  """
+  Returns descriptions of the metrics in result that regressed against
+  baseline. Round trips and sessions must not grow at all.
+  """
+  regressions = []
+  if not baseline:
+    return regressions
+  for metric in ("soap_round_trips", "ssh_sessions"):
+    if result[metric] > baseline.get(metric, result[metric]):
+      regressions.append("%s %s: %s > baseline %s" %
+                         (name, metric, result[metric], baseline[metric]))
+  for metric in ("wall_ms", "peak_kb"):
+    limit = baseline.get(metric, result[metric]) * REGRESSION_TOLERANCE
+    if result[metric] > limit:
+      regressions.append("%s %s: %s > %.1fx baseline %s" %
+                         (name, metric, result[metric], REGRESSION_TOLERANCE,
+                          baseline[metric]))
+  return regressions
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+  parser.add_argument("--hosts", default=",".join(map(str, DEFAULT_HOSTS)),
+                      help="Comma separated cluster sizes")
+  parser.add_argument("--scenario", action="append",
+                      choices=[name for name, _ in SCENARIOS],
+                      help="Scenario to run, may be repeated (default all)")
+  parser.add_argument("--soap-latency-ms", type=float, default=1)
+  parser.add_argument("--login-latency-ms", type=float, default=10)
+  parser.add_argument("--ssh-connect-latency-ms", type=float, default=10)
+  parser.add_argument("--ssh-command-latency-ms", type=float, default=2)
+  parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+  parser.add_argument("--update-baseline", action="store_true",
+                      help="Store the results as the new baseline")
+  parser.add_argument("--metrics",
+                      help="Enable instrumentation and write the metrics of "
+                      "every run to this JSON file")
+  args = parser.parse_args(argv)
+
+  fakes.LATENCY.update({
+    "soap": args.soap_latency_ms / 1e3,
+    "login": args.login_latency_ms / 1e3,
+    "ssh_connect": args.ssh_connect_latency_ms / 1e3,
+    "ssh_command": args.ssh_command_latency_ms / 1e3,
+  })
+  sizes = [int(size) for size in args.hosts.split(",")]
+  selected = [(name, func) for name, func in SCENARIOS
+              if not args.scenario or name in args.scenario]
+
+  baseline = {}
+  if os.path.exists(args.baseline):
+    with open(args.baseline) as fd:
+      baseline = json.load(fd)
+
+  if args.metrics:
+    instrumentation.enable()
+  metrics = {}
+  results = {}
+  regressions = []
+  print("%-32s %6s %10s %10s %8s %9s" % ("scenario", "hosts", "wall ms",
+                                         "soap rt", "ssh", "peak kB"))
+  for name, func in selected:
+    for size in sizes:
+      key = "%s/%d" % (name, size)
+      result = run_scenario(func, size)
+      results[key] = result
+      if args.metrics:
+        metrics[key] = instrumentation.export_json()
+      print("%-32s %6d %10.1f %10d %8d %9d" % (
+          name, size, result["wall_ms"], result["soap_round_trips"],
+          result["ssh_sessions"], result["peak_kb"]))
+      regressions.extend(find_regressions(key, result, baseline.get(key)))
+  reset_process_state()
+  shutil.rmtree(STORE_DIR, ignore_errors=True)
+
+  if args.metrics:
+    with open(args.metrics, "w") as fd:
+      json.dump(metrics, fd, indent=2, sort_keys=True)
+      fd.write("\n")
+  if args.update_baseline:
+    baseline.update(results)
+    with open(args.baseline, "w") as fd:
+      json.dump(baseline, fd, indent=2, sort_keys=True)
+      fd.write("\n")
+    print("Baseline written to %s" % args.baseline)
+    return 0
+  if regressions:
+    print("\nRegressions against %s:" % args.baseline)
+    for regression in regressions:
+      print("  " + regression)
+    return 1
+  return 0
+
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -0,0 +1,106 @@
+"""
+Process wide circuit breakers, one per ESXi host.
+
+When a host keeps failing, every caller used to go through the full connect
+retry schedule before giving up. The breaker for the host opens after
+failure_threshold consecutive failures and callers then fail immediately.
+After reset_timeout_secs a single caller is let through as a probe, and its
+outcome decides whether the breaker closes again or stays open.
+"""
+
+import threading
+import time
+
+__all__ = [
+    "CircuitBreaker",
+    "get_host_circuit_breaker",
+]
+
+# Consecutive failures after which a host's breaker opens.
+circuit_breaker_failure_threshold = 5
+# Time an open breaker rejects callers before letting a probe through.
+circuit_breaker_reset_timeout_secs = 30
+
+
+class CircuitBreaker(object):
+  """
+  Thread safe closed / open / half open circuit breaker.
+  """
+  CLOSED = "closed"
+  OPEN = "open"
+  HALF_OPEN = "half_open"
+
+  def __init__(self, failure_threshold=circuit_breaker_failure_threshold,
+               reset_timeout_secs=circuit_breaker_reset_timeout_secs):
+    self.failure_threshold = failure_threshold
+    self.reset_timeout_secs = reset_timeout_secs
+    self._lock = threading.Lock()
+    self._state = self.CLOSED
+    self._failures = 0
+    self._opened_at = 0
+    self._probe_started_at = None
+
+  @property
+  def state(self):
+    with self._lock:
+      return self._state
+
+  def allow(self):
+    """
+    Returns True if the caller may talk to the host.
+
+    While the breaker is open this returns False until reset_timeout_secs
+    passed, then True for exactly one caller, the probe. A probe that does
+    not report back within reset_timeout_secs is replaced by a new one.
+    """
+    with self._lock:
+      if self._state == self.CLOSED:
+        return True
+      now = time.time()
+      if self._state == self.OPEN:
+        if now - self._opened_at < self.reset_timeout_secs:
+          return False
+        self._state = self.HALF_OPEN
+        self._probe_started_at = now
+        return True
+      # Half open, a probe is in flight.
+      if now - self._probe_started_at < self.reset_timeout_secs:
+        return False
+      self._probe_started_at = now
+      return True
+
+  def is_open(self):
+    """
+    Returns True while callers are being rejected.
+    """
+    return self.state != self.CLOSED
+
+  def record_success(self):
+    with self._lock:
+      self._state = self.CLOSED
+      self._failures = 0
+      self._probe_started_at = None
+
+  def record_failure(self):
+    with self._lock:
+      self._failures += 1
+      if (self._state == self.HALF_OPEN or
+          self._failures >= self.failure_threshold):
+        self._state = self.OPEN
+        self._opened_at = time.time()
+        self._probe_started_at = None
+
+
+_host_breakers = {}
+_host_breakers_lock = threading.Lock()
+
+def get_host_circuit_breaker(host_ip):
+  """
+  Returns the process wide CircuitBreaker of host_ip.
+  """
+  with _host_breakers_lock:
+    breaker = _host_breakers.get(host_ip)
+    if breaker is None:
+      breaker = CircuitBreaker()
+      _host_breakers[host_ip] = breaker
+    return breaker
@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+"""
+Command line entry point of the client.
+
+Usage:
+  cli.py validate --host IP [--host IP ...] [--deadline-secs N] [--vcenter]
+      PORTGROUP...
+  cli.py resolve-external-id [--host IP]
+      [--interface-list-xml FILE --ipv4-xml FILE] EXTERNAL_ID...
+  cli.py list-vmknics [--host IP] [--file FILE] [--port-key KEY]
+
+Every subcommand takes --json to print machine readable output. Only validate
+talks to hostd and imports pyVmomi, resolve-external-id and list-vmknics run
+commands over ssh, or parse local command output if files are given.
+validate --vcenter validates all hosts with one vCenter query. Host
+state is served from the snapshot store when available. gflags such as
+--hypervisor_internal_ip and --host_ssh_key are accepted in --name=value
+form. The exit status is 0 if everything asked for was found or valid, 1
+otherwise.
+"""
+
+import argparse
+import json
+import sys
+
+VMKNIC_LIST_CMD = "esxcfg-vmknic -l"
+# Longest the cli waits on exit for the snapshot store refreshes started by
+# serving stored host state.
+REFRESH_WAIT_SECS = 15
+
+
+def _ssh_client(host_ip):
+  """
+  Returns an ssh client to host_ip, the local host if host_ip is None.
+  """
+  from client import FLAGS, new_ssh_client
+  from ssh_scheduler import PRIORITY_DIAGNOSTICS
+  host_ip = host_ip or FLAGS.hypervisor_internal_ip
+  return new_ssh_client(host_ip, priority=PRIORITY_DIAGNOSTICS,
+                        private_key=FLAGS.host_ssh_key)
+
+
+def _read(path):
+  with open(path) as fd:
+    return fd.read()
+
+
+def cmd_validate(args):
+  if args.vcenter:
+    from client import validate_nsx_t_portgroups_in_cluster
+    ret, validated = validate_nsx_t_portgroups_in_cluster(args.host,
+                                                          args.portgroup)
+    if not ret:
+      sys.stderr.write("%s\n" % validated)
+      return 1
+  else:
+    from client import validate_nsx_t_portgroup
+    from fanout import validate_portgroups_on_hosts
+    validated = validate_portgroups_on_hosts(
+        args.host, args.portgroup, validate_func=validate_nsx_t_portgroup,
+        deadline_secs=args.deadline_secs)
+
+  results = []
+  for host_ip, portgroup, ret, msg in validated:
+    results.append({"host": host_ip, "portgroup": portgroup, "valid": ret,
+                    "message": msg})
+  results.sort(key=lambda result: (result["host"], result["portgroup"]))
+  if args.json:
+    print(json.dumps(results, indent=2))
+  else:
+    for result in results:
+      print("%s %s %s %s" % (result["host"], result["portgroup"],
+                             "valid" if result["valid"] else "invalid",
+                             result["message"] or ""))
+  return 0 if all(result["valid"] for result in results) else 1
+
+
+def cmd_resolve_external_id(args):
+  from interface_table import HostInterfaceTable
+
+  if args.interface_list_xml or args.ipv4_xml:
+    if not (args.interface_list_xml and args.ipv4_xml):
+      sys.stderr.write("--interface-list-xml and --ipv4-xml go together\n")
+      return 2
+    table = HostInterfaceTable.from_esxcli_files(args.interface_list_xml,
+                                                 args.ipv4_xml)
+  else:
+    from client import FLAGS, get_host_interface_table
+    ret, table = get_host_interface_table(
+        args.host or FLAGS.hypervisor_internal_ip)
+    if not ret:
+      sys.stderr.write("%s\n" % table)
+      return 1
+
+  resolved = table.resolve_external_ids(args.external_id)
+  if args.json:
+    print(json.dumps(dict(
+        (external_id, dict(zip(("device", "address", "netmask"), value))
+         if value else None)
+        for external_id, value in resolved.items()), indent=2))
+  else:
+    for external_id in args.external_id:
+      value = resolved[external_id]
+      print("%s %s" % (external_id,
+                       " ".join(str(v) for v in value) if value
+                       else "not found"))
+  return 0 if all(resolved.values()) else 1
+
+
+def cmd_list_vmknics(args):
+  from parse_vmknic import parse_vmknic_table
+
+  if args.file:
+    cmd_out = _read(args.file)
+  else:
+    ret, cmd_out, err = _ssh_client(args.host).execute(VMKNIC_LIST_CMD)
+    if ret != 0:
+      sys.stderr.write("%s failed, ret %s err %s\n" % (VMKNIC_LIST_CMD, ret,
+                                                       err))
+      return 1
+
+  try:
+    index = parse_vmknic_table(cmd_out)
+  except ValueError as ex:
+    sys.stderr.write("%s\n" % ex)
+    return 1
+  if args.port_key is not None:
+    index = {args.port_key: index.get(args.port_key, [])}
+  records = [record for port_key in sorted(index)
+             for record in index[port_key]]
+  if args.json:
+    print(json.dumps([record._asdict() for record in records], indent=2))
+  else:
+    for record in records:
+      print("%s %s %s %s/%s mtu %s %s" % (
+          record.interface, record.port_key, record.ip_family,
+          record.ip_address, record.netmask, record.mtu, record.netstack))
+  return 0 if records else 1
+
+
+def build_parser():
+  parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+  subparsers = parser.add_subparsers(dest="command")
+  subparsers.required = True
+
+  validate = subparsers.add_parser(
+      "validate", help="Validate NSX-T portgroups on hosts")
+  validate.add_argument("--host", action="append", required=True,
+                        help="Host IP, may be repeated")
+  validate.add_argument("--deadline-secs", type=float,
+                        help="Overall time budget of the validation")
+  validate.add_argument("--vcenter", action="store_true",
+                        help="Validate all hosts with one vCenter query "
+                        "instead of connecting to every host")
+  validate.add_argument("portgroup", nargs="+")
+  validate.set_defaults(func=cmd_validate)
+
+  resolve = subparsers.add_parser(
+      "resolve-external-id",
+      help="Resolve interface External IDs to vmk devices and addresses")
+  resolve.add_argument("--host", help="Host IP, defaults to the local host")
+  resolve.add_argument("--interface-list-xml",
+                       help="Output of 'localcli --formatter=xml network ip "
+                       "interface list' to use instead of ssh, json and csv "
+                       "output are accepted too")
+  resolve.add_argument("--ipv4-xml",
+                       help="Output of 'localcli --formatter=xml network ip "
+                       "interface ipv4 get' to use instead of ssh, json and "
+                       "csv output are accepted too")
+  resolve.add_argument("external_id", nargs="+")
+  resolve.set_defaults(func=cmd_resolve_external_id)
+
+  vmknics = subparsers.add_parser("list-vmknics",
+                                  help="List the vmkernel NICs of a host")
+  vmknics.add_argument("--host", help="Host IP, defaults to the local host")
+  vmknics.add_argument("--file",
+                       help="Output of '%s' to use instead of ssh" %
+                       VMKNIC_LIST_CMD)
+  vmknics.add_argument("--port-key",
+                       help="Only list the NICs on this port or portgroup")
+  vmknics.set_defaults(func=cmd_list_vmknics)
+
+  for subparser in (validate, resolve, vmknics):
+    subparser.add_argument("--json", action="store_true",
+                           help="Print JSON")
+  return parser
+
+
+def _parse_flags(parser, argv):
+  """
+  Parses the gflags in argv, e.g. --hypervisor_internal_ip=IP, so the ssh
+  paths read their command line values from FLAGS. Exits on arguments
+  neither argparse nor gflags knows.
+  """
+  from client import FLAGS
+  try:
+    unparsed = FLAGS([sys.argv[0]] + argv)[1:]
+  except Exception as ex:
+    parser.error(str(ex))
+  if unparsed:
+    parser.error("unrecognized arguments: %s" % " ".join(unparsed))
+
+
+def main(argv=None):
+  parser = build_parser()
+  args, flag_argv = parser.parse_known_args(argv)
+  _parse_flags(parser, flag_argv)
+  from snapshot_store import wait_for_refreshes
+  try:
+    return args.func(args)
+  finally:
+    # Otherwise the daemon refresh threads die with the process, and the
+    # next run is served the same stale snapshots again.
+    wait_for_refreshes(REFRESH_WAIT_SECS)
+
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -1,46 +1,79 @@
 #!/usr/bin/env python
 
 import env
-import gflags
 import json
 import os
-from pyVmomi import vim
 import re
 import socket
+import time
 
-from util.base import log
-# For FLAGS host_ssh_key, hypervisor_internal_ip, hypervisor_username.
-import util.cluster.consts   # pylint: disable=unused-import
-import util.hypervisor.base.esx_flags  # pylint: disable=unused-import
-from util.misc.retry import retry_with_exp_backoff
-from util.net.ssh_client import SSHClient
-from util.hypervisor.esx_host import get_vcenter
-from util.hypervisor.esx_utils import EsxHostObject
-from cluster.client import genesis_utils
-from cluster.client.genesis.networking import esx_dvs_helper as helper
-
-FLAGS = gflags.FLAGS
-pyvmomi_socket_timeout_secs = 300
+from circuit_breaker import get_host_circuit_breaker
+from cluster_validation import retrieve_validation_matrix
+from credential_cache import file_md5sum, get_credential_cache
+from esxcli_batch import execute_batch
+from fleet_ingest import ingest_interface_tables
+from host_inventory import (find_host_network_inventory,
+                            get_host_network_inventory)
+from host_network import (retrieve_host_network_snapshot, snapshot_from_dict,
+                          snapshot_to_dict, validate_portgroup_in_snapshot)
+from instrumentation import (instrument_ssh_client, instrument_stub, record,
+                             timed)
+from interface_table import (HostInterfaceTable, fetch_host_interface_outputs,
+                             fetch_host_interface_table)
+from lazy_import import LazyImport
+from liveness import Keepalive, LivenessProbe, set_stub_timeout, stub_timeout
+from portgroup_index import get_portgroup_index
+from records import vnic_record_from_dict
+from retry import RetryBudget, is_transient_error, retry_with_deadline
+from session_pool import credentials_fingerprint, get_session_pool
+from singleflight import coalesce
+from snapshot_store import (SECTION_INTERFACES, SECTION_NETWORK, SECTION_VNICS,
+                            get_snapshot_store, save_snapshot, serve_stored)
+from ssh_scheduler import (PRIORITY_CREDENTIALS, PRIORITY_DEFAULT,
+                           ScheduledSSHClient)
+from vnic_reconciler import (ACTION_ADD, apply_vnic_changes,
+                             build_virtual_nic_spec, plan_vnic_changes)
+
+# pyVmomi, gflags and the util and cluster packages are imported on first use,
+# importing this module has no side effects.
+# util.cluster.consts and esx_flags define FLAGS host_ssh_key,
+# hypervisor_internal_ip and hypervisor_username.
+FLAGS = LazyImport("gflags", "FLAGS",
+                   setup=("util.cluster.consts",
+                          "util.hypervisor.base.esx_flags"))
+log = LazyImport("util.base", "log")
+vim = LazyImport("pyVmomi", "vim")
+SSHClient = LazyImport("util.net.ssh_client", "SSHClient")
+helper = LazyImport("cluster.client.genesis.networking.esx_dvs_helper")
+
+# Socket timeout of the TCP and TLS handshake and the login calls.
+pyvmomi_connect_timeout_secs = 15
+# Socket timeout of every other SOAP call, unless the operation sets its own.
+pyvmomi_read_timeout_secs = 120
+# Socket timeout of the single RetrieveContents() of a network snapshot.
+pyvmomi_retrieve_timeout_secs = 60
+# Socket timeout of host network reconfiguration, e.g. AddVirtualNic().
+pyvmomi_reconfigure_timeout_secs = 300
+# Stored network snapshots older than this are not used for validation, they
+# may predate a change of the transport zone of a portgroup.
+validation_snapshot_max_age_secs = 300
+# Longest reconcile_vnics() waits for the host inventory to show its changes.
+vnic_reconcile_settle_secs = 10
+# Overall time budget of connect_with_retries(), across all attempts.
+esx_connect_deadline_secs = 600
+# Retry budget shared by all connect_with_retries() callers in the process,
+# so that a rack coming back does not get hit by every caller in lockstep.
+esx_connect_retry_budget = RetryBudget(rate_per_sec=2, burst=20)
 '''
 gflags.DEFINE_string(
         "esx_port_key_external_id_marker",
         "extId:",
         "String identifier for external ID")
 '''
-def get_user_credentials(host_ip=None):
+def get_otp_script_path():
   """
-  User credentials for the object.
+  Returns the local path of get_one_time_password.py.
   """
-  host_ip = host_ip or FLAGS.hypervisor_internal_ip
-  ssh_client = SSHClient(host_ip, FLAGS.hypervisor_username,
-                         private_key=FLAGS.host_ssh_key)
-  ret, stdout, stderr = ssh_client.execute("echo 1")
-  if ret != 0:
-    log.WARNING("Failed creating ssh client with key, attempting with "
-                "default password, stdout %s stderr %s" % (stdout, stderr))
-    ssh_client = SSHClient(host_ip, FLAGS.hypervisor_username,
-                           password=FLAGS.default_cvm_password)
-
   # Derive relative path to the OTP script. This is required during upgrade
   # where we need to pick otp script from data installer directory.
   pattern = re.compile("/home/nutanix/data/installer/.*?/")
@@ -49,17 +82,107 @@ def get_user_credentials(host_ip=None):
 
   if match:
     egg_path = filepath[:match.end()]
-    otp_path = os.path.join(egg_path, "lib/esx5/get_one_time_password.py")
-  else:
-    # Pick default path
-    otp_path = "/home/nutanix/cluster/lib/esx5/get_one_time_password.py"
+    return os.path.join(egg_path, "lib/esx5/get_one_time_password.py")
+  # Pick default path
+  return "/home/nutanix/cluster/lib/esx5/get_one_time_password.py"
+
+def get_otp_md5sum_cmd(otp_path):
+  """
+  Returns the command printing the md5sum of the OTP script on the host.
+  """
+  return "md5sum %s" % os.path.join("/", os.path.basename(otp_path))
+
+def transfer_otp_script(ssh_client, otp_path, md5sum_result=None):
+  """
+  Copies the OTP script to the host unless the copy already on the host has
+  the same md5sum.
 
+  md5sum_result is the (ret, stdout, stderr) of get_otp_md5sum_cmd() if the
+  caller already ran it, e.g. as part of a batch.
+  """
+  try:
+    local_md5 = file_md5sum(otp_path)
+  except (IOError, OSError) as ex:
+    log.WARNING("Unable to checksum %s: %s" % (otp_path, ex))
+    local_md5 = None
+  if local_md5:
+    if md5sum_result is None:
+      md5sum_result = ssh_client.execute(get_otp_md5sum_cmd(otp_path))
+    ret, out, _ = md5sum_result
+    if ret == 0 and out.split() and out.split()[0] == local_md5:
+      log.INFO("OTP script on host is up to date, skipping upload")
+      return
   ssh_client.transfer_to(otp_path, "/")
+
+def new_ssh_client(host_ip, priority=PRIORITY_DEFAULT, **kwargs):
+  """
+  Returns an SSHClient to host_ip running its commands through the process
+  wide SSH scheduler with priority, on persistent sessions shared with other
+  clients using the same credentials. Sessions are instrumented if
+  instrumentation is enabled.
+  """
+  username = FLAGS.hypervisor_username
+  def connect():
+    return instrument_ssh_client(SSHClient(host_ip, username, **kwargs),
+                                 host_ip)
+  key = (username,) + tuple(sorted(kwargs.items()))
+  return ScheduledSSHClient(host_ip, key, connect, priority=priority)
+
+def get_user_credentials(host_ip=None, use_cache=True):
+  """
+  User credentials for the object.
+
+  Credentials are served from the process wide credential cache while they
+  are valid, unless use_cache is False. The ssh probe, the OTP script
+  checksum and the resource pool commands are sent as one batch.
+  """
+  host_ip = host_ip or FLAGS.hypervisor_internal_ip
+  cache = get_credential_cache()
+  if use_cache:
+    cached = cache.get(host_ip)
+    if cached:
+      record("otp", host_ip, "get_user_credentials", "cache_hit")
+      return cached
+
+  with timed("otp", host_ip, "get_user_credentials") as timer:
+    credentials = fetch_user_credentials(host_ip)
+    if not credentials:
+      timer.set_outcome("error")
+  if credentials and use_cache:
+    cache.put(host_ip, credentials)
+  return credentials
+
+@coalesce("fetch_user_credentials")
+def fetch_user_credentials(host_ip):
+  """
+  Fetches one time password credentials of host_ip over ssh.
+
+  Returns the credentials dict, or None on failure.
+  """
+  otp_path = get_otp_script_path()
   rsc_group = FLAGS.nutanix_resource_pool_on_esx
   mem_limit = FLAGS.nutanix_resource_pool_size_in_mb
   mem_min = FLAGS.nutanix_resource_pool_min_size_in_mb
   min_limit = FLAGS.nutanix_resource_pool_min_limit_size_in_mb
-  if create_ntnx_rsc_pool(rsc_group, mem_limit, mem_min, min_limit, ssh_client):
+  list_cmd, _, setmemconfig_cmd = get_ntnx_rsc_pool_cmds(
+      rsc_group, mem_limit, mem_min, min_limit)
+  prep_cmds = ["echo 1", get_otp_md5sum_cmd(otp_path), list_cmd,
+               setmemconfig_cmd]
+
+  ssh_client = new_ssh_client(host_ip, priority=PRIORITY_CREDENTIALS,
+                              private_key=FLAGS.host_ssh_key)
+  results = execute_batch(ssh_client, prep_cmds)
+  ret, stdout, stderr = results[0]
+  if ret != 0:
+    log.WARNING("Failed creating ssh client with key, attempting with "
+                "default password, stdout %s stderr %s" % (stdout, stderr))
+    ssh_client = new_ssh_client(host_ip, priority=PRIORITY_CREDENTIALS,
+                                password=FLAGS.default_cvm_password)
+    results = execute_batch(ssh_client, prep_cmds)
+
+  transfer_otp_script(ssh_client, otp_path, md5sum_result=results[1])
+  if create_ntnx_rsc_pool(rsc_group, mem_limit, mem_min, min_limit, ssh_client,
+                          prefetched_results=results[2:]):
     log.INFO("Using nutanix resource pool %s to run "
                 "get_one_time_password.py" % rsc_group)
     cmd = ("USER=vpxuser python ++group=%s /get_one_time_password.py" %
@@ -72,42 +195,56 @@ def get_user_credentials(host_ip=None):
     log.ERROR("Unable to execute OTP command ret %s out %s err %s" %
               (ret, out, err))
     return None
-  dict = json.loads(out)
-  return dict
+  return json.loads(out)
+
+def get_ntnx_rsc_pool_cmds(rsc_group, mem_limit, mem_min, min_limit):
+  """
+  Returns the (list, add, setmemconfig) commands for the resource pool.
+  """
+  list_cmd = ("localcli --plugin-dir /usr/lib/vmware/esxcli/int sched group "
+              "list -g %s -l 1" % rsc_group)
+  (parent_group, _, name) = rsc_group.rpartition("/")
+  add_cmd = ("localcli --plugin-dir /usr/lib/vmware/esxcli/int sched group add "
+             "-g %s -n %s" % (parent_group, name))
+  setmemconfig_cmd = ("localcli --plugin-dir=/usr/lib/vmware/esxcli/int sched "
+                      "group setmemconfig -g %s --max %s --min %s --minlimit "
+                      "%s -u mb" % (rsc_group, mem_limit, mem_min, min_limit))
+  return (list_cmd, add_cmd, setmemconfig_cmd)
 
-def create_ntnx_rsc_pool(rsc_group, mem_limit, mem_min, min_limit, ssh_client):
+def create_ntnx_rsc_pool(rsc_group, mem_limit, mem_min, min_limit, ssh_client,
+                         prefetched_results=None):
   """
   Creates resource pool on ESX to execute scripts and commands.
 
   If we fail to set memory limits, we are marking it as failure. Using a pool
   without limits would cause more harm with runaway scripts or commands.
+
+  The list and setmemconfig commands are sent in one batch. If the caller
+  already ran them, their results are passed in prefetched_results.
   Returns:
     False - failed to create resource pool or failed to set memory limit
     True  - otherwise
   """
-  # Check if the pool already exists
-  cmd = ("localcli --plugin-dir /usr/lib/vmware/esxcli/int sched group list "
-         "-g %s -l 1" % rsc_group)
-  ret, out, err = ssh_client.execute(cmd)
+  list_cmd, add_cmd, setmemconfig_cmd = get_ntnx_rsc_pool_cmds(
+      rsc_group, mem_limit, mem_min, min_limit)
+  # Check if the pool already exists, and set its limits assuming it does.
+  if prefetched_results is None:
+    prefetched_results = execute_batch(ssh_client, [list_cmd, setmemconfig_cmd])
+  (ret, out, err), setmemconfig_result = prefetched_results
   if ret != 0:
     # Pool doesn't exist
     log.ERROR("Unable to fetch nutanix resource pool, ret %s out %s err %s" %
               (ret, out, err))
     log.INFO("Creating default nutanix resource pool %s on ESX" % rsc_group)
-    (parent_group, _, name) = rsc_group.rpartition("/")
-    cmd = ("localcli --plugin-dir /usr/lib/vmware/esxcli/int sched group add "
-          "-g %s -n %s" % (parent_group, name))
-    ret, out, err = ssh_client.execute(cmd)
+    (ret, out, err), setmemconfig_result = execute_batch(
+        ssh_client, [add_cmd, setmemconfig_cmd])
     if ret != 0:
       log.ERROR("Failed to create nutanix resource pool, ret %s out %s err %s" %
                 (ret, out, err))
       return False
 
-  # Set memory limits on the resource pool
-  cmd = ("localcli --plugin-dir=/usr/lib/vmware/esxcli/int sched group "
-         "setmemconfig -g %s --max %s --min %s --minlimit %s -u mb" %
-         (rsc_group, mem_limit, mem_min, min_limit))
-  ret, out, err = ssh_client.execute(cmd)
+  # Memory limits on the resource pool
+  ret, out, err = setmemconfig_result
   if ret != 0:
     log.ERROR("Failed to set memory limits (min, max, minlimt) of (%s, %s, %s) "
               "on ESX resource pool %s, ret %s out %s err %s" %
@@ -115,24 +252,60 @@ def create_ntnx_rsc_pool(rsc_group, mem_limit, mem_min, min_limit, ssh_client):
     return False
   return True
 
+def is_transient_connect_error(error, explicit_credentials=False):
+  """
+  Returns True if a connection attempt that failed with error is worth
+  retrying. error is None when the attempt failed before talking to hostd,
+  e.g. because credentials could not be fetched. InvalidLogin is only worth
+  retrying with one time password credentials, which are fetched again.
+  """
+  if error is None:
+    return True
+  if isinstance(error, vim.fault.InvalidLogin):
+    return not explicit_credentials
+  if isinstance(error, vim.fault.HostConnectFault):
+    # Host is busy.
+    return True
+  return is_transient_error(error)
+
+def _keepalive_failed(host_ip):
+  """
+  Returns the Keepalive on_dead callback of a session to host_ip. It does
+  not reference the host object, so the object can still be collected.
+  """
+  def on_dead():
+    log.WARNING("Keepalive probe of host %s failed, session is dead" %
+                host_ip)
+  return on_dead
+
 class BaseEsxHostObject(object):
   """
   Returns Esx Host object after connecting with pyvim interface.
   """
-  def __init__(self, host_ip, user=None, password=None):
+  def __init__(self, host_ip, user=None, password=None, use_session_pool=True,
+               keepalive_secs=None):
     """
     Initializes the object and connects with Present host objects.
+
+    If use_session_pool is True, the service instance is borrowed from the
+    process wide session pool and returned to it on disconnect, instead of
+    logging in and out for every object. If keepalive_secs is set, the
+    session is probed in the background at that interval while connected,
+    for long lived objects.
     """
     self.user = user
     self.password = password
     self.host_ip = host_ip
     self.host_obj = None
+    self.session_pool = get_session_pool() if use_session_pool else None
 
     self.service_instance = None
-    self.service_content = None
-    self.datacenter = None
-    self.compute_resource = None
+    self.property_collector = None
     self.vim_connection_error = None
+    self.connect_deadline = None
+    self.keepalive_secs = keepalive_secs
+    self.liveness = None
+    self.keepalive = None
     self.connect_with_retries()
 
   def __del__(self):
@@ -157,16 +330,17 @@ class BaseEsxHostObject(object):
 
   def set_host_params(self):
     """
-    Once connection made, fill other params as datacenter, compute resources.
+    Once connection made, find the host object and the property collector.
+    The service content, datacenter and compute resource are not kept.
     """
     try:
       if self.is_socket_open():
-        self.service_content = self.service_instance.content
-        self.datacenter = (
-            self.service_instance.content.rootFolder.childEntity[0])
-        self.compute_resource = self.datacenter.hostFolder.childEntity[0]
-        if self.compute_resource.host:
-          self.host_obj = self.compute_resource.host[0]
+        content = self.service_instance.content
+        self.property_collector = content.propertyCollector
+        datacenter = content.rootFolder.childEntity[0]
+        compute_resource = datacenter.hostFolder.childEntity[0]
+        if compute_resource.host:
+          self.host_obj = compute_resource.host[0]
     except Exception as ee:
       log.ERROR("Initializing host failed %s" % ee)
       return False
@@ -178,60 +352,147 @@ class BaseEsxHostObject(object):
      None
 
     This function is a wrapper on connect function for retrying attempts to
-    connect to the hypervisor.
+    connect to the hypervisor. Every attempt is reported to the circuit
+    breaker of the host; while it is open no attempt is made.
 
     Returns:
      False: when connection is unnsuccessful even after the retries.
      True: when connection is successful to the hypervisor.
     """
-    for _ in retry_with_exp_backoff(
-            slot_time_ms=FLAGS.esx_retry_slot_time_ms,
-            max_delay_ms=FLAGS.esx_retry_max_delay_ms,
-            max_retries=FLAGS.esx_retry_max_retries):
-      log.INFO("Attempting to connect to host with IP %s" % self.host_ip)
+    breaker = get_host_circuit_breaker(self.host_ip)
+    if not breaker.allow():
+      log.ERROR("Host with IP %s is failing, circuit breaker is %s, not "
+                "connecting" % (self.host_ip, breaker.state))
+      record("retry", self.host_ip, "connect", "circuit_open")
+      return False
+    self.connect_deadline = time.time() + esx_connect_deadline_secs
+    try:
+      for _ in retry_with_deadline(
+              base_delay_ms=FLAGS.esx_retry_slot_time_ms,
+              max_delay_ms=FLAGS.esx_retry_max_delay_ms,
+              max_retries=FLAGS.esx_retry_max_retries,
+              deadline_secs=esx_connect_deadline_secs,
+              budget=esx_connect_retry_budget):
+        log.INFO("Attempting to connect to host with IP %s" % self.host_ip)
 
-      ret = self.connect()
+        self.vim_connection_error = None
+        with timed("retry", self.host_ip, "connect") as timer:
+          ret = self.connect()
+          if not ret:
+            timer.set_outcome("error")
 
-      if ret:
-        log.INFO("Connection to host is successful on host ip %s"
-                  % self.host_ip)
-        return True
+        if ret:
+          log.INFO("Connection to host is successful on host ip %s"
+                    % self.host_ip)
+          breaker.record_success()
+          return True
 
-      if type(self.vim_connection_error) == socket.error:
-        log.ERROR("Unreachable host with IP %s, will not retry connecting, "
-                  "breaking connection." % self.host_ip)
-        self.vim_connection_error = None
-        return False
+        explicit_credentials = bool(self.user and self.password)
+        if (explicit_credentials and
+            isinstance(self.vim_connection_error, vim.fault.InvalidLogin)):
+          # hostd answered, so the host is fine. The breaker is shared by
+          # every caller of the host and must not open because one caller
+          # has a wrong password.
+          breaker.record_success()
+          log.ERROR("Login to host with IP %s as %s rejected, will not retry "
+                    "connecting." % (self.host_ip, self.user))
+          self.vim_connection_error = None
+          return False
 
-      log.INFO('Retrying connection to %s' % self.host_ip)
-    return False
+        breaker.record_failure()
+        if breaker.is_open():
+          log.ERROR("Circuit breaker of host with IP %s opened, not retrying"
+                    % self.host_ip)
+          self.vim_connection_error = None
+          return False
+
+        if not is_transient_connect_error(self.vim_connection_error,
+                                          explicit_credentials):
+          log.ERROR("Connection to host with IP %s failed with %r, will not "
+                    "retry connecting, breaking connection." %
+                    (self.host_ip, self.vim_connection_error))
+          self.vim_connection_error = None
+          return False
+
+        log.INFO('Retrying connection to %s' % self.host_ip)
+      log.ERROR("Giving up connecting to host with IP %s, retries, deadline or "
+                "retry budget exhausted" % self.host_ip)
+      return False
+    finally:
+      self.connect_deadline = None
 
   def connect(self):
     """
     Connects with host object.
     """
+    if self.session_pool:
+      credentials_id = None
+      if self.user and self.password:
+        # Sessions of other passwords must not let this one skip the login.
+        credentials_id = credentials_fingerprint(self.user, self.password)
+      self.service_instance = self.session_pool.acquire(
+          self.host_ip, self.user, self.login, credentials_id=credentials_id)
+    else:
+      self.service_instance = self.login()
+    if not self.service_instance:
+      return False
+    if not self.set_host_params():
+      self.disconnect(discard=True)
+      return False
+    self.liveness = LivenessProbe(self.service_instance)
+    # set_host_params() just talked to the host.
+    self.liveness.mark_alive()
+    if self.keepalive_secs:
+      self.keepalive = Keepalive(
+          self.liveness, interval_secs=self.keepalive_secs,
+          on_dead=_keepalive_failed(self.host_ip),
+          name="keepalive-%s" % self.host_ip).start()
+    return True
+
+  def login(self):
+    """
+    Logs in to the host.
+
+    Returns the service instance, or None if the login failed.
+    """
     (ret, username, password) = self.get_login_credentials()
     if not ret:
       log.ERROR("Cannot find credentials for connection")
-      return False
+      return None
 
+    socket_timeout = pyvmomi_connect_timeout_secs
+    if self.connect_deadline is not None:
+      # Do not let a single attempt outlive the connect deadline.
+      socket_timeout = max(1, min(socket_timeout,
+                                  self.connect_deadline - time.time()))
     from pyVim.connect import SmartConnectNoSSL
     try:
-      self.service_instance = SmartConnectNoSSL(
-          user=username, pwd=password, host=self.host_ip,
-          socketTimeout=pyvmomi_socket_timeout_secs)
+      with timed("soap", self.host_ip, "login"):
+        si = SmartConnectNoSSL(
+            user=username, pwd=password, host=self.host_ip,
+            socketTimeout=socket_timeout)
+      # Logged in, later calls may take longer than the handshake.
+      set_stub_timeout(si._stub, pyvmomi_read_timeout_secs)
+      instrument_stub(si._stub, self.host_ip)
+      return si
     except socket.error as socket_exception:
       self.vim_connection_error = socket_exception
       log.ERROR("Connection to host %s failed %s" % (self.host_ip,
                                                      socket_exception))
-      return False
+    except vim.fault.InvalidLogin as e:
+      self.vim_connection_error = e
+      # Cached one time password credentials were rejected, fetch new ones on
+      # the next attempt.
+      if not (self.user and self.password):
+        get_credential_cache().invalidate(self.host_ip)
+      log.ERROR("Login to host %s failed %s" % (self.host_ip, e.msg))
     except vim.fault.HostConnectFault as e:
+      self.vim_connection_error = e
       log.ERROR("Connection to host %s failed %s" % (self.host_ip, e.msg))
-      return False
     except Exception as e:
+      self.vim_connection_error = e
       log.ERROR("Connection to host %s failed %s" % (self.host_ip, e))
-      return False
-    return self.set_host_params()
+    return None
 
   def is_socket_open(self):
     """
@@ -242,19 +503,56 @@ class BaseEsxHostObject(object):
       return True
     return False
 
-  def is_connected(self):
+  def is_connected(self, probe=False):
     """
     Returns True if host object is correctly instantiated, else return False.
+
+    If probe is True the host must also answer a liveness probe, see
+    is_alive(). A session failing the probe is disconnected and discarded.
     """
-    if self.host_obj:
-      return True
-    return False
+    if not self.host_obj:
+      return False
+    if probe and not self.is_alive():
+      log.WARNING("Session to host %s failed the liveness probe, "
+                  "disconnecting" % self.host_ip)
+      self.disconnect(discard=True)
+      return False
+    return True
+
+  def is_alive(self, force=False):
+    """
+    Returns True if the host answers a CurrentTime() probe with a short
+    timeout. Results are cached for a few seconds unless force is True, so
+    callers can check before doing expensive work.
+    """
+    if not self.liveness:
+      return False
+    return self.liveness.is_alive(force=force)
 
-  def disconnect(self):
+  def operation_timeout(self, timeout_secs):
+    """
+    Returns a context manager running the SOAP calls of this session within
+    it with a socket timeout of timeout_secs.
+    """
+    return stub_timeout(self.service_instance._stub, timeout_secs)
+
+  def disconnect(self, discard=False):
     """
     Disconnects with host interface.
+
+    Pooled sessions are handed back to the session pool, or logged out if
+    discard is True.
     """
-    if self.service_instance:
+    if self.keepalive:
+      self.keepalive.stop()
+      self.keepalive = None
+    self.liveness = None
+    if self.service_instance and self.session_pool:
+      self.session_pool.release(self.service_instance, discard=discard)
+      self.service_instance = None
+      self.property_collector = None
+      self.host_obj = None
+    elif self.service_instance:
       from pyVim.connect import Disconnect
       Disconnect(self.service_instance)
       # Explicitly closing all the connections,
@@ -264,9 +562,7 @@ class BaseEsxHostObject(object):
       except Exception as ex:
         log.ERROR("Error while closing host connection. Error: %s" % str(ex))
       self.service_instance = None
-      self.datacenter = None
-      self.compute_resource = None
-      self.service_content = None
+      self.property_collector = None
       self.host_obj = None
 
   def get_host(self):
@@ -275,6 +571,26 @@ class BaseEsxHostObject(object):
     """
     return self.host_obj
 
+  def get_network_snapshot(self):
+    """
+    Returns a HostNetworkSnapshot of the host.
+
+    The snapshot is served from the host network inventory, which follows
+    updates in the background. If the inventory cannot be started the
+    snapshot is fetched in one round trip.
+    """
+    try:
+      inventory = get_host_network_inventory(
+          self.host_obj, self.property_collector,
+          host_ip=self.host_ip)
+      return inventory.snapshot().network
+    except Exception as ex:
+      log.WARNING("Host network inventory of %s unavailable: %s" %
+                  (self.host_ip, ex))
+    with self.operation_timeout(pyvmomi_retrieve_timeout_secs):
+      return retrieve_host_network_snapshot(
+          self.host_obj, self.property_collector)
+
   def get_management_server_ip(self):
     """
     Get the management-server IP address from the host.
@@ -289,15 +605,27 @@ class BaseEsxHostObject(object):
 
     Returns the UUID of ESX host.
     """
+    try:
+      inventory = get_host_network_inventory(
+          self.host_obj, self.property_collector,
+          host_ip=self.host_ip)
+      if inventory.snapshot().host_uuid:
+        return inventory.snapshot().host_uuid
+    except Exception as ex:
+      log.WARNING("Host network inventory of %s unavailable: %s" %
+                  (self.host_ip, ex))
     return self.host_obj.hardware.systemInfo.uuid
 
   def get_port_key_from_external_id(self, portgroup):
-    from xml.etree import ElementTree
+    """
+    Returns (True, vmk device name) of the interface whose External ID matches
+    portgroup, given in "<esx_port_key_external_id_marker><external id>"
+    format, or (False, error message).
+    """
     if isinstance(portgroup, str):
         external_id_marker = FLAGS.esx_port_key_external_id_marker
         if portgroup.startswith(external_id_marker):
             portgroup = portgroup[len(external_id_marker):]
-            print("portgroup: %s" %portgroup)
         else:
             errStr = "port ID is not in external ID Format %s" % portgroup
             return (False, errStr)
@@ -305,187 +633,489 @@ class BaseEsxHostObject(object):
         errStr = "port ID is not in external ID Format %s" % portgroup
         return (False, errStr)
 
-    host_ip = FLAGS.hypervisor_internal_ip
-    ssh_client = SSHClient(host_ip, FLAGS.hypervisor_username,
-            private_key=FLAGS.host_ssh_key)
-    ret, stdout, stderr = ssh_client.execute(
-            "localcli --formatter=xml network ip interface list ")
-    if ret != 0:
-        errstr = "failed in executing network ip interface list"
-        print (errstr)
-        return (False, errstr)
-    network_ip_list = ElementTree.fromstring(stdout)
-    root = network_ip_list.find('root')[0]
-    nics = root.findall('structure')
-    for nic in nics:
-        for nic_keys in nic.items():
-            for nic_attribs in nic_keys.attrib.iter():
-                print (nic_attribs.tag, nic_attribs.attrib, nic_atttribs.text)
+    ret, table = get_host_interface_table(FLAGS.hypervisor_internal_ip)
+    if not ret:
+        log.ERROR(table)
+        return (False, table)
+    nic = table.by_external_id(portgroup)
+    if not nic:
+        return (False, "Can not find device for external ID %s" % portgroup)
+    return (True, nic.name)
 
 
+@coalesce("fetch_interface_table")
+def fetch_interface_table(host_ip):
+  """
+  Fetches the esxcli interface table of host_ip over ssh and saves it to the
+  snapshot store.
+
+  Returns:
+    (True, HostInterfaceTable) on success, (False, error message) otherwise.
+  """
+  ssh_client = new_ssh_client(host_ip, private_key=FLAGS.host_ssh_key)
+  ret, table = fetch_host_interface_table(ssh_client)
+  if ret:
+    # Tables are stored under the UUID of the host last seen at host_ip, if
+    # any, learned when its SOAP state was saved.
+    store = get_snapshot_store()
+    save_snapshot(host_ip, store.host_uuid_of(host_ip) if store else None,
+                  SECTION_INTERFACES, table.to_dicts())
+  return (ret, table)
+
+def get_host_interface_table(host_ip):
+  """
+  Returns (True, HostInterfaceTable) of host_ip, served from the snapshot
+  store on a cold start, or (False, error message).
+  """
+  rows = serve_stored(host_ip, SECTION_INTERFACES,
+                      lambda: fetch_interface_table(host_ip))
+  if rows is not None:
+    return (True, HostInterfaceTable.from_dicts(rows))
+  return fetch_interface_table(host_ip)
+
+def fetch_interface_outputs(host_ip):
+  """
+  Fetches the undecoded esxcli interface outputs of host_ip over ssh, see
+  fetch_host_interface_outputs().
+  """
+  ssh_client = new_ssh_client(host_ip, private_key=FLAGS.host_ssh_key)
+  return fetch_host_interface_outputs(ssh_client)
+
+def get_fleet_interface_index(hosts, **kwargs):
+  """
+  Fetches the esxcli interface tables of hosts through the ingestion pipeline
+  of fleet_ingest, decoding them in worker processes, and saves each to the
+  snapshot store. kwargs are passed to ingest_interface_tables().
+
+  Returns:
+    (FleetInterfaceIndex, dict of stage name to StageStats).
+  """
+  store = get_snapshot_store()
+
+  def save(host_ip, table, rows):
+    save_snapshot(host_ip, store.host_uuid_of(host_ip) if store else None,
+                  SECTION_INTERFACES, rows)
+
+  return ingest_interface_tables(hosts, fetch_interface_outputs,
+                                 on_table=save, **kwargs)
+
+@coalesce("get_portgroup_mor")
 def get_portgroup_mor(host_ip, portgroup_name):
+  """
+  Looks up a distributed virtual portgroup by name among the networks of
+  host_ip in the vCenter index.
+
+  Returns:
+    (True, PortgroupRecord, host_obj) if found,
+    (False, error message or None, None) otherwise.
+  """
   ret, vcenter = helper.get_vcenter_object()
   if not ret:
     return (False, None, None)
   host_obj = vcenter.lookup_host_by_ip(host_ip)
   if not host_obj:
     return (False, None, None)
-  network_mors = host_obj.network
-  dvs_mors = []
-  for network_mor in network_mors:
-    if isinstance(network_mor, vim.dvs.DistributedVirtualPortgroup):
-      dvs_mors.append(network_mor)
-  dvs_name_config_map = vcenter.query_object_properties(dvs_mors, ["name", "config"])
-
-  print (dvs_name_config_map)
-  return 
-  
-
-  for pswitch in proxy_switch:
-    print(dir(pswitch.spec))
-  return
-  for dvs in vcenter.all_virtual_distributed_switches:
-    for portgroup in dvs.portgroup:
-      if portgroup.name == portgroup_name:
-        print(dir(portgroup))
-        print(portgroup.name, portgroup.tag)
-        print(portgroup.config)
-        print(portgroup.configStatus)
-        return (True, portgroup, host_obj)
-      #print(portgroup.config.distributedVirtualSwitch.uuid, portgroup.name, portgroup.key)
-  return (False, "port group not found", None)
+  network_moids = frozenset(network._moId for network in host_obj.network)
+  portgroup = get_portgroup_index(host_obj._stub).lookup(portgroup_name,
+                                                         network_moids)
+  if not portgroup:
+    return (False, "port group not found", None)
+  return (True, portgroup, host_obj)
+
+def add_vnic(host_obj, portgroup, ip_address, netmask):
+  """
+  Adds a vmkernel NIC with a static IPv4 address on portgroup, a
+  PortgroupRecord, to host_obj.
+
+  Returns:
+    (True, vmk device name) on success, (False, error message) otherwise.
+  """
+  vmk = build_virtual_nic_spec(portgroup, ip_address, netmask)
+  try:
+    with stub_timeout(host_obj._stub, pyvmomi_reconfigure_timeout_secs):
+      vmk_id = host_obj.configManager.networkSystem.AddVirtualNic(
+                 portgroup="", nic=vmk)
+  except Exception as ex:
+    log.ERROR("vmkernel create failed: %s" % str(ex))
+    return (False, "vmkernel create failed: %s" % str(ex))
+  return (True, vmk_id)
+
+def find_vnic(vnics, portgroup, ip_address):
+  """
+  Returns the device of the VnicRecord in vnics connected to portgroup, a
+  PortgroupRecord, with ip_address, or None.
+  """
+  for vnic in vnics:
+    if (vnic.switch_uuid == portgroup.switch_uuid and
+        vnic.portgroup_key == portgroup.key and
+        vnic.ip_address == ip_address):
+      return vnic.device
+  return None
 
 def create_vnic(host_ip, ip_address, netmask, host_physical_network):
   ret, portgroup, host_obj = get_portgroup_mor(host_ip, host_physical_network)
   if not ret:
     return (False, "nic create failed")
-  switch_uuid = portgroup.config.distributedVirtualSwitch.uuid
-  portgroup_key = portgroup.key
-
-  vmk = vim.host.VirtualNic.Specification()
-  vmk.ip = vim.host.IpConfig()
-  vmk.ip.ipAddress = ip_address
-  vmk.ip.subnetMask = netmask
-  dvs_port = vim.dvs.PortConnection()
-  dvs_port.switchUuid = switch_uuid
-  dvs_port.portgroupKey = portgroup_key
-  vmk.distributedVirtualPort = dvs_port
+  return add_vnic(host_obj, portgroup, ip_address, netmask)
+
+def provision_vnics(specs, max_per_host=1, max_workers=16):
+  """
+  Creates vmkernel NICs on many hosts.
+
+  Specs for the same host, IP address and portgroup are provisioned once and
+  share the result. The specs of a host are split into at most max_per_host
+  lists, each provisioned one spec after the other by one worker, so at most
+  max_per_host AddVirtualNic calls run at a time on one host and no worker
+  waits for another. A spec whose host already has a vnic on the same
+  portgroup with the same IP address succeeds without creating another one.
+
+  Args:
+    specs (list): (host_ip, ip_address, netmask, portgroup name) tuples.
+    max_per_host (int): Maximum concurrent AddVirtualNic calls per host.
+    max_workers (int): Maximum concurrent AddVirtualNic calls overall.
+
+  Returns:
+    list of (True, vmk device name) or (False, error message), in the order
+    of specs.
+  """
+  from concurrent.futures import ThreadPoolExecutor
+
+  ret, vcenter = helper.get_vcenter_object()
+  if not ret:
+    return [(False, "failed to connect to vCenter")] * len(specs)
+
+  # Position in unique_specs of every spec.
+  positions = []
+  unique_specs = []
+  position_by_key = {}
+  for spec in specs:
+    host_ip, ip_address, _, portgroup_name = spec
+    key = (host_ip, ip_address, portgroup_name)
+    if key not in position_by_key:
+      position_by_key[key] = len(unique_specs)
+      unique_specs.append(spec)
+    positions.append(position_by_key[key])
+
+  # Map of (host IP, lane) to the positions of the specs provisioned one
+  # after the other.
+  lanes = {}
+  specs_per_host = {}
+  for position, spec in enumerate(unique_specs):
+    host_ip = spec[0]
+    count = specs_per_host.get(host_ip, 0)
+    specs_per_host[host_ip] = count + 1
+    lanes.setdefault((host_ip, count % max_per_host), []).append(position)
+
+  results = [None] * len(unique_specs)
+
+  def provision(host_obj, spec):
+    host_ip, ip_address, netmask, portgroup_name = spec
+    snapshot = get_host_network_inventory(host_obj).snapshot()
+    portgroup = get_portgroup_index(host_obj._stub).lookup(
+        portgroup_name, portgroup_moids(snapshot))
+    if not portgroup:
+      return (False, "port group %s not found" % portgroup_name)
+    device = find_vnic(snapshot.vnics, portgroup, ip_address)
+    if device:
+      log.INFO("vmknic %s with %s on %s already exists on host %s" %
+               (device, ip_address, portgroup_name, host_ip))
+      return (True, device)
+    return add_vnic(host_obj, portgroup, ip_address, netmask)
+
+  def provision_lane(lane):
+    (host_ip, _), lane_positions = lane
+    host_obj = vcenter.lookup_host_by_ip(host_ip)
+    for position in lane_positions:
+      if not host_obj:
+        results[position] = (False, "host %s not found" % host_ip)
+      else:
+        results[position] = provision(host_obj, unique_specs[position])
+
+  executor = ThreadPoolExecutor(max_workers=max_workers)
   try:
-    vmk_id = host_obj.configManager.networkSystem.AddVirtualNic(
-               portgroup="", nic=vmk)
-  except Exception as ex:
-    print("vmkernel create failed: %s" % str(ex))
-    return False
-  print(vmk_id)
+    list(executor.map(provision_lane, list(lanes.items())))
+  finally:
+    executor.shutdown(wait=True)
+  return [results[position] for position in positions]
 
+def reconcile_vnics(desired, dry_run=False, max_workers=16,
+                    remove_unmatched=False):
+  """
+  Makes the vmkernel NICs of hosts match their desired specs with the fewest
+  changes, see vnic_reconciler.plan_vnic_changes(). Each plan is computed
+  from one snapshot of the vnics of the host. Re-running with the same specs
+  changes nothing.
+
+  Args:
+    desired (dict): Map of host IP to list of VnicSpec.
+    dry_run (bool): If True, the plans are returned without applying them.
+    max_workers (int): Maximum number of hosts reconciled concurrently.
+    remove_unmatched (bool): Whether to remove the vnics on the portgroups
+      of the specs that no spec asks for. They are kept by default.
+
+  Returns:
+    dict of host IP to (True, list of VnicChange planned or applied) or
+    (False, error message). The changes adding vnics of an applied plan
+    carry the device added.
+  """
+  from concurrent.futures import ThreadPoolExecutor
+
+  ret, vcenter = helper.get_vcenter_object()
+  if not ret:
+    return dict((host_ip, (False, "failed to connect to vCenter"))
+                for host_ip in desired)
+
+  def reconcile(host_ip):
+    specs = desired[host_ip]
+    host_obj = vcenter.lookup_host_by_ip(host_ip)
+    if not host_obj:
+      return (False, "host %s not found" % host_ip)
+    inventory = get_host_network_inventory(host_obj, host_ip=host_ip)
+    snapshot = inventory.snapshot()
+    index = get_portgroup_index(host_obj._stub)
+    network_moids = portgroup_moids(snapshot)
+    portgroups = {}
+    for spec in specs:
+      portgroups[spec.portgroup] = index.lookup(spec.portgroup, network_moids)
+      if not portgroups[spec.portgroup]:
+        return (False, "port group %s not found" % spec.portgroup)
+    plan = plan_vnic_changes(snapshot.vnics, specs, portgroups,
+                             remove_unmatched=remove_unmatched)
+    if dry_run or not plan:
+      return (True, plan)
+    with stub_timeout(host_obj._stub, pyvmomi_reconfigure_timeout_secs):
+      ret, added = apply_vnic_changes(host_obj.configManager.networkSystem,
+                                      plan)
+    if not ret:
+      return (False, added)
+    added = iter(added)
+    plan = [change._replace(device=next(added))
+            if change.action == ACTION_ADD else change for change in plan]
+    # Wait for the inventory to see the changes, so the next run plans from
+    # them.
+    deadline = time.time() + vnic_reconcile_settle_secs
+    while plan_vnic_changes(snapshot.vnics, specs, portgroups,
+                            remove_unmatched=remove_unmatched):
+      remaining = deadline - time.time()
+      if remaining <= 0:
+        log.WARNING("vmknics of host %s did not converge within %s secs" %
+                    (host_ip, vnic_reconcile_settle_secs))
+        break
+      snapshot = inventory.wait_for_version(snapshot.version, remaining)
+    return (True, plan)
+
+  hosts = list(desired)
+  executor = ThreadPoolExecutor(max_workers=max_workers)
+  try:
+    return dict(zip(hosts, executor.map(reconcile, hosts)))
+  finally:
+    executor.shutdown(wait=True)
+
+def portgroup_moids(snapshot):
+  """
+  Returns the moids of the distributed portgroups of an InventorySnapshot.
+  """
+  return frozenset(portgroup.moid for portgroup in snapshot.network.portgroups)
+
+def vnic_ports_of(vnics, index, portgroup_names=(), network_moids=None):
+  """
+  Returns a JSON serializable dict of the distributed port of every
+  VnicRecord in vnics, and the (switch uuid, key) of the portgroups they are
+  on and of portgroup_names, by portgroup name as looked up in index among
+  network_moids, see PortgroupIndex.lookup().
+  """
+  ports = []
+  names = set(portgroup_names)
+  for vnic in vnics:
+    if not vnic.switch_uuid:
+      continue
+    ports.append(dict(vnic._asdict()))
+    entry = index.lookup_key(vnic.portgroup_key)
+    if entry:
+      names.add(entry.name)
+  portgroups = {}
+  for name in names:
+    entry = index.lookup(name, network_moids)
+    if entry:
+      portgroups[name] = [entry.switch_uuid, entry.key]
+  return {"vnics": ports, "portgroups": portgroups}
+
+@coalesce("fetch_vnic_ports")
+def fetch_vnic_ports(host_ip, host_physical_network):
+  """
+  Fetches the vnic ports of host_ip, see vnic_ports_of(), and saves them to
+  the snapshot store. Returns None if the host or portgroup is not found.
+  """
+  ret, vcenter = helper.get_vcenter_object()
+  if not ret:
+    return None
+  host_obj = vcenter.lookup_host_by_ip(host_ip)
+  if not host_obj:
+    return None
+  snapshot = get_host_network_inventory(host_obj).snapshot()
+  vnic_ports = vnic_ports_of(snapshot.vnics,
+                             get_portgroup_index(host_obj._stub),
+                             [host_physical_network],
+                             portgroup_moids(snapshot))
+  if host_physical_network not in vnic_ports["portgroups"]:
+    return None
+  save_snapshot(host_ip, snapshot.host_uuid, SECTION_VNICS, vnic_ports)
+  return vnic_ports
+
+def get_host_interface_record(host_ip, host_physical_network):
+  """
+  Returns (True, VnicRecord) of the vmkernel NIC of host_ip on the
+  distributed portgroup called host_physical_network, (False, None) if the
+  host or portgroup is not found, or (False, error message).
+  """
+  vnic_ports = serve_stored(
+      host_ip, SECTION_VNICS,
+      lambda: fetch_vnic_ports(host_ip, host_physical_network))
+  if vnic_ports is not None:
+    ret, vnic = interface_record_in(vnic_ports, host_physical_network)
+    # Otherwise the stored snapshot may predate the portgroup or the vnic.
+    if ret:
+      return (ret, vnic)
+  vnic_ports = fetch_vnic_ports(host_ip, host_physical_network)
+  if vnic_ports is None:
+    return (False, None)
+  return interface_record_in(vnic_ports, host_physical_network)
+
+def interface_record_in(vnic_ports, host_physical_network):
+  """
+  Returns (True, VnicRecord) of the vnic on the portgroup called
+  host_physical_network in vnic_ports, see vnic_ports_of(), (False, None) if
+  the portgroup is not in it, or (False, error message).
+  """
+  portgroup = vnic_ports["portgroups"].get(host_physical_network)
+  if not portgroup:
+    return (False, None)
+  switch_uuid, portgroup_key = portgroup
+  for vnic in vnic_ports["vnics"]:
+    vnic = vnic_record_from_dict(vnic)
+    if (vnic.switch_uuid == switch_uuid and
+        vnic.portgroup_key == portgroup_key and vnic.port_key):
+      return (True, vnic)
+  return (False, "Failed to fidn port key")
 
 def get_portkey_of_host_interface(host_ip, host_physical_network):
-    ret, portgroup, host_obj = get_portgroup_mor(host_ip, host_physical_network)
+    ret, vnic = get_host_interface_record(host_ip, host_physical_network)
     if not ret:
-        return (False, None)
-    switch_uuid = portgroup.config.distributedVirtualSwitch.uuid
-    portgroup_key = portgroup.key
-
-    port_key, external_id = None, None
-    all_vmknics = host_obj.configManager.networkSystem.networkInfo.vnic
-    for vmk in all_vmknics:
-        if not vmk.spec.distributedVirtualPort:
-            continue
-        if (vmk.spec.distributedVirtualPort.switchUuid == switch_uuid and
-            vmk.spec.distributedVirtualPort.portgroupKey == portgroup_key):
-            port_key = vmk.spec.distributedVirtualPort.portKey
-            external_id = vmk.spec.externalId
-            break
-    if not port_key:
-        print ("Can not find port key")
-        return (False, "Failed to fidn port key")
-    if not external_id:
-        return (True, port_key)
-    return (True, FLAGS.esx_port_key_external_id_marker+external_id)
+        if vnic:
+            log.ERROR("Can not find port key of host %s on %s: %s" %
+                      (host_ip, host_physical_network, vnic))
+        return (False, vnic)
+    if not vnic.external_id:
+        return (True, vnic.port_key)
+    return (True, FLAGS.esx_port_key_external_id_marker+vnic.external_id)
 
 def get_portgroup_nsx_backing(host_ip, port_group):
-  esx_obj = EsxHostObject(host_ip)
-  host_obj = esx_obj.get_host()
-  
-  if not host_obj:
+  esx_obj = BaseEsxHostObject(host_ip)
+  if not esx_obj.get_host():
     return False
-  for ps in (host_obj.configManager.networkSystem.networkInfo.proxySwitch):
-    for tz in ps.transportZones:
-      print(tz.uuid, tz.type)
-  network_mors = host_obj.network
-  dvs_mors = []
-  for network_mor in network_mors:
-    if isinstance(network_mor, vim.dvs.DistributedVirtualPortgroup):
-      dvs_mors.append(network_mor)
-  for dvs in dvs_mors:
-    print(dvs.name, dvs.config)
+  snapshot = esx_obj.get_network_snapshot()
+  for tz_uuid, tz_type in snapshot.transport_zones or []:
+    log.INFO("host %s transport zone %s type %s" %
+             (host_ip, tz_uuid, tz_type))
+  for portgroup in snapshot.portgroups:
+    log.INFO("host %s portgroup %s backing %s transport zone %s" %
+             (host_ip, portgroup.name, portgroup.backing_type,
+              portgroup.transport_zone_uuid))
   return True
 
-def validate_nsx_t_portgroup(host_ip, port_group):
-  err_msg = "host: %s portgroup: %s " % (host_ip, port_group)
-  warning_msg_unsupported_pyvim_client = ("pvVmomi version does not support "
-                                          "nsx-t attributes")
-  esx_obj = EsxHostObject(host_ip)
+@coalesce("fetch_network_snapshot")
+def fetch_network_snapshot(host_ip):
+  """
+  Fetches the HostNetworkSnapshot of host_ip and saves it to the snapshot
+  store. Once the network inventory of the host is followed, it is read
+  from the inventory without connecting.
+
+  Returns:
+    (True, HostNetworkSnapshot) on success, (False, error message) otherwise.
+  """
+  inventory = find_host_network_inventory(host_ip)
+  if inventory:
+    snapshot = inventory.snapshot()
+    save_snapshot(host_ip, snapshot.host_uuid, SECTION_NETWORK,
+                  snapshot_to_dict(snapshot.network))
+    return (True, snapshot.network)
+  esx_obj = BaseEsxHostObject(host_ip)
   if not esx_obj:
-    return (False, err_msg + "Esx host object does not exist")
+    return (False, "Esx host object does not exist")
   host_obj = esx_obj.get_host()
   if not host_obj:
-    return (False, err_msg + "host object does not exist")
-  nets = host_obj.network
-  if not nets:
-    return (False, err_msg + "network prop retreival failed")
-  dvs_networks = []
-  for net in nets:
-    if isinstance(net, vim.dvs.DistributedVirtualPortgroup):
-      dvs_networks.append(net)
-  nsx_tz_to_validate = None
-  pgBackingType = None
-  for dvs_network in dvs_networks:
-     if dvs_network.name == port_group:
-       if not hasattr(dvs_network.config, 'backingType'):
-         return (False, warning_msg_unsupported_pyvim_client)
-       backingType = dvs_network.config.backingType
-       if backingType == "nsx":
-         pgBackingType = "nsx"
-         if not hasattr(dvs_network.config, 'transportZoneUuid'):
-           return (False, warning_msg_unsupported_pyvim_client)
-         nsx_tz_to_validate = dvs_network.config.transportZoneUuid
-         break
-
-  if pgBackingType == "nsx" and not nsx_tz_to_validate:
-    return (False, warning_msg_unsupported_pyvim_client)
-  elif not nsx_tz_to_validate:
-    return (True, None)
-
-  proxySwitches = host_obj.configManager.networkSystem.networkInfo.proxySwitch
-  for proxySwitch in proxySwitches:
-    if not hasattr(proxySwitch, 'transportZones'):
-      return (False, warning_msg_unsupported_pyvim_client)
-    for tz in proxySwitch.transportZones:
-      if tz.uuid == nsx_tz_to_validate and tz.type != 'vlan':
-        return (False, err_msg + "transport type is %s" % tz.type)
-  return (True, nsx_tz_to_validate)
-  
-'''
-base_host = BaseEsxHostObject("10.46.1.214", user="administrator@vsphere.local",
-                              password="Nutanix/4u")
-create_vnic("10.47.242.69", "172.16.9.1", "255.255.0.0", 'DPG-HOST-BP')
-base_host = BaseEsxHostObject("192.168.5.1")
-
-base_host.connect_with_retries()
-host_obj=base_host.get_host()
-all_vmknics = host_obj.configManager.networkSystem.networkInfo.vnic
-print (all_vmknics)
-get_portgroup_mor("10.47.242.69", 'DPG-HOST-BP')
-ret, pk = get_portkey_of_host_interface("10.47.242.69", 'DPG-HOST-BP')
-if ret:
-  print("PK: %s" % pk)
-base_host = BaseEsxHostObject("192.168.5.1")
-base_host.get_port_key_from_external_id(portgroup=pk)
-'''
-#get_portgroup_mor("10.47.242.69", 'DPG-HOST-VXLAM')
-#get_portgroup_nsx_backing("10.47.242.69", 'DPG-HOST-VXLAM')
-pg_list = ['DPG-HOST-VXLAM', 'DPG-HOST-BP', 'VM Network']
-for pg in pg_list:
-  ret, msg = validate_nsx_t_portgroup("10.47.242.69", pg)
-  print (ret, msg)
+    return (False, "host object does not exist")
+  try:
+    snapshot = esx_obj.get_network_snapshot()
+  except Exception as ex:
+    log.ERROR("Failed to retrieve network properties of %s: %s" %
+              (host_ip, ex))
+    return (False, "network prop retreival failed")
+  save_snapshot(host_ip, esx_obj.get_esx_host_uuid(), SECTION_NETWORK,
+                snapshot_to_dict(snapshot))
+  return (True, snapshot)
+
+def validate_nsx_t_portgroup(host_ip, port_group):
+  """
+  Validates that port_group on the host is not backed by an NSX-T overlay
+  transport zone. All the properties needed are fetched in one round trip,
+  or served from the snapshot store on a cold start.
+
+  Returns:
+    (True, transport zone uuid or None) if the portgroup can be used,
+    (False, error message) otherwise.
+  """
+  err_msg = "host: %s portgroup: %s " % (host_ip, port_group)
+  stored = serve_stored(host_ip, SECTION_NETWORK,
+                        lambda: fetch_network_snapshot(host_ip),
+                        max_age_secs=validation_snapshot_max_age_secs)
+  if stored is not None:
+    ret, msg = validate_portgroup_in_snapshot(snapshot_from_dict(stored),
+                                              port_group, err_msg)
+    # A failure may come from a stored snapshot predating the portgroup,
+    # only the live state can tell.
+    if ret:
+      return (ret, msg)
+  ret, snapshot = fetch_network_snapshot(host_ip)
+  if not ret:
+    return (False, err_msg + snapshot)
+  return validate_portgroup_in_snapshot(snapshot, port_group, err_msg)
+
+def validate_nsx_t_portgroups_in_cluster(hosts, portgroups, container=None):
+  """
+  Validates every portgroup on every host like validate_nsx_t_portgroup(),
+  with one vCenter query for all hosts in container instead of a login per
+  host. The network state of the hosts is saved to the snapshot store.
+
+  Args:
+    hosts (list): IP addresses or vCenter names of the hosts.
+    portgroups (list): Names of the portgroups.
+    container (vim.ManagedEntity): Cluster, folder or datacenter containing
+      the hosts, every host of the vCenter if None.
+
+  Returns:
+    (True, list of (host, portgroup, ret, msg) in the order of hosts and
+    portgroups) on success, (False, error message) otherwise.
+  """
+  if not hosts:
+    return (True, [])
+  ret, vcenter = helper.get_vcenter_object()
+  if not ret:
+    return (False, "failed to connect to vCenter")
+  host_obj = vcenter.lookup_host_by_ip(hosts[0])
+  if not host_obj:
+    return (False, "host %s not found" % hosts[0])
+  try:
+    with stub_timeout(host_obj._stub, pyvmomi_retrieve_timeout_secs):
+      service_content = vim.ServiceInstance(
+          "ServiceInstance", host_obj._stub).RetrieveContent()
+      matrix = retrieve_validation_matrix(service_content, container)
+  except Exception as ex:
+    log.ERROR("Failed to retrieve network properties of cluster: %s" % ex)
+    return (False, "network prop retreival failed")
+  for host in hosts:
+    snapshot = matrix.snapshot(host)
+    if snapshot is not None:
+      save_snapshot(host, matrix.host_uuids.get(matrix.host_name(host)),
+                    SECTION_NETWORK, snapshot_to_dict(snapshot))
+  return (True, matrix.validate_all(hosts, portgroups))
@@ -0,0 +1,216 @@
+"""
+Cluster wide NSX-T portgroup validation from vCenter.
+
+validate_nsx_t_portgroup() logs in to every host and validates one
+portgroup at a time, so a cluster costs hosts x portgroups validations and a
+login per host. retrieve_validation_matrix() fetches the networks, proxy
+switch transport zones and vnics of every host in a container, and the
+backing of every portgroup they are on, with one ContainerView and one
+RetrieveContents() call to vCenter. ValidationMatrix then answers any
+(host, portgroup) pair from memory with validate_portgroup_in_snapshot(),
+so results match those of validate_nsx_t_portgroup(). Hosts are found by
+name or by the IP address of their management vnics; addresses every host
+has, e.g. 192.168.5.1 on the internal vSwitch, are not used.
+"""
+
+from collections import namedtuple
+
+from host_network import (PORTGROUP_BASIC_PROPERTIES, PORTGROUP_PROPERTIES,
+                          compact_host_property, snapshot_from_properties,
+                          validate_portgroup_in_snapshot)
+from lazy_import import LazyImport
+
+vim = LazyImport("pyVmomi", "vim")
+vmodl = LazyImport("pyVmomi", "vmodl")
+
+__all__ = [
+    "MatrixCell",
+    "ValidationMatrix",
+    "build_cluster_filter_spec",
+    "retrieve_validation_matrix",
+]
+
+CLUSTER_HOST_PROPERTIES = ["name", "network", "config.network.proxySwitch",
+                           "config.network.vnic", "hardware.systemInfo.uuid",
+                           "config.virtualNicManagerInfo.netConfig"]
+
+host_not_found_msg = "host not found in vCenter"
+ambiguous_host_msg = "IP address is used by several hosts in vCenter"
+
+# Backing of a portgroup on a host. The fields are None when the portgroup
+# does not set them or, for transport_zone_type, when no proxy switch of the
+# host is in its transport zone.
+MatrixCell = namedtuple("MatrixCell", [
+    "backing_type", "transport_zone_uuid", "transport_zone_type"])
+
+
+class ValidationMatrix(object):
+  """
+  Network state of the hosts of a container, indexed by host name and by
+  the IP addresses of their management vnics.
+
+  Attributes:
+    snapshots (dict): Map of host name to HostNetworkSnapshot.
+    host_uuids (dict): Map of host name to host UUID.
+    ambiguous_ips (set): IP addresses of management vnics of several hosts,
+      which are not mapped to any.
+  """
+
+  def __init__(self, snapshots, host_uuids, names_by_ip, ambiguous_ips=()):
+    self.snapshots = snapshots
+    self.host_uuids = host_uuids
+    self._names_by_ip = names_by_ip
+    self.ambiguous_ips = frozenset(ambiguous_ips)
+
+  def host_name(self, host):
+    """
+    Returns the name of the host called host or with a management vnic at IP
+    address host, or None.
+    """
+    if host in self.snapshots:
+      return host
+    return self._names_by_ip.get(host)
+
+  def snapshot(self, host):
+    """
+    Returns the HostNetworkSnapshot of host, a name or IP address, or None.
+    """
+    name = self.host_name(host)
+    return self.snapshots.get(name) if name else None
+
+  def validate(self, host, port_group):
+    """
+    Validates port_group on host like validate_nsx_t_portgroup().
+
+    Returns:
+      (True, transport zone uuid or None) if the portgroup can be used,
+      (False, error message) otherwise.
+    """
+    err_msg = "host: %s portgroup: %s " % (host, port_group)
+    snapshot = self.snapshot(host)
+    if snapshot is None and host in self.ambiguous_ips:
+      return (False, err_msg + ambiguous_host_msg)
+    if snapshot is None:
+      return (False, err_msg + host_not_found_msg)
+    return validate_portgroup_in_snapshot(snapshot, port_group, err_msg)
+
+  def cell(self, host, port_group):
+    """
+    Returns the MatrixCell of port_group on host, or None if the host or
+    the portgroup is not found.
+    """
+    snapshot = self.snapshot(host)
+    if snapshot is None:
+      return None
+    for portgroup in snapshot.portgroups:
+      if portgroup.name == port_group:
+        tz_type = None
+        for tz_uuid, tz_type_of_uuid in snapshot.transport_zones or []:
+          if tz_uuid == portgroup.transport_zone_uuid:
+            tz_type = tz_type_of_uuid
+            break
+        return MatrixCell(portgroup.backing_type,
+                          portgroup.transport_zone_uuid, tz_type)
+    return None
+
+  def validate_all(self, hosts, portgroups):
+    """
+    Returns (host, portgroup, ret, msg) for every pair of hosts and
+    portgroups, in order.
+    """
+    results = []
+    for host in hosts:
+      for port_group in portgroups:
+        ret, msg = self.validate(host, port_group)
+        results.append((host, port_group, ret, msg))
+    return results
+
+
+def build_cluster_filter_spec(view, portgroup_properties=PORTGROUP_PROPERTIES,
+                              host_properties=CLUSTER_HOST_PROPERTIES):
+  """
+  Returns a PropertyFilterSpec selecting host_properties of every host in
+  view, a ContainerView of HostSystem, and portgroup_properties of every
+  distributed virtual portgroup on them.
+  """
+  pc = vmodl.query.PropertyCollector
+  host_to_network = pc.TraversalSpec(name="hostToNetwork", type=vim.HostSystem,
+                                     path="network", skip=False)
+  view_to_host = pc.TraversalSpec(name="viewToHost",
+                                  type=vim.view.ContainerView, path="view",
+                                  skip=False, selectSet=[host_to_network])
+  obj_spec = pc.ObjectSpec(obj=view, skip=True, selectSet=[view_to_host])
+  prop_set = [
+    pc.PropertySpec(type=vim.HostSystem, all=False, pathSet=host_properties),
+    pc.PropertySpec(type=vim.dvs.DistributedVirtualPortgroup, all=False,
+                    pathSet=portgroup_properties),
+  ]
+  return pc.FilterSpec(objectSet=[obj_spec], propSet=prop_set)
+
+
+def retrieve_validation_matrix(service_content, container=None):
+  """
+  Fetches the ValidationMatrix of the hosts in container with one
+  RetrieveContents() call.
+
+  Args:
+    service_content (vim.ServiceInstanceContent): Content of the vCenter.
+    container (vim.ManagedEntity): Cluster, folder or datacenter whose hosts
+      are validated. The root folder, i.e. every host of the vCenter, if
+      None.
+  """
+  view = service_content.viewManager.CreateContainerView(
+      container or service_content.rootFolder, [vim.HostSystem], True)
+  nsx_supported = True
+  try:
+    collector = service_content.propertyCollector
+    try:
+      contents = collector.RetrieveContents(
+          [build_cluster_filter_spec(view)])
+    except vmodl.query.InvalidProperty:
+      # vCenter or pyVmomi predates NSX-T portgroup attributes.
+      nsx_supported = False
+      contents = collector.RetrieveContents(
+          [build_cluster_filter_spec(view, PORTGROUP_BASIC_PROPERTIES)])
+  finally:
+    view.Destroy()
+  return matrix_from_object_contents(contents, nsx_supported=nsx_supported)
+
+
+def matrix_from_object_contents(contents, nsx_supported=True):
+  """
+  Builds a ValidationMatrix from the ObjectContent list returned for
+  build_cluster_filter_spec().
+  """
+  host_props = []
+  portgroup_props = {}
+  for content in contents or []:
+    props = dict((prop.name, prop.val) for prop in content.propSet)
+    if isinstance(content.obj, vim.HostSystem):
+      host_props.append(dict((name, compact_host_property(name, val))
+                             for name, val in props.items()))
+    elif isinstance(content.obj, vim.dvs.DistributedVirtualPortgroup):
+      portgroup_props[content.obj._moId] = props
+
+  snapshots = {}
+  host_uuids = {}
+  names_by_ip = {}
+  ambiguous_ips = set()
+  for props in host_props:
+    name = props.get("name")
+    network = props.get("network") or ()
+    snapshots[name] = snapshot_from_properties(
+        props,
+        dict((moid, portgroup_props[moid]) for moid in network
+             if moid in portgroup_props),
+        nsx_supported=nsx_supported)
+    host_uuids[name] = props.get("hardware.systemInfo.uuid")
+    management = props.get("config.virtualNicManagerInfo.netConfig") or ()
+    for vnic in props.get("config.network.vnic") or ():
+      if not vnic.ip_address or vnic.device not in management:
+        continue
+      if names_by_ip.setdefault(vnic.ip_address, name) != name:
+        ambiguous_ips.add(vnic.ip_address)
+  for ip_address in ambiguous_ips:
+    del names_by_ip[ip_address]
+  return ValidationMatrix(snapshots, host_uuids, names_by_ip, ambiguous_ips)
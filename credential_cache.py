@@ -0,0 +1,110 @@
+"""
+Per host cache of the credentials returned by get_one_time_password.py.
+
+Fetching credentials costs an SSH session, an upload of the OTP script, the
+resource pool setup and the script run itself. Entries expire before the
+password issued by the script does, and are dropped as soon as a login with
+them is rejected.
+"""
+
+import hashlib
+import os
+import threading
+import time
+
+__all__ = [
+    "CredentialCache",
+    "file_md5sum",
+    "get_credential_cache",
+]
+
+# Lifetime of cached credentials. Kept below the validity of the passwords
+# handed out by get_one_time_password.py so a cached entry is never stale.
+otp_credential_ttl_secs = 120
+
+
+class CredentialCache(object):
+  """
+  Thread safe map of host_ip to credentials dict with expiry.
+  """
+
+  def __init__(self, ttl_secs=otp_credential_ttl_secs):
+    self.ttl_secs = ttl_secs
+    self._lock = threading.Lock()
+    # Map of host_ip to (expiry time, credentials dict).
+    self._entries = {}
+    self.hits = 0
+    self.misses = 0
+
+  def get(self, host_ip):
+    """
+    Returns the cached credentials dict for host_ip, or None if there is no
+    entry or it has expired.
+    """
+    with self._lock:
+      entry = self._entries.get(host_ip)
+      if entry and entry[0] > time.time():
+        self.hits += 1
+        return entry[1]
+      if entry:
+        del self._entries[host_ip]
+      self.misses += 1
+      return None
+
+  def put(self, host_ip, credentials, ttl_secs=None):
+    """
+    Caches credentials for host_ip for ttl_secs, or the cache default.
+    """
+    if ttl_secs is None:
+      ttl_secs = self.ttl_secs
+    with self._lock:
+      self._entries[host_ip] = (time.time() + ttl_secs, credentials)
+
+  def invalidate(self, host_ip):
+    """
+    Drops the cached credentials of host_ip, e.g. after an auth fault.
+    """
+    with self._lock:
+      self._entries.pop(host_ip, None)
+
+  def clear(self):
+    with self._lock:
+      self._entries = {}
+
+
+_md5sum_cache = {}
+_md5sum_lock = threading.Lock()
+
+def file_md5sum(path):
+  """
+  Returns the hex md5 digest of the file at path. Digests are cached until the
+  file's mtime or size changes.
+  """
+  st = os.stat(path)
+  stamp = (st.st_mtime, st.st_size)
+  with _md5sum_lock:
+    cached = _md5sum_cache.get(path)
+    if cached and cached[0] == stamp:
+      return cached[1]
+  md5 = hashlib.md5()
+  with open(path, "rb") as fd:
+    for chunk in iter(lambda: fd.read(65536), b""):
+      md5.update(chunk)
+  digest = md5.hexdigest()
+  with _md5sum_lock:
+    _md5sum_cache[path] = (stamp, digest)
+  return digest
+
+
+_credential_cache = None
+_credential_cache_lock = threading.Lock()
+
+def get_credential_cache():
+  """
+  Returns the process wide CredentialCache.
+  """
+  global _credential_cache
+  with _credential_cache_lock:
+    if _credential_cache is None:
+      _credential_cache = CredentialCache()
+    return _credential_cache
@@ -0,0 +1,99 @@
+"""
+Runs several commands on a host in a single SSH invocation.
+
+Each command's stdout, exit status and stderr are framed with delimiters that
+carry a random token, and demultiplexed afterwards, so callers get the same
+(ret, stdout, stderr) per command as if they had run them one at a time.
+"""
+
+import uuid
+
+__all__ = [
+    "build_batch_script",
+    "execute_batch",
+    "parse_batch_output",
+]
+
+
+def _marker(token, index, kind):
+  return "@@%s %d %s" % (token, index, kind)
+
+
+def build_batch_script(cmds, token):
+  """
+  Returns a shell script running cmds in order, framing their output.
+
+  The output of command i is:
+    <OUT marker>\\n<stdout>\\n<RC marker> <ret>\\n<stderr>\\n<END marker>\\n
+  """
+  parts = ['__batch_err=$(mktemp 2>/dev/null || echo /tmp/.batch.$$)']
+  for index, cmd in enumerate(cmds):
+    parts.append("echo '%s'" % _marker(token, index, "OUT"))
+    # Subshell, so "exit" or "cd" in a command do not affect the others.
+    parts.append('( %s\n) 2>"$__batch_err"' % cmd)
+    parts.append('__batch_rc=$?')
+    parts.append("echo")
+    parts.append('echo "%s $__batch_rc"' % _marker(token, index, "RC"))
+    parts.append('cat "$__batch_err"')
+    parts.append("echo")
+    parts.append("echo '%s'" % _marker(token, index, "END"))
+  parts.append('rm -f "$__batch_err"')
+  return "; ".join(parts)
+
+
+def parse_batch_output(stdout, num_cmds, token):
+  """
+  Splits the output of build_batch_script() into per command results.
+
+  Returns:
+    list of (ret, stdout, stderr), with None for commands whose frame is
+    missing, e.g. because the session died part way.
+  """
+  results = [None] * num_cmds
+  pos = 0
+  for index in range(num_cmds):
+    out_marker = _marker(token, index, "OUT") + "\n"
+    rc_marker = "\n" + _marker(token, index, "RC") + " "
+    end_marker = "\n" + _marker(token, index, "END") + "\n"
+    start = stdout.find(out_marker, pos)
+    if start < 0:
+      break
+    start += len(out_marker)
+    rc_start = stdout.find(rc_marker, start)
+    if rc_start < 0:
+      break
+    rc_end = stdout.find("\n", rc_start + len(rc_marker))
+    end = stdout.find(end_marker, rc_end)
+    if rc_end < 0 or end < 0:
+      break
+    try:
+      ret = int(stdout[rc_start + len(rc_marker):rc_end])
+    except ValueError:
+      break
+    results[index] = (ret, stdout[start:rc_start], stdout[rc_end + 1:end])
+    pos = end + len(end_marker)
+  return results
+
+
+def execute_batch(ssh_client, cmds):
+  """
+  Runs cmds over ssh_client in one remote invocation.
+
+  Args:
+    ssh_client (SSHClient): Client connected to the host.
+    cmds (list): Shell commands to run, in order. Each command runs even if
+      the previous one failed.
+
+  Returns:
+    list of (ret, stdout, stderr), one per command. Commands that produced no
+    result, e.g. because SSH failed, get the ret and stderr of the whole
+    invocation.
+  """
+  if not cmds:
+    return []
+  token = uuid.uuid4().hex
+  ret, stdout, stderr = ssh_client.execute(build_batch_script(cmds, token))
+  results = parse_batch_output(stdout or "", len(cmds), token)
+  failed_ret = ret if ret != 0 else -1
+  return [result if result is not None else (failed_ret, "", stderr)
+          for result in results]
@@ -0,0 +1,301 @@
+"""
+esxcli queries through the most compact output formatter a host supports.
+
+--formatter=xml output is several times larger than the data it carries and
+decoding it means walking <structure>/<field>/<value> elements of every row.
+The json and csv formatters carry the same rows in a fraction of the bytes
+and decode in C. EsxcliSchema lists the columns of a command as its
+meta-data-field does, with their types, and decodes rows of any of the three
+formatters into the same dicts of field name to typed value. run_queries()
+asks for esxcli_formatter output and falls back to XML for commands a host
+rejects that formatter for, or whose output fails to decode, but not for
+commands that failed for other reasons.
+"""
+
+from collections import namedtuple
+import csv
+import io
+import json
+import re
+import threading
+
+from esxcli_batch import execute_batch
+from ssh_scheduler import SSH_CONNECTION_ERROR_RET
+from xml_parse_interface_list import iter_esxcli_structures
+
+__all__ = [
+    "EsxcliQuery",
+    "EsxcliSchema",
+    "FORMATTER_CSV",
+    "FORMATTER_JSON",
+    "FORMATTER_XML",
+    "decode_esxcli_output",
+    "decode_output",
+    "fetch_outputs",
+    "run_queries",
+    "sniff_formatter",
+]
+
+FORMATTER_JSON = "json"
+FORMATTER_CSV = "csv"
+FORMATTER_XML = "xml"
+FORMATTERS = (FORMATTER_JSON, FORMATTER_CSV, FORMATTER_XML)
+
+# Formatter asked for first. XML is the fallback.
+esxcli_formatter = FORMATTER_JSON
+
+# Error output of esxcli rejecting a formatter it does not support.
+_FORMATTER_ERROR_RE = re.compile(r"formatter", re.IGNORECASE)
+
+# esxcli value types, as named by the XML formatter.
+TYPE_STRING = "string"
+TYPE_INTEGER = "integer"
+TYPE_BOOLEAN = "boolean"
+
+
+class EsxcliSchema(object):
+  """
+  Columns of the rows of an esxcli command.
+
+  Attributes:
+    columns (tuple): Field names, in the order of the meta-data-field of the
+      command, e.g. "MAC Address".
+    types (dict): Map of field name to TYPE_INTEGER or TYPE_BOOLEAN. Other
+      fields are strings.
+    keys (dict): Map of the key of a field in json and csv output, its name
+      without spaces, to the field name.
+  """
+  __slots__ = ("columns", "types", "keys")
+
+  def __init__(self, columns, types=None):
+    """
+    columns is a list of field names or the comma separated value of the
+    meta-data-field of the command.
+    """
+    if isinstance(columns, str):
+      columns = columns.split(",")
+    self.columns = tuple(columns)
+    self.types = dict(types or {})
+    self.keys = dict((field.replace(" ", ""), field) for field in self.columns)
+
+  def decode_text(self, field, text):
+    """
+    Returns the typed value of field from its csv text. Empty text is None,
+    whatever the type: the XML formatter reports empty values as empty
+    elements.
+    """
+    if not text:
+      return None
+    kind = self.types.get(field, TYPE_STRING)
+    if kind == TYPE_INTEGER:
+      return int(text)
+    if kind == TYPE_BOOLEAN:
+      return text == "true"
+    return text
+
+  def iter_json(self, output, fields=None):
+    """
+    Yields the rows of --formatter=json output.
+    """
+    data = json.loads(output)
+    if isinstance(data, dict):
+      data = [data]
+    wanted = frozenset(fields) if fields is not None else None
+    for obj in data:
+      row = {}
+      for key, value in obj.items():
+        field = self.keys.get(key)
+        if field is None or (wanted is not None and field not in wanted):
+          continue
+        if value == "":
+          value = None
+        row[field] = value
+      yield row
+
+  def iter_csv(self, output, fields=None):
+    """
+    Yields the rows of --formatter=csv output, whose first line holds the
+    keys of the columns.
+    """
+    reader = csv.reader(io.StringIO(output))
+    header = next(reader, None)
+    if header is None:
+      return
+    wanted = frozenset(fields) if fields is not None else None
+    # Index and field name of the columns to decode. esxcli ends every line
+    # with a comma, the empty column after it is skipped.
+    columns = []
+    for index, key in enumerate(header):
+      field = self.keys.get(key)
+      if field is not None and (wanted is None or field in wanted):
+        columns.append((index, field))
+    for values in reader:
+      if not values:
+        continue
+      yield dict((field, self.decode_text(field, values[index]))
+                 for index, field in columns if index < len(values))
+
+  def iter_rows(self, output, formatter, fields=None):
+    """
+    Yields the rows of output of formatter as dicts of field name to value.
+    Only fields are kept, if given.
+    """
+    if formatter == FORMATTER_JSON:
+      return self.iter_json(output, fields)
+    if formatter == FORMATTER_CSV:
+      return self.iter_csv(_as_text(output), fields)
+    return iter_esxcli_structures(output, fields)
+
+
+def _as_text(output):
+  return output.decode("utf-8") if isinstance(output, bytes) else output
+
+
+def sniff_formatter(output):
+  """
+  Returns the formatter that produced esxcli output given as text or bytes.
+  """
+  head = _as_text(output[:64]).lstrip()
+  if head.startswith("<"):
+    return FORMATTER_XML
+  if head.startswith(("[", "{")):
+    return FORMATTER_JSON
+  return FORMATTER_CSV
+
+
+def decode_esxcli_output(output, schema, fields=None, formatter=None):
+  """
+  Returns the rows of esxcli output as a list of dicts of field name to
+  value. The formatter is guessed from the output if not given.
+  """
+  if formatter is None:
+    formatter = sniff_formatter(output)
+  return list(schema.iter_rows(output, formatter, fields))
+
+
+class EsxcliQuery(namedtuple("EsxcliQuery", ["command", "schema", "fields"])):
+  """
+  An esxcli command, e.g. "network ip interface list", with the schema of
+  its rows and the fields to keep, None for all of them.
+  """
+  __slots__ = ()
+
+  def cmd(self, formatter):
+    return "localcli --formatter=%s %s" % (formatter, self.command)
+
+
+# (host_ip, command) the host rejected esxcli_formatter for, or whose output
+# in it failed to decode, those are asked for XML right away.
+_xml_only = set()
+_xml_only_lock = threading.Lock()
+
+def run_queries(ssh_client, queries, formatter=None):
+  """
+  Runs queries over ssh_client in one remote invocation, in formatter output,
+  esxcli_formatter by default. Queries the host rejects formatter for, or
+  whose output fails to decode, are run again in one invocation with XML
+  output, see _to_retry(). Other failures are returned as they are.
+
+  Returns:
+    list with, per query, (True, list of rows) or (False, error message).
+  """
+  formatter = formatter or esxcli_formatter
+  host_ip = getattr(ssh_client, "host_ip", None)
+  formatters = _formatters_of(host_ip, queries, formatter)
+  fetched, rejected = _fetch(ssh_client, queries, formatters)
+  results = [_decode_result(query, result) for query, result in
+             zip(queries, fetched)]
+  # Output that fetched but does not decode is as good as rejected.
+  rejected.update(index for index, (ret, _) in enumerate(results)
+                  if not ret and fetched[index][0])
+  retry = _to_retry(host_ip, queries, formatters, rejected)
+  if retry:
+    retried, _ = _fetch(ssh_client, [queries[index] for index in retry],
+                        [FORMATTER_XML] * len(retry))
+    for index, result in zip(retry, retried):
+      results[index] = _decode_result(queries[index], result)
+  return results
+
+def fetch_outputs(ssh_client, queries, formatter=None):
+  """
+  Runs queries like run_queries() but leaves their output undecoded, for
+  callers decoding it elsewhere, e.g. in another process. Only queries the
+  host rejects formatter for are run again with XML output.
+
+  Returns:
+    list with, per query, (True, (formatter, output)) or (False, error
+    message).
+  """
+  formatter = formatter or esxcli_formatter
+  host_ip = getattr(ssh_client, "host_ip", None)
+  formatters = _formatters_of(host_ip, queries, formatter)
+  results, rejected = _fetch(ssh_client, queries, formatters)
+  retry = _to_retry(host_ip, queries, formatters, rejected)
+  if retry:
+    retried, _ = _fetch(ssh_client, [queries[index] for index in retry],
+                        [FORMATTER_XML] * len(retry))
+    for index, result in zip(retry, retried):
+      results[index] = result
+  return results
+
+def decode_output(query, formatter, output):
+  """
+  Returns the rows of the output of query in formatter, as fetched by
+  fetch_outputs().
+  """
+  return list(query.schema.iter_rows(output, formatter, query.fields))
+
+def _formatters_of(host_ip, queries, formatter):
+  with _xml_only_lock:
+    return [FORMATTER_XML if (host_ip, query.command) in _xml_only
+            else formatter for query in queries]
+
+def _to_retry(host_ip, queries, formatters, rejected):
+  """
+  Returns the indexes of the queries in rejected, whose formatter the host
+  rejected or whose output failed to decode, to run again with XML output,
+  and remembers to ask for XML right away next time. Other failures, e.g.
+  of ssh or of the command itself, say nothing about the formatter, and
+  demoting them would make the host pay for XML for good.
+  """
+  retry = sorted(index for index in rejected
+                 if formatters[index] != FORMATTER_XML)
+  if retry:
+    with _xml_only_lock:
+      _xml_only.update((host_ip, queries[index].command) for index in retry)
+  return retry
+
+def _fetch(ssh_client, queries, formatters):
+  """
+  Returns the list of (True, (formatter, output)) or (False, error message)
+  of queries, and the set of indexes of the queries the host rejected their
+  formatter for. Queries ssh failed to run are never in it: the connection
+  failed or was lost, no ssh slot was granted in time, or the output of the
+  batch lacks their result.
+  """
+  results = []
+  rejected = set()
+  outputs = execute_batch(ssh_client, [query.cmd(formatter) for query, formatter
+                                       in zip(queries, formatters)])
+  for index, (query, formatter, (ret, out, err)) in enumerate(
+      zip(queries, formatters, outputs)):
+    if (ret > 0 and ret != SSH_CONNECTION_ERROR_RET and
+        _FORMATTER_ERROR_RE.search("%s\n%s" % (err, out))):
+      rejected.add(index)
+    if ret != 0:
+      results.append((False, "failed in executing %s, ret %s err %s" %
+                      (query.command, ret, err)))
+    else:
+      results.append((True, (formatter, out)))
+  return results, rejected
+
+def _decode_result(query, result):
+  ret, value = result
+  if not ret:
+    return result
+  formatter, output = value
+  try:
+    return (True, decode_output(query, formatter, output))
+  except Exception as ex:
+    return (False, "failed decoding %s output of %s: %s" %
+            (formatter, query.command, ex))
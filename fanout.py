@@ -0,0 +1,127 @@
+"""
+Concurrent cluster wide portgroup validation.
+
+validate_portgroups_on_hosts() runs validate_nsx_t_portgroup() for every
+(host, portgroup) pair concurrently, bounding the number of concurrent
+validations per vCenter and per host, and yields the results as they finish.
+A validation is only started once its host and vCenter have a free slot, so
+no thread waits on a busy host while validations of idle hosts could run.
+"""
+
+from collections import deque
+import queue
+import threading
+import time
+
+__all__ = [
+    "validate_portgroups_on_hosts",
+]
+
+fanout_max_workers = 32
+fanout_max_per_vcenter = 16
+fanout_max_per_host = 2
+
+deadline_exceeded_msg = "deadline exceeded"
+
+
+def validate_portgroups_on_hosts(hosts, portgroups, validate_func=None,
+                                 vcenter_of=None,
+                                 max_workers=fanout_max_workers,
+                                 max_per_vcenter=fanout_max_per_vcenter,
+                                 max_per_host=fanout_max_per_host,
+                                 deadline_secs=None):
+  """
+  Validates every portgroup on every host concurrently.
+
+  Args:
+    hosts (list): IP addresses of the hosts.
+    portgroups (list): Names of the portgroups to validate on each host.
+    validate_func (callable): Called as validate_func(host_ip, portgroup),
+      returns (ret, msg). Defaults to client.validate_nsx_t_portgroup.
+    vcenter_of (callable): Maps a host IP to the vCenter managing it, used to
+      group hosts for max_per_vcenter. If None, all hosts share one group.
+    max_workers (int): Maximum number of validations in flight.
+    max_per_vcenter (int): Maximum validations in flight per vCenter.
+    max_per_host (int): Maximum validations in flight per host.
+    deadline_secs (float): Overall time budget, or None for no deadline.
+      Validations not finished in time are reported as failed.
+
+  Yields:
+    (host_ip, portgroup, ret, msg) as each validation finishes.
+  """
+  if validate_func is None:
+    from client import validate_nsx_t_portgroup as validate_func
+  vcenter_of = vcenter_of or (lambda host_ip: None)
+  deadline = None if deadline_secs is None else time.time() + deadline_secs
+
+  # Map of host IP to the portgroups left to start on it.
+  waiting = {}
+  for host_ip in hosts:
+    waiting.setdefault(host_ip, deque()).extend(portgroups)
+  vcenters = dict((host_ip, vcenter_of(host_ip)) for host_ip in waiting)
+  # Hosts with portgroups left to start, in round robin order.
+  rotation = deque(host_ip for host_ip, left in waiting.items() if left)
+  running_per_host = dict((host_ip, 0) for host_ip in waiting)
+  running_per_vcenter = dict((vcenter, 0) for vcenter in vcenters.values())
+  running = []
+  results = queue.Queue()
+
+  def run(host_ip, portgroup):
+    try:
+      ret, msg = validate_func(host_ip, portgroup)
+    except Exception as ex:
+      ret, msg = (False, "host: %s portgroup: %s validation failed %s" %
+                  (host_ip, portgroup, ex))
+    results.put((host_ip, portgroup, ret, msg))
+
+  def start_ready():
+    """
+    Starts validations, one host at a time round robin, until the overall
+    limit is reached or no host and vCenter with work left has a free slot.
+    """
+    skipped = 0
+    while rotation and len(running) < max_workers and skipped < len(rotation):
+      host_ip = rotation[0]
+      vcenter = vcenters[host_ip]
+      if (running_per_host[host_ip] >= max_per_host or
+          running_per_vcenter[vcenter] >= max_per_vcenter):
+        rotation.rotate(-1)
+        skipped += 1
+        continue
+      skipped = 0
+      portgroup = waiting[host_ip].popleft()
+      if waiting[host_ip]:
+        rotation.rotate(-1)
+      else:
+        rotation.popleft()
+      running_per_host[host_ip] += 1
+      running_per_vcenter[vcenter] += 1
+      running.append((host_ip, portgroup))
+      # Daemon threads, so validations still running past the deadline or an
+      # interrupt do not hold up the exit of the process.
+      thread = threading.Thread(target=run, args=(host_ip, portgroup),
+                                name="fanout-%s" % host_ip)
+      thread.daemon = True
+      thread.start()
+
+  start_ready()
+  while running:
+    timeout = None if deadline is None else max(0, deadline - time.time())
+    try:
+      result = results.get(timeout=timeout)
+    except queue.Empty:
+      break
+    host_ip = result[0]
+    running.remove(result[:2])
+    running_per_host[host_ip] -= 1
+    running_per_vcenter[vcenters[host_ip]] -= 1
+    if deadline is None or time.time() < deadline:
+      start_ready()
+    yield result
+
+  # Past the deadline, the validations running and not started yet fail.
+  for host_ip, portgroup in running:
+    yield (host_ip, portgroup, False, deadline_exceeded_msg)
+  for host_ip, left in waiting.items():
+    for portgroup in left:
+      yield (host_ip, portgroup, False, deadline_exceeded_msg)
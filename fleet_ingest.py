@@ -0,0 +1,473 @@
+"""
+Pipelined ingestion of the interface tables of a fleet of hosts.
+
+Gathering the interfaces of many hosts one host at a time serializes their
+SSH round trips, and once those run concurrently, decoding every output on
+one thread under the GIL becomes the bottleneck past a hundred hosts.
+ingest_interface_tables() runs three stages connected by bounded queues:
+fetch threads run the esxcli queries of many hosts at once, a process pool
+decodes their output, and the calling thread merges the decoded tables into
+a FleetInterfaceIndex as they arrive. A full queue blocks the stage feeding
+it, so a slow parse stage throttles fetching instead of buffering the output
+of the whole fleet. The throughput of every stage is reported in StageStats.
+
+Parse processes are started by a forkserver, or spawned where there is none,
+never forked from this process, whose other threads may hold locks a forked
+child would inherit locked. The pool is kept for the next ingestion.
+"""
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+import os
+import queue
+import threading
+import time
+
+from instrumentation import record
+from interface_table import INDEXED_ATTRS, HostInterfaceTable
+from lazy_import import LazyImport
+
+log = LazyImport("util.base", "log")
+
+__all__ = [
+    "FleetInterfaceIndex",
+    "StageStats",
+    "ingest_interface_tables",
+    "parse_interface_outputs",
+    "shutdown_parse_pool",
+]
+
+STAGE_FETCH = "fetch"
+STAGE_PARSE = "parse"
+STAGE_INDEX = "index"
+STAGES = (STAGE_FETCH, STAGE_PARSE, STAGE_INDEX)
+
+# Hosts fetched concurrently. The SSH scheduler caps sessions further.
+fleet_fetch_workers = 32
+# Parse processes, os.cpu_count() if None. 0 parses on a thread of this
+# process instead.
+fleet_parse_workers = None
+# Capacity of each queue between stages, in hosts.
+fleet_queue_size = 16
+
+# Attributes the fleet index is searched by.
+FLEET_INDEXED_ATTRS = INDEXED_ATTRS + ("ipv4_address",)
+
+# End of stream marker put on a queue by the last producer of a stage.
+_DONE = object()
+
+
+class StageStats(object):
+  """
+  Throughput of one pipeline stage.
+
+  Attributes:
+    name (str): STAGE_FETCH, STAGE_PARSE or STAGE_INDEX.
+    items (int): Hosts the stage finished, successfully or not.
+    failures (int): Hosts the stage failed.
+    output_len (int): Length of the esxcli output the stage handled.
+    busy_secs (float): Time spent on hosts, summed over the workers.
+    blocked_secs (float): Time spent waiting for room in the next queue.
+    started_at (float): When work on the first host started, or None.
+    finished_at (float): When work on the last host finished, or None.
+  """
+
+  def __init__(self, name):
+    self.name = name
+    self.items = 0
+    self.failures = 0
+    self.output_len = 0
+    self.busy_secs = 0.0
+    self.blocked_secs = 0.0
+    self.started_at = None
+    self.finished_at = None
+    self._lock = threading.Lock()
+
+  def add(self, host_ip, busy_secs, output_len=0, ok=True):
+    """
+    Records a host the stage finished, after busy_secs of work.
+    """
+    now = time.time()
+    with self._lock:
+      self.items += 1
+      self.failures += 0 if ok else 1
+      self.output_len += output_len
+      self.busy_secs += busy_secs
+      if self.started_at is None or now - busy_secs < self.started_at:
+        self.started_at = now - busy_secs
+      self.finished_at = now
+    record("ingest", host_ip, self.name, "ok" if ok else "error", busy_secs)
+
+  def add_blocked(self, blocked_secs):
+    with self._lock:
+      self.blocked_secs += blocked_secs
+
+  @property
+  def wall_secs(self):
+    if self.started_at is None:
+      return 0.0
+    return self.finished_at - self.started_at
+
+  @property
+  def items_per_sec(self):
+    wall_secs = self.wall_secs
+    return self.items / wall_secs if wall_secs else 0.0
+
+  def to_dict(self):
+    """
+    Returns the stats as a JSON serializable dict.
+    """
+    return {"name": self.name, "items": self.items,
+            "failures": self.failures, "output_len": self.output_len,
+            "busy_secs": self.busy_secs, "blocked_secs": self.blocked_secs,
+            "wall_secs": self.wall_secs, "items_per_sec": self.items_per_sec}
+
+  def __str__(self):
+    return ("%s: %d hosts, %d failed, %.1f hosts/s, busy %.3fs, "
+            "blocked %.3fs" % (self.name, self.items, self.failures,
+                               self.items_per_sec, self.busy_secs,
+                               self.blocked_secs))
+
+
+class FleetInterfaceIndex(object):
+  """
+  Interface tables of many hosts, merged into indexes searching all of them.
+
+  Attributes:
+    tables (dict): Map of host IP to HostInterfaceTable.
+    errors (dict): Map of host IP to the error of its last failed ingestion.
+      A host keeps the table of its last successful one, if any.
+  """
+
+  def __init__(self):
+    self.tables = {}
+    self.errors = {}
+    self._lock = threading.Lock()
+    self._indexes = dict((attr, {}) for attr in FLEET_INDEXED_ATTRS)
+
+  def __len__(self):
+    return len(self.tables)
+
+  def add(self, host_ip, table):
+    """
+    Adds the HostInterfaceTable of host_ip, replacing its previous one.
+    """
+    with self._lock:
+      previous = self.tables.get(host_ip)
+      if previous is not None:
+        self._remove_locked(host_ip, previous)
+      self.tables[host_ip] = table
+      self.errors.pop(host_ip, None)
+      for record in table.records:
+        for attr in FLEET_INDEXED_ATTRS:
+          value = getattr(record, attr)
+          if value is not None:
+            self._indexes[attr].setdefault(value, []).append(
+                (host_ip, record))
+
+  def _remove_locked(self, host_ip, table):
+    for attr, index in self._indexes.items():
+      for value in set(getattr(record, attr) for record in table.records):
+        entries = index.get(value)
+        if entries is None:
+          continue
+        entries[:] = [entry for entry in entries if entry[0] != host_ip]
+        if not entries:
+          del index[value]
+
+  def add_error(self, host_ip, msg):
+    with self._lock:
+      self.errors[host_ip] = msg
+
+  def table(self, host_ip):
+    """
+    Returns the HostInterfaceTable of host_ip, or None.
+    """
+    with self._lock:
+      return self.tables.get(host_ip)
+
+  def lookup(self, attr, value):
+    """
+    Returns (host IP, InterfaceRecord) of every interface of the fleet whose
+    attr equals value.
+    """
+    with self._lock:
+      return list(self._indexes[attr].get(value, ()))
+
+  def find(self, attr, value):
+    """
+    Returns the first (host IP, InterfaceRecord) whose attr equals value, or
+    None.
+    """
+    matches = self.lookup(attr, value)
+    return matches[0] if matches else None
+
+  def by_external_id(self, external_id):
+    return self.find("external_id", external_id)
+
+  def by_mac(self, mac):
+    return self.find("mac", mac)
+
+  def by_ip_address(self, ip_address):
+    return self.find("ipv4_address", ip_address)
+
+
+def parse_interface_outputs(host_ip, outputs):
+  """
+  Parse stage task, run in a worker process. Decodes the (formatter, output)
+  list returned by fetch_host_interface_outputs() for host_ip.
+
+  Returns:
+    (host_ip, ret, rows or error message, parse seconds), rows being the
+    HostInterfaceTable.to_dicts() of the host.
+  """
+  start = time.time()
+  try:
+    ret, value = True, HostInterfaceTable.from_outputs(outputs).to_dicts()
+  except Exception as ex:
+    ret, value = False, "failed decoding interfaces of %s: %s" % (host_ip, ex)
+  return (host_ip, ret, value, time.time() - start)
+
+
+_parse_pool = None
+_parse_pool_workers = None
+_parse_pool_lock = threading.Lock()
+
+def _mp_context():
+  if "forkserver" in multiprocessing.get_all_start_methods():
+    return multiprocessing.get_context("forkserver")
+  return multiprocessing.get_context("spawn")
+
+def _parse_executor(parse_workers):
+  """
+  Returns the executor of the parse stage: the process wide pool of
+  parse_workers processes, created on first use or when the previous one
+  broke or had another size, or a thread of this process if parse_workers
+  is 0 or no process can be started.
+  """
+  global _parse_pool, _parse_pool_workers
+  if parse_workers:
+    with _parse_pool_lock:
+      if _parse_pool is not None and _parse_pool_workers == parse_workers:
+        return _parse_pool
+      if _parse_pool is not None:
+        _parse_pool.shutdown(wait=False)
+        _parse_pool = None
+      try:
+        _parse_pool = ProcessPoolExecutor(max_workers=parse_workers,
+                                          mp_context=_mp_context())
+        _parse_pool_workers = parse_workers
+        return _parse_pool
+      except Exception as ex:
+        log.WARNING("Parsing interfaces in process, no worker processes: %s"
+                    % ex)
+  return ThreadPoolExecutor(max_workers=1)
+
+def _discard_parse_executor(executor):
+  """
+  Drops executor, if it is the process wide pool, after one of its worker
+  processes died, so the next ingestion starts a new one.
+  """
+  global _parse_pool
+  with _parse_pool_lock:
+    if executor is _parse_pool:
+      _parse_pool = None
+  executor.shutdown(wait=False)
+
+def shutdown_parse_pool():
+  """
+  Stops the worker processes of the parse stage.
+  """
+  global _parse_pool
+  with _parse_pool_lock:
+    pool, _parse_pool = _parse_pool, None
+  if pool is not None:
+    pool.shutdown(wait=True)
+
+
+def _output_len(outputs):
+  return sum(len(output) for _, output in outputs)
+
+
+def _put(to_queue, item, stats):
+  """
+  Puts item on to_queue, charging the time spent waiting for room in it to
+  the stats of the stage putting it.
+  """
+  try:
+    to_queue.put_nowait(item)
+    return
+  except queue.Full:
+    pass
+  start = time.time()
+  to_queue.put(item)
+  stats.add_blocked(time.time() - start)
+
+
+def ingest_interface_tables(hosts, fetch_func, index=None, on_table=None,
+                            fetch_workers=fleet_fetch_workers,
+                            parse_workers=fleet_parse_workers,
+                            queue_size=fleet_queue_size):
+  """
+  Fetches, decodes and indexes the interface tables of hosts in a pipeline.
+
+  Args:
+    hosts (list): IP addresses of the hosts.
+    fetch_func (callable): Called as fetch_func(host_ip) from fetch threads,
+      returns (True, outputs) of fetch_host_interface_outputs() or (False,
+      error message).
+    index (FleetInterfaceIndex): Index the tables are added to, a new one if
+      None.
+    on_table (callable): Called as on_table(host_ip, table, rows) for every
+      table added, rows being table.to_dicts().
+    fetch_workers (int): Maximum hosts fetched concurrently.
+    parse_workers (int): Parse processes, os.cpu_count() if None, or 0 to
+      parse on a thread of this process.
+    queue_size (int): Capacity of each queue between stages, in hosts.
+
+  Returns:
+    (FleetInterfaceIndex, dict of stage name to StageStats).
+  """
+  if index is None:
+    index = FleetInterfaceIndex()
+  stats = dict((name, StageStats(name)) for name in STAGES)
+  hosts = list(hosts)
+  if not hosts:
+    return (index, stats)
+  if parse_workers is None:
+    parse_workers = os.cpu_count() or 1
+  fetch_workers = max(1, min(fetch_workers, len(hosts)))
+
+  host_queue = queue.Queue()
+  for host_ip in hosts:
+    host_queue.put(host_ip)
+  parse_queue = queue.Queue(maxsize=queue_size)
+  # Parses submitted and not collected yet, in submission order.
+  parsing_queue = queue.Queue(maxsize=max(1, parse_workers) * 2)
+  index_queue = queue.Queue(maxsize=queue_size)
+  stopped = threading.Event()
+  broken = threading.Event()
+  fetchers_lock = threading.Lock()
+  fetchers_left = [fetch_workers]
+
+  def fetch():
+    try:
+      while not stopped.is_set():
+        try:
+          host_ip = host_queue.get_nowait()
+        except queue.Empty:
+          return
+        start = time.time()
+        try:
+          ret, value = fetch_func(host_ip)
+        except Exception as ex:
+          ret, value = False, "failed fetching interfaces of %s: %s" % (
+              host_ip, ex)
+        stats[STAGE_FETCH].add(host_ip, time.time() - start,
+                               _output_len(value) if ret else 0, ret)
+        _put(parse_queue, (host_ip, ret, value), stats[STAGE_FETCH])
+    finally:
+      with fetchers_lock:
+        fetchers_left[0] -= 1
+        last = fetchers_left[0] == 0
+      if last:
+        parse_queue.put(_DONE)
+
+  def dispatch():
+    try:
+      while True:
+        item = parse_queue.get()
+        if item is _DONE:
+          break
+        host_ip, ret, value = item
+        if ret:
+          try:
+            future = executor.submit(parse_interface_outputs, host_ip, value)
+          except Exception as ex:
+            # E.g. BrokenProcessPool, a worker process died. The remaining
+            # hosts fail the same way, the stages keep draining.
+            if isinstance(ex, BrokenProcessPool):
+              broken.set()
+            _put(parsing_queue, (host_ip, None,
+                                 "failed parsing interfaces of %s: %s" %
+                                 (host_ip, ex)), stats[STAGE_PARSE])
+            continue
+          _put(parsing_queue, (host_ip, future, _output_len(value)),
+               stats[STAGE_PARSE])
+        else:
+          _put(parsing_queue, (host_ip, None, value), stats[STAGE_PARSE])
+    finally:
+      parsing_queue.put(_DONE)
+
+  def collect():
+    while True:
+      item = parsing_queue.get()
+      if item is _DONE:
+        break
+      host_ip, future, value = item
+      if future is None:
+        # Failed fetches pass through to be recorded by the index stage.
+        _put(index_queue, (host_ip, False, value), stats[STAGE_PARSE])
+        continue
+      output_len = value
+      try:
+        _, ret, value, parse_secs = future.result()
+      except Exception as ex:
+        # E.g. a worker process died.
+        if isinstance(ex, BrokenProcessPool):
+          broken.set()
+        ret, parse_secs = False, 0.0
+        value = "failed parsing interfaces of %s: %s" % (host_ip, ex)
+      stats[STAGE_PARSE].add(host_ip, parse_secs, output_len, ret)
+      _put(index_queue, (host_ip, ret, value), stats[STAGE_PARSE])
+    index_queue.put(_DONE)
+
+  executor = _parse_executor(parse_workers)
+  threads = [threading.Thread(target=fetch, name="ingest-fetch-%d" % number)
+             for number in range(fetch_workers)]
+  threads.append(threading.Thread(target=dispatch, name="ingest-dispatch"))
+  threads.append(threading.Thread(target=collect, name="ingest-collect"))
+  for thread in threads:
+    thread.daemon = True
+    thread.start()
+
+  done = False
+  try:
+    while True:
+      item = index_queue.get()
+      if item is _DONE:
+        done = True
+        break
+      host_ip, ret, value = item
+      start = time.time()
+      if ret:
+        table = HostInterfaceTable.from_dicts(value)
+        index.add(host_ip, table)
+        if on_table:
+          try:
+            on_table(host_ip, table, value)
+          except Exception as ex:
+            log.ERROR("Failed handling interfaces of %s: %s" % (host_ip, ex))
+      else:
+        log.ERROR(value)
+        index.add_error(host_ip, value)
+      stats[STAGE_INDEX].add(host_ip, time.time() - start, ok=ret)
+  finally:
+    if not done:
+      # Let the stages run out on the hosts already fetched.
+      stopped.set()
+      while index_queue.get() is not _DONE:
+        pass
+    for thread in threads:
+      thread.join()
+    if broken.is_set():
+      _discard_parse_executor(executor)
+    elif not isinstance(executor, ProcessPoolExecutor):
+      executor.shutdown(wait=True)
+
+  indexed = stats[STAGE_INDEX]
+  log.INFO("Ingested interfaces of %d of %d hosts: %s" % (
+      indexed.items - indexed.failures, len(hosts),
+      "; ".join(str(stats[name]) for name in STAGES)))
+  return (index, stats)
@@ -0,0 +1,286 @@
+"""
+Event driven cache of the network inventory of a host.
+
+HostNetworkInventory fills itself with one WaitForUpdatesEx() call and then
+keeps a background thread waiting for incremental updates on a private
+PropertyCollector. Every applied update set produces a new immutable
+InventorySnapshot with a higher version, so readers get a consistent view of
+vnics, proxy switches and portgroups without any SOAP call.
+
+An inventory lives as long as the session it follows updates over: the
+session pool stops the inventories of a session before logging it out.
+"""
+
+import threading
+import time
+
+from host_network import (HOST_PROPERTIES, PORTGROUP_PROPERTIES,
+                          build_host_network_filter_spec,
+                          compact_host_property, snapshot_from_properties)
+from lazy_import import LazyImport
+from liveness import stub_timeout
+
+log = LazyImport("util.base", "log")
+vim = LazyImport("pyVmomi", "vim")
+vmodl = LazyImport("pyVmomi", "vmodl")
+
+__all__ = [
+    "HostNetworkInventory",
+    "InventorySnapshot",
+    "find_host_network_inventory",
+    "get_host_network_inventory",
+    "stop_host_network_inventories",
+]
+
+INVENTORY_HOST_PROPERTIES = HOST_PROPERTIES + ["config.network.vnic",
+                                               "hardware.systemInfo.uuid"]
+# Longest a WaitForUpdatesEx() call blocks.
+inventory_max_wait_secs = 60
+# The socket timeout of a WaitForUpdatesEx() call exceeds max_wait_secs by
+# this much, whatever shorter timeout other callers of the session set.
+inventory_wait_margin_secs = 30
+
+
+class InventorySnapshot(object):
+  """
+  Consistent view of the host network inventory.
+
+  Attributes:
+    version (int): Incremented for every update set applied.
+    updated_at (float): Time the snapshot was built.
+    network (HostNetworkSnapshot): Portgroups and transport zones.
+    vnics (tuple): VnicRecord of the vmkernel NICs of the host.
+    host_uuid (str): Hardware UUID of the host.
+  """
+  __slots__ = ("version", "updated_at", "network", "vnics", "host_uuid")
+
+  def __init__(self, version, network, vnics, host_uuid=None):
+    self.version = version
+    self.updated_at = time.time()
+    self.network = network
+    self.vnics = vnics
+    self.host_uuid = host_uuid
+
+
+class HostNetworkInventory(object):
+  """
+  Keeps INVENTORY_HOST_PROPERTIES of a host and PORTGROUP_PROPERTIES of its
+  portgroups current through PropertyCollector WaitForUpdatesEx().
+  """
+
+  def __init__(self, host_obj, property_collector=None,
+               max_wait_secs=inventory_max_wait_secs):
+    self.host_obj = host_obj
+    if property_collector is None:
+      property_collector = vim.ServiceInstance(
+          "ServiceInstance", host_obj._stub).content.propertyCollector
+    self._root_collector = property_collector
+    self._collector = None
+    self.max_wait_secs = max_wait_secs
+
+    self._lock = threading.Lock()
+    self._host_props = {}
+    # Map of portgroup moid to its properties.
+    self._portgroup_props = {}
+    self._pc_version = ""
+    self._snapshot = None
+    self._updated = threading.Condition(self._lock)
+    self._stop = threading.Event()
+    self._thread = None
+    self.error = None
+
+  def start(self):
+    """
+    Registers the filter, waits for the initial content and starts following
+    updates in the background. The private collector is destroyed if this
+    fails.
+    """
+    self._collector = self._root_collector.CreatePropertyCollector()
+    try:
+      spec = build_host_network_filter_spec(
+          self.host_obj, PORTGROUP_PROPERTIES, INVENTORY_HOST_PROPERTIES)
+      self._collector.CreateFilter(spec, partialUpdates=False)
+      self._wait_and_apply()
+    except Exception:
+      self.stop()
+      raise
+    self._thread = threading.Thread(target=self._run,
+                                    name="host-inventory-%s" %
+                                    self.host_obj._moId)
+    self._thread.daemon = True
+    self._thread.start()
+
+  def stop(self):
+    """
+    Stops following updates and destroys the private collector.
+    """
+    self._stop.set()
+    if self._collector:
+      try:
+        self._collector.CancelWaitForUpdates()
+      except Exception:
+        pass
+      try:
+        self._collector.Destroy()
+      except Exception:
+        pass
+      self._collector = None
+
+  def is_current(self):
+    """
+    Returns True while updates are being followed.
+    """
+    return (self._snapshot is not None and self.error is None and
+            not self._stop.is_set())
+
+  def snapshot(self):
+    """
+    Returns the latest InventorySnapshot. No SOAP call is made.
+    """
+    return self._snapshot
+
+  def wait_for_version(self, version, timeout_secs=None):
+    """
+    Blocks until a snapshot newer than version is available, or timeout_secs
+    passed. Returns the latest snapshot.
+    """
+    with self._updated:
+      if self._snapshot is None or self._snapshot.version <= version:
+        self._updated.wait(timeout_secs)
+      return self._snapshot
+
+  def _run(self):
+    while not self._stop.is_set():
+      try:
+        self._wait_and_apply()
+      except Exception as ex:
+        if not self._stop.is_set():
+          log.ERROR("Following network updates of host %s failed: %s" %
+                    (self.host_obj._moId, ex))
+          self.error = ex
+        return
+
+  def _wait_and_apply(self):
+    options = vmodl.query.PropertyCollector.WaitOptions(
+        maxWaitSeconds=self.max_wait_secs)
+    # The session is shared, e.g. with liveness probes setting a short
+    # timeout, see liveness.stub_timeout().
+    with stub_timeout(self.host_obj._stub,
+                      self.max_wait_secs + inventory_wait_margin_secs):
+      update_set = self._collector.WaitForUpdatesEx(self._pc_version,
+                                                    options)
+    if update_set is None:
+      # Nothing changed within max_wait_secs.
+      return
+    with self._updated:
+      for filter_update in update_set.filterSet or []:
+        for object_update in filter_update.objectSet or []:
+          self._apply_object_update(object_update)
+      self._pc_version = update_set.version
+      # A truncated update set is followed by the rest on the next call.
+      if not update_set.truncated or self._snapshot is None:
+        self._publish_locked()
+
+  def _apply_object_update(self, object_update):
+    obj = object_update.obj
+    is_host = isinstance(obj, vim.HostSystem)
+    if object_update.kind == "leave":
+      if not is_host:
+        self._portgroup_props.pop(obj._moId, None)
+      return
+    if is_host:
+      props = self._host_props
+    else:
+      props = self._portgroup_props.setdefault(obj._moId, {})
+    for change in object_update.changeSet or []:
+      if change.op in ("remove", "indirectRemove"):
+        props.pop(change.name, None)
+      elif is_host:
+        # Only keep the fields read from the pyVmomi objects, not their
+        # config trees.
+        props[change.name] = compact_host_property(change.name, change.val)
+      else:
+        props[change.name] = change.val
+
+  def _publish_locked(self):
+    version = self._snapshot.version + 1 if self._snapshot else 1
+    network = snapshot_from_properties(self._host_props,
+                                       self._portgroup_props)
+    vnics = tuple(self._host_props.get("config.network.vnic") or ())
+    self._snapshot = InventorySnapshot(
+        version, network, vnics,
+        self._host_props.get("hardware.systemInfo.uuid"))
+    self._updated.notify_all()
+
+
+_inventories = {}
+# Map of the IP a host object was connected through to the key of its
+# inventory in _inventories.
+_inventory_keys_by_ip = {}
+_inventories_lock = threading.Lock()
+# Map of inventory key to the lock held while its inventory starts, so the
+# SOAP calls of a start only hold up callers of the same host.
+_inventory_start_locks = {}
+
+def _inventory_key(host_obj):
+  stub = host_obj._stub
+  return (getattr(stub, "host", id(stub)), host_obj._moId)
+
+def get_host_network_inventory(host_obj, property_collector=None,
+                               host_ip=None):
+  """
+  Returns the process wide HostNetworkInventory of host_obj, starting it on
+  first use or if the previous one stopped following updates. If host_ip is
+  given, the inventory can later be found by it with
+  find_host_network_inventory().
+  """
+  key = _inventory_key(host_obj)
+  with _inventories_lock:
+    if host_ip:
+      _inventory_keys_by_ip[host_ip] = key
+    inventory = _inventories.get(key)
+    if inventory and inventory.is_current():
+      return inventory
+    start_lock = _inventory_start_locks.setdefault(key, threading.Lock())
+  with start_lock:
+    with _inventories_lock:
+      inventory = _inventories.get(key)
+    # Started by another caller meanwhile.
+    if inventory and inventory.is_current():
+      return inventory
+    if inventory:
+      inventory.stop()
+    inventory = HostNetworkInventory(host_obj, property_collector)
+    inventory.start()
+    with _inventories_lock:
+      _inventories[key] = inventory
+    return inventory
+
+def find_host_network_inventory(host_ip):
+  """
+  Returns the HostNetworkInventory registered for host_ip if it is following
+  updates, None otherwise. No SOAP call is made.
+  """
+  with _inventories_lock:
+    inventory = _inventories.get(_inventory_keys_by_ip.get(host_ip))
+  if inventory and inventory.is_current():
+    return inventory
+  return None
+
+def stop_host_network_inventories(stub):
+  """
+  Stops and forgets the inventories following updates over stub, e.g.
+  because its session is being logged out. The next
+  get_host_network_inventory() of those hosts starts a new one.
+
+  Returns:
+    Number of inventories stopped.
+  """
+  with _inventories_lock:
+    stopped = [(key, inventory) for key, inventory in _inventories.items()
+               if inventory.host_obj._stub is stub]
+    for key, _ in stopped:
+      del _inventories[key]
+  for _, inventory in stopped:
+    inventory.stop()
+  return len(stopped)
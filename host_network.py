@@ -0,0 +1,247 @@
+"""
+Bulk retrieval of the host network state used for NSX-T portgroup validation.
+
+Reading host_obj.network and then name/config of every portgroup costs one
+SOAP round trip per attribute access. retrieve_host_network_snapshot() fetches
+everything validate_nsx_t_portgroup() needs with a single RetrieveContents()
+call, and validate_portgroup_in_snapshot() runs the validation against it.
+"""
+
+from collections import namedtuple
+
+from lazy_import import LazyImport
+from records import (TransportZoneRecord, transport_zones_from_proxy_switches,
+                     vnic_record_from_vim)
+
+vim = LazyImport("pyVmomi", "vim")
+vmodl = LazyImport("pyVmomi", "vmodl")
+
+__all__ = [
+    "HostNetworkSnapshot",
+    "PortgroupInfo",
+    "build_host_network_filter_spec",
+    "compact_host_property",
+    "retrieve_host_network_snapshot",
+    "snapshot_from_dict",
+    "snapshot_from_properties",
+    "snapshot_to_dict",
+    "validate_portgroup_in_snapshot",
+]
+
+PORTGROUP_PROPERTIES = ["name", "config.backingType",
+                        "config.transportZoneUuid"]
+# Portgroup properties known to pyVmomi versions without NSX-T support.
+PORTGROUP_BASIC_PROPERTIES = ["name"]
+HOST_PROPERTIES = ["network", "config.network.proxySwitch"]
+
+unsupported_pyvim_client_msg = "pvVmomi version does not support nsx-t attributes"
+
+
+# Properties of a distributed virtual portgroup as seen from a host.
+# backing_type and transport_zone_uuid are None when the portgroup does not
+# set them. nsx_supported is False when the pyVmomi version in use does not
+# know about NSX-T attributes.
+PortgroupInfo = namedtuple("PortgroupInfo", [
+    "moid", "name", "backing_type", "transport_zone_uuid", "nsx_supported"])
+
+
+class HostNetworkSnapshot(object):
+  """
+  Point in time view of the networks of a host.
+
+  Attributes:
+    network_count (int): Number of networks (of any type) on the host.
+    portgroups (list): PortgroupInfo of the distributed virtual portgroups.
+    transport_zones (list): TransportZoneRecord of the transport zones of all
+      proxy switches, or None if pyVmomi does not expose transport zones.
+  """
+  __slots__ = ("network_count", "portgroups", "transport_zones")
+
+  def __init__(self, network_count, portgroups, transport_zones):
+    self.network_count = network_count
+    self.portgroups = portgroups
+    self.transport_zones = transport_zones
+
+
+def build_host_network_filter_spec(host_obj,
+                                   portgroup_properties=PORTGROUP_PROPERTIES,
+                                   host_properties=HOST_PROPERTIES):
+  """
+  Returns a PropertyFilterSpec selecting host_properties of host_obj and
+  portgroup_properties of every distributed virtual portgroup on it.
+  """
+  pc = vmodl.query.PropertyCollector
+  host_to_network = pc.TraversalSpec(name="hostToNetwork", type=vim.HostSystem,
+                                     path="network", skip=False)
+  obj_spec = pc.ObjectSpec(obj=host_obj, skip=False,
+                           selectSet=[host_to_network])
+  prop_set = [
+    pc.PropertySpec(type=vim.HostSystem, all=False, pathSet=host_properties),
+    pc.PropertySpec(type=vim.dvs.DistributedVirtualPortgroup, all=False,
+                    pathSet=portgroup_properties),
+  ]
+  return pc.FilterSpec(objectSet=[obj_spec], propSet=prop_set)
+
+
+def retrieve_host_network_snapshot(host_obj, property_collector=None):
+  """
+  Fetches the network state of host_obj in one RetrieveContents() call.
+
+  Args:
+    host_obj (vim.HostSystem): Host to query.
+    property_collector (vmodl.query.PropertyCollector): Collector to use. If
+      None, the collector of the service instance host_obj is bound to.
+
+  Returns:
+    HostNetworkSnapshot.
+  """
+  if property_collector is None:
+    property_collector = vim.ServiceInstance(
+        "ServiceInstance", host_obj._stub).content.propertyCollector
+  nsx_supported = True
+  try:
+    contents = property_collector.RetrieveContents(
+        [build_host_network_filter_spec(host_obj)])
+  except vmodl.query.InvalidProperty:
+    # Host or pyVmomi predates NSX-T portgroup attributes.
+    nsx_supported = False
+    contents = property_collector.RetrieveContents(
+        [build_host_network_filter_spec(host_obj, PORTGROUP_BASIC_PROPERTIES)])
+  return snapshot_from_object_contents(contents, nsx_supported=nsx_supported)
+
+
+def snapshot_from_object_contents(contents, nsx_supported=True):
+  """
+  Builds a HostNetworkSnapshot from the ObjectContent list returned for
+  build_host_network_filter_spec().
+  """
+  host_props = {}
+  portgroup_props = {}
+  for content in contents or []:
+    props = dict((prop.name, prop.val) for prop in content.propSet)
+    if isinstance(content.obj, vim.HostSystem):
+      host_props = dict((name, compact_host_property(name, val))
+                        for name, val in props.items())
+    elif isinstance(content.obj, vim.dvs.DistributedVirtualPortgroup):
+      portgroup_props[content.obj._moId] = props
+  return snapshot_from_properties(host_props, portgroup_props,
+                                  nsx_supported=nsx_supported)
+
+
+def compact_host_property(name, value):
+  """
+  Returns the value of host property name with the pyVmomi objects replaced
+  by what the client reads from them: moids of networks, TransportZoneRecord
+  of proxy switches, VnicRecord of vnics and the devices of the vnics
+  selected for management traffic.
+  """
+  if name == "network":
+    return tuple(network._moId for network in value or ())
+  if name == "config.network.proxySwitch":
+    return transport_zones_from_proxy_switches(value)
+  if name == "config.network.vnic":
+    return tuple(vnic_record_from_vim(vnic) for vnic in value or ())
+  if name == "config.virtualNicManagerInfo.netConfig":
+    return management_vnics(value)
+  return value
+
+
+def management_vnics(net_configs):
+  """
+  Returns the devices of the vnics selected for management traffic, from the
+  VirtualNicManagerNetConfig list of a host.
+  """
+  devices = []
+  for net_config in net_configs or ():
+    if net_config.nicType != "management":
+      continue
+    # Selected vnics are named "<nic type>.<vnic key>".
+    selected = set(net_config.selectedVnic or ())
+    for vnic in net_config.candidateVnic or ():
+      if "%s.%s" % (net_config.nicType, vnic.key) in selected:
+        devices.append(vnic.device)
+  return tuple(devices)
+
+
+def snapshot_from_properties(host_props, portgroup_props, nsx_supported=True):
+  """
+  Builds a HostNetworkSnapshot.
+
+  Args:
+    host_props (dict): HOST_PROPERTIES of the host, by property path, as
+      returned by compact_host_property().
+    portgroup_props (dict): Map of portgroup moid to its PORTGROUP_PROPERTIES
+      by property path.
+    nsx_supported (bool): Whether NSX-T portgroup properties were fetched.
+  """
+  network_count = len(host_props.get("network") or ())
+  transport_zones = host_props.get("config.network.proxySwitch", [])
+  portgroups = []
+  for moid, props in portgroup_props.items():
+    portgroups.append(PortgroupInfo(
+        moid, props.get("name"),
+        backing_type=props.get("config.backingType"),
+        transport_zone_uuid=props.get("config.transportZoneUuid"),
+        nsx_supported=nsx_supported))
+  return HostNetworkSnapshot(network_count, portgroups, transport_zones)
+
+
+def snapshot_to_dict(snapshot):
+  """
+  Returns a JSON serializable dict of a HostNetworkSnapshot.
+  """
+  return {
+    "network_count": snapshot.network_count,
+    "portgroups": [[pg.moid, pg.name, pg.backing_type, pg.transport_zone_uuid,
+                    pg.nsx_supported] for pg in snapshot.portgroups],
+    "transport_zones": (None if snapshot.transport_zones is None else
+                        [list(tz) for tz in snapshot.transport_zones]),
+  }
+
+
+def snapshot_from_dict(data):
+  """
+  Builds a HostNetworkSnapshot from the output of snapshot_to_dict().
+  """
+  transport_zones = data["transport_zones"]
+  return HostNetworkSnapshot(
+      data["network_count"],
+      [PortgroupInfo(*portgroup) for portgroup in data["portgroups"]],
+      None if transport_zones is None else
+      [TransportZoneRecord(*tz) for tz in transport_zones])
+
+
+def validate_portgroup_in_snapshot(snapshot, port_group, err_msg=""):
+  """
+  Validates that port_group is not an NSX-T portgroup backed by an overlay
+  transport zone on the host described by snapshot.
+
+  Returns:
+    (True, transport zone uuid or None) if the portgroup is usable,
+    (False, reason) otherwise.
+  """
+  if not snapshot.network_count:
+    return (False, err_msg + "network prop retreival failed")
+
+  nsx_tz_to_validate = None
+  pg_backing_type = None
+  for portgroup in snapshot.portgroups:
+    if portgroup.name == port_group:
+      if not portgroup.nsx_supported:
+        return (False, unsupported_pyvim_client_msg)
+      if portgroup.backing_type == "nsx":
+        pg_backing_type = "nsx"
+        nsx_tz_to_validate = portgroup.transport_zone_uuid
+        break
+
+  if pg_backing_type == "nsx" and not nsx_tz_to_validate:
+    return (False, unsupported_pyvim_client_msg)
+  elif not nsx_tz_to_validate:
+    return (True, None)
+
+  if snapshot.transport_zones is None:
+    return (False, unsupported_pyvim_client_msg)
+  for tz_uuid, tz_type in snapshot.transport_zones:
+    if tz_uuid == nsx_tz_to_validate and tz_type != "vlan":
+      return (False, err_msg + "transport type is %s" % tz_type)
+  return (True, nsx_tz_to_validate)
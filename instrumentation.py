@@ -0,0 +1,272 @@
+"""
+Round trip and latency instrumentation of host operations.
+
+Every SOAP call, SSH command and transfer, OTP fetch and retry attempt can be
+recorded with host, operation and outcome labels. Records feed counters and
+latency histograms that can be exported as Prometheus text or as a JSON
+snapshot. Instrumentation is off by default; while disabled timed() returns
+a shared no-op context manager and nothing is wrapped, so the cost is one
+global lookup per call site.
+"""
+
+import bisect
+import threading
+import time
+
+__all__ = [
+    "disable",
+    "enable",
+    "export_json",
+    "export_prometheus",
+    "instrument_ssh_client",
+    "instrument_stub",
+    "is_enabled",
+    "record",
+    "reset",
+    "timed",
+]
+
+# Upper bounds of the latency histogram buckets, in seconds.
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+                   5.0, 10.0, 30.0, 60.0, 300.0)
+LABEL_NAMES = ("kind", "host", "op", "outcome")
+
+COUNTER_NAME = "vmware_client_operations_total"
+HISTOGRAM_NAME = "vmware_client_operation_latency_seconds"
+
+_enabled = False
+_lock = threading.Lock()
+# Map of label values tuple to count.
+_counters = {}
+# Map of label values tuple to [bucket counts..., sum].
+_histograms = {}
+
+
+def enable():
+  global _enabled
+  _enabled = True
+
+
+def disable():
+  global _enabled
+  _enabled = False
+
+
+def is_enabled():
+  return _enabled
+
+
+def reset():
+  """
+  Drops all recorded data.
+  """
+  with _lock:
+    _counters.clear()
+    _histograms.clear()
+
+
+def record(kind, host, op, outcome, latency_secs=None):
+  """
+  Records one operation.
+
+  Args:
+    kind (str): "soap", "ssh", "otp" or "retry".
+    host (str): Host the operation went to.
+    op (str): Operation, e.g. the SOAP method or property name.
+    outcome (str): "ok", "error" or an operation specific outcome.
+    latency_secs (float): Duration of the operation, or None if it has none.
+  """
+  if not _enabled:
+    return
+  labels = (kind, host or "", op, outcome)
+  with _lock:
+    _counters[labels] = _counters.get(labels, 0) + 1
+    if latency_secs is None:
+      return
+    histogram = _histograms.get(labels)
+    if histogram is None:
+      histogram = [0] * (len(LATENCY_BUCKETS) + 2)
+      _histograms[labels] = histogram
+    histogram[bisect.bisect_left(LATENCY_BUCKETS, latency_secs)] += 1
+    histogram[-1] += latency_secs
+
+
+class _NoopTimer(object):
+  __slots__ = ()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc, tb):
+    return False
+
+  def set_outcome(self, outcome):
+    pass
+
+
+_NOOP_TIMER = _NoopTimer()
+
+
+class _Timer(object):
+  __slots__ = ("kind", "host", "op", "outcome", "start")
+
+  def __init__(self, kind, host, op):
+    self.kind = kind
+    self.host = host
+    self.op = op
+    self.outcome = None
+
+  def __enter__(self):
+    self.start = time.time()
+    return self
+
+  def __exit__(self, exc_type, exc, tb):
+    outcome = self.outcome or ("error" if exc_type else "ok")
+    record(self.kind, self.host, self.op, outcome, time.time() - self.start)
+    return False
+
+  def set_outcome(self, outcome):
+    """
+    Overrides the outcome, which is otherwise "ok" or "error" depending on
+    whether the block raised.
+    """
+    self.outcome = outcome
+
+
+def timed(kind, host, op):
+  """
+  Returns a context manager recording the duration and outcome of the block.
+  """
+  if not _enabled:
+    return _NOOP_TIMER
+  return _Timer(kind, host, op)
+
+
+def instrument_stub(stub, host):
+  """
+  Wraps the SOAP stub of a service instance so every method invocation and
+  property read is recorded. Does nothing while instrumentation is disabled.
+  """
+  if not _enabled or getattr(stub, "_instrumented", False):
+    return stub
+  for attr in ("InvokeMethod", "InvokeAccessor"):
+    invoke = getattr(stub, attr, None)
+    if invoke is not None:
+      setattr(stub, attr, _timed_invoke(invoke, host))
+  stub._instrumented = True
+  return stub
+
+
+def _timed_invoke(invoke, host):
+  def wrapper(mo, info, *args, **kwargs):
+    with timed("soap", host, getattr(info, "name", "unknown")):
+      return invoke(mo, info, *args, **kwargs)
+  return wrapper
+
+
+def _ssh_op(cmd):
+  """
+  Returns a low cardinality operation label for an SSH command.
+  """
+  if "@@" in cmd:
+    return "batch"
+  # Skip leading environment assignments, e.g. "USER=vpxuser python ...".
+  words = cmd.split()
+  while words and "=" in words[0] and not words[0].startswith("-"):
+    words.pop(0)
+  if not words:
+    return "empty"
+  if words[0] == "localcli":
+    # localcli [options] namespace... -> the first two namespace words.
+    namespace = [word for word in words[1:] if not word.startswith("-")]
+    return " ".join(["localcli"] + namespace[:2])
+  return words[0]
+
+
+class _InstrumentedSSHClient(object):
+  """
+  Proxy recording execute() and transfer_to() of an SSHClient.
+  """
+
+  def __init__(self, ssh_client, host):
+    self._ssh_client = ssh_client
+    self._host = host
+
+  def execute(self, cmd, *args, **kwargs):
+    with timed("ssh", self._host, _ssh_op(cmd)) as timer:
+      result = self._ssh_client.execute(cmd, *args, **kwargs)
+      if result[0] != 0:
+        timer.set_outcome("error")
+      return result
+
+  def transfer_to(self, *args, **kwargs):
+    with timed("ssh", self._host, "transfer_to"):
+      return self._ssh_client.transfer_to(*args, **kwargs)
+
+  def __getattr__(self, name):
+    return getattr(self._ssh_client, name)
+
+
+def instrument_ssh_client(ssh_client, host):
+  """
+  Returns ssh_client wrapped so its commands and transfers are recorded, or
+  ssh_client itself while instrumentation is disabled.
+  """
+  if not _enabled:
+    return ssh_client
+  return _InstrumentedSSHClient(ssh_client, host)
+
+
+def _format_labels(labels, extra=None):
+  pairs = list(zip(LABEL_NAMES, labels)) + list(extra or [])
+  return "{%s}" % ",".join(
+      '%s="%s"' % (name, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+      for name, value in pairs)
+
+
+def export_prometheus():
+  """
+  Returns the recorded data in the Prometheus text exposition format.
+  """
+  with _lock:
+    counters = sorted(_counters.items())
+    histograms = sorted((labels, list(values))
+                        for labels, values in _histograms.items())
+  lines = [
+    "# HELP %s Number of host operations." % COUNTER_NAME,
+    "# TYPE %s counter" % COUNTER_NAME,
+  ]
+  for labels, value in counters:
+    lines.append("%s%s %d" % (COUNTER_NAME, _format_labels(labels), value))
+  lines.append("# HELP %s Latency of host operations." % HISTOGRAM_NAME)
+  lines.append("# TYPE %s histogram" % HISTOGRAM_NAME)
+  for labels, values in histograms:
+    cumulative = 0
+    for bound, count in zip(LATENCY_BUCKETS + ("+Inf",), values[:-1]):
+      cumulative += count
+      lines.append("%s_bucket%s %d" % (
+          HISTOGRAM_NAME, _format_labels(labels, [("le", bound)]), cumulative))
+    lines.append("%s_sum%s %f" % (HISTOGRAM_NAME, _format_labels(labels),
+                                  values[-1]))
+    lines.append("%s_count%s %d" % (HISTOGRAM_NAME, _format_labels(labels),
+                                    cumulative))
+  return "\n".join(lines) + "\n"
+
+
+def export_json():
+  """
+  Returns the recorded data as a JSON serializable dict.
+  """
+  with _lock:
+    counters = sorted(_counters.items())
+    histograms = sorted((labels, list(values))
+                        for labels, values in _histograms.items())
+  return {
+    "counters": [dict(zip(LABEL_NAMES, labels), value=value)
+                 for labels, value in counters],
+    "histograms": [dict(zip(LABEL_NAMES, labels),
+                        buckets=dict(zip([str(b) for b in LATENCY_BUCKETS] +
+                                         ["+Inf"], values[:-1])),
+                        sum=values[-1], count=sum(values[:-1]))
+                   for labels, values in histograms],
+  }
@@ -0,0 +1,249 @@
+"""
+Joined, indexed view of the vmkernel interfaces of a host.
+
+Resolving an External ID to an address used to take one scan of
+"network ip interface list" and another of "network ip interface ipv4 get".
+HostInterfaceTable joins both outputs once and indexes the result, so any
+number of lookups afterwards are dict accesses. Both are fetched through the
+esxcli query layer, in JSON output where the host supports it.
+"""
+
+from esxcli_query import (TYPE_BOOLEAN, TYPE_INTEGER, EsxcliQuery, EsxcliSchema,
+                          decode_esxcli_output, decode_output, fetch_outputs,
+                          run_queries, sniff_formatter)
+
+__all__ = [
+    "HostInterfaceTable",
+    "InterfaceRecord",
+    "fetch_host_interface_outputs",
+    "fetch_host_interface_table",
+]
+
+# Maps esxcli field name to InterfaceRecord attribute.
+INTERFACE_FIELDS = {
+  "Name": "name",
+  "MAC Address": "mac",
+  "Enabled": "enabled",
+  "Portset": "portset",
+  "Portgroup": "portgroup",
+  "Netstack Instance": "netstack",
+  "VDS Name": "vds_name",
+  "VDS UUID": "vds_uuid",
+  "VDS Port": "vds_port",
+  "Opaque Network ID": "opaque_network_id",
+  "External ID": "external_id",
+  "MTU": "mtu",
+}
+IPV4_FIELDS = {
+  "Name": "name",
+  "IPv4 Address": "ipv4_address",
+  "IPv4 Netmask": "ipv4_netmask",
+}
+# Columns of the commands, as listed by their meta-data-field.
+INTERFACE_SCHEMA = EsxcliSchema(
+    "Name,MAC Address,Enabled,Portset,Portgroup,Netstack Instance,VDS Name,"
+    "VDS UUID,VDS Port,VDS Connection,Opaque Network ID,Opaque Network Type,"
+    "External ID,MTU,TSO MSS,RXDispQueue Size,Port ID",
+    {"Enabled": TYPE_BOOLEAN, "VDS Connection": TYPE_INTEGER,
+     "MTU": TYPE_INTEGER, "TSO MSS": TYPE_INTEGER,
+     "RXDispQueue Size": TYPE_INTEGER, "Port ID": TYPE_INTEGER})
+IPV4_SCHEMA = EsxcliSchema(
+    "Name,IPv4 Address,IPv4 Netmask,IPv4 Broadcast,Address Type,Gateway,"
+    "DHCP DNS",
+    {"DHCP DNS": TYPE_BOOLEAN})
+INTERFACE_LIST_QUERY = EsxcliQuery("network ip interface list",
+                                   INTERFACE_SCHEMA, tuple(INTERFACE_FIELDS))
+IPV4_GET_QUERY = EsxcliQuery("network ip interface ipv4 get", IPV4_SCHEMA,
+                             tuple(IPV4_FIELDS))
+INTERFACE_QUERIES = (INTERFACE_LIST_QUERY, IPV4_GET_QUERY)
+# Attributes the table is indexed by.
+INDEXED_ATTRS = ("name", "external_id", "mac", "portgroup", "vds_port")
+# esxcli placeholder for fields that are not set.
+NOT_AVAILABLE = "N/A"
+
+
+class InterfaceRecord(object):
+  """
+  A vmkernel interface with its IPv4 configuration. Fields esxcli reports as
+  N/A are None.
+  """
+  __slots__ = tuple(INTERFACE_FIELDS.values()) + ("ipv4_address",
+                                                  "ipv4_netmask")
+
+  def __init__(self, **kwargs):
+    for attr in self.__slots__:
+      value = kwargs.get(attr)
+      setattr(self, attr, None if value == NOT_AVAILABLE else value)
+
+  def __repr__(self):
+    return "InterfaceRecord(%s)" % ", ".join(
+        "%s=%r" % (attr, getattr(self, attr)) for attr in self.__slots__)
+
+
+class HostInterfaceTable(object):
+  """
+  Interfaces of one host, indexed by name, External ID, MAC, Portgroup and
+  VDS Port.
+  """
+
+  def __init__(self, records):
+    self.records = list(records)
+    self._indexes = dict((attr, {}) for attr in INDEXED_ATTRS)
+    for record in self.records:
+      for attr in INDEXED_ATTRS:
+        value = getattr(record, attr)
+        if value is not None:
+          self._indexes[attr].setdefault(value, []).append(record)
+
+  @classmethod
+  def from_esxcli_output(cls, interface_list_out, ipv4_out):
+    """
+    Builds the table from the output of the interface list and ipv4 get
+    commands, as text or bytes, in any esxcli formatter.
+    """
+    return cls.from_rows(
+        _decode(INTERFACE_LIST_QUERY, data=interface_list_out),
+        _decode(IPV4_GET_QUERY, data=ipv4_out))
+
+  @classmethod
+  def from_esxcli_files(cls, interface_list_path, ipv4_path):
+    """
+    Builds the table from files holding the output of the interface list and
+    ipv4 get commands, in any esxcli formatter.
+    """
+    return cls.from_rows(
+        _decode(INTERFACE_LIST_QUERY, path=interface_list_path),
+        _decode(IPV4_GET_QUERY, path=ipv4_path))
+
+  @classmethod
+  def from_rows(cls, interface_rows, ipv4_rows):
+    """
+    Builds the table from the rows of INTERFACE_LIST_QUERY and
+    IPV4_GET_QUERY.
+    """
+    ipv4_by_name = {}
+    for row in ipv4_rows:
+      ipv4_by_name[row.get("Name")] = row
+    records = []
+    for row in interface_rows:
+      kwargs = dict((INTERFACE_FIELDS[field], value)
+                    for field, value in row.items())
+      ipv4 = ipv4_by_name.get(row.get("Name"), {})
+      kwargs["ipv4_address"] = ipv4.get("IPv4 Address")
+      kwargs["ipv4_netmask"] = ipv4.get("IPv4 Netmask")
+      records.append(InterfaceRecord(**kwargs))
+    return cls(records)
+
+  @classmethod
+  def from_outputs(cls, outputs):
+    """
+    Builds the table from the (formatter, output) of INTERFACE_QUERIES, as
+    returned by fetch_host_interface_outputs().
+    """
+    return cls.from_rows(*[decode_output(query, formatter, output)
+                           for query, (formatter, output)
+                           in zip(INTERFACE_QUERIES, outputs)])
+
+  @classmethod
+  def from_dicts(cls, rows):
+    """
+    Builds the table from the output of to_dicts().
+    """
+    return cls(InterfaceRecord(**row) for row in rows)
+
+  def to_dicts(self):
+    """
+    Returns the records as a list of JSON serializable dicts.
+    """
+    return [dict((attr, getattr(record, attr)) for attr in record.__slots__)
+            for record in self.records]
+
+  def get(self, attr, value):
+    """
+    Returns the first interface whose attr equals value, or None.
+    """
+    matches = self._indexes[attr].get(value)
+    return matches[0] if matches else None
+
+  def get_all(self, attr, value):
+    """
+    Returns all interfaces whose attr equals value.
+    """
+    return list(self._indexes[attr].get(value, ()))
+
+  def by_name(self, name):
+    return self.get("name", name)
+
+  def by_external_id(self, external_id):
+    return self.get("external_id", external_id)
+
+  def by_mac(self, mac):
+    return self.get("mac", mac)
+
+  def by_portgroup(self, portgroup):
+    return self.get("portgroup", portgroup)
+
+  def by_vds_port(self, vds_port):
+    return self.get("vds_port", vds_port)
+
+  def resolve_external_ids(self, external_ids):
+    """
+    Resolves External IDs to interfaces.
+
+    Returns:
+      dict of external id to (device name, ipv4 address, ipv4 netmask), or to
+      None for External IDs with no interface on the host.
+    """
+    resolved = {}
+    for external_id in external_ids:
+      record = self.by_external_id(external_id)
+      resolved[external_id] = (
+          (record.name, record.ipv4_address, record.ipv4_netmask)
+          if record else None)
+    return resolved
+
+
+def _decode(query, data=None, path=None):
+  """
+  Returns the rows of query in esxcli output given as data, text or bytes, or
+  read from the file at path.
+  """
+  if path is not None:
+    with open(path, "rb") as fd:
+      data = fd.read()
+  return decode_esxcli_output(data, query.schema, query.fields,
+                              formatter=sniff_formatter(data))
+
+
+def fetch_host_interface_table(ssh_client):
+  """
+  Fetches the interface list and IPv4 configuration over ssh_client in one
+  remote invocation.
+
+  Returns:
+    (True, HostInterfaceTable) on success, (False, error message) otherwise.
+  """
+  (ret, interface_rows), (ipv4_ret, ipv4_rows) = run_queries(
+      ssh_client, INTERFACE_QUERIES)
+  if not ret:
+    return (False, interface_rows)
+  if not ipv4_ret:
+    return (False, ipv4_rows)
+  return (True, HostInterfaceTable.from_rows(interface_rows, ipv4_rows))
+
+
+def fetch_host_interface_outputs(ssh_client):
+  """
+  Fetches the output of INTERFACE_QUERIES over ssh_client in one remote
+  invocation without decoding it, see HostInterfaceTable.from_outputs().
+
+  Returns:
+    (True, list of (formatter, output)) on success, (False, error message)
+    otherwise.
+  """
+  outputs = []
+  for ret, value in fetch_outputs(ssh_client, INTERFACE_QUERIES):
+    if not ret:
+      return (False, value)
+    outputs.append(value)
+  return (True, outputs)
@@ -0,0 +1,64 @@
+"""
+Deferred imports.
+
+The client modules are imported by short lived genesis hooks, where loading
+pyVmomi, gflags and the util and cluster packages dominates the runtime.
+LazyImport stands in for a module, or for an attribute of a module, and
+imports it on first attribute access or call, so that only the code paths
+that use a dependency pay for loading it.
+"""
+
+import importlib
+
+__all__ = [
+    "LazyImport",
+]
+
+
+class LazyImport(object):
+  """
+  Proxy of module_name, or of its attribute attr, imported on first use.
+
+  Args:
+    module_name (str): Module to import.
+    attr (str): Attribute of the module to stand in for, None for the module
+      itself.
+    setup (tuple): Modules imported before module_name, e.g. the modules
+      defining the flags read through a lazy FLAGS.
+  """
+  __slots__ = ("_module_name", "_attr", "_setup", "_target")
+
+  def __init__(self, module_name, attr=None, setup=()):
+    object.__setattr__(self, "_module_name", module_name)
+    object.__setattr__(self, "_attr", attr)
+    object.__setattr__(self, "_setup", tuple(setup))
+    object.__setattr__(self, "_target", None)
+
+  def resolve(self):
+    """
+    Imports the module if needed and returns the proxied object.
+    """
+    target = self._target
+    if target is None:
+      for name in self._setup:
+        importlib.import_module(name)
+      target = importlib.import_module(self._module_name)
+      if self._attr:
+        target = getattr(target, self._attr)
+      object.__setattr__(self, "_target", target)
+    return target
+
+  def __getattr__(self, name):
+    return getattr(self.resolve(), name)
+
+  def __setattr__(self, name, value):
+    setattr(self.resolve(), name, value)
+
+  def __call__(self, *args, **kwargs):
+    return self.resolve()(*args, **kwargs)
+
+  def __repr__(self):
+    if self._target is None:
+      return "<lazy %s%s>" % (self._module_name,
+                              "." + self._attr if self._attr else "")
+    return repr(self._target)
@@ -0,0 +1,257 @@
+"""
+Socket timeouts and liveness checks of vSphere sessions.
+
+A single socket timeout used for connecting and reading lets a black holed
+host block a caller for the full read timeout on every attempt, and a
+session whose connection died half way still has a truthy service instance.
+set_stub_timeout() and stub_timeout() change the socket timeout of an
+established session, so logins can use a short connect timeout and
+individual operations their own read timeout. Overlapping stub_timeout()
+contexts on one stub are tracked together: the longest active timeout
+applies, and the timeout from before the first one is restored when the
+last one exits. LivenessProbe pings the host
+with CurrentTime() under a short timeout and caches the answer for a few
+seconds, and Keepalive probes long lived sessions in the background.
+"""
+
+from contextlib import contextmanager
+import socket
+import threading
+import time
+import weakref
+
+__all__ = [
+    "Keepalive",
+    "LivenessProbe",
+    "get_stub_timeout",
+    "probe_session",
+    "set_stub_timeout",
+    "stub_timeout",
+]
+
+# Timeout of a liveness probe round trip.
+liveness_probe_timeout_secs = 5
+# A probe result is reused for this long.
+liveness_cache_secs = 5
+# Default interval of Keepalive probes.
+keepalive_interval_secs = 60
+
+
+def _pooled_connections(stub):
+  for entry in list(getattr(stub, "pool", None) or []):
+    # pyVmomi pools (connection, last used) pairs, older versions bare
+    # connections.
+    yield entry[0] if isinstance(entry, tuple) else entry
+
+
+def _known_connections(stub):
+  """
+  Returns the weak set of the connections seen in the pool of stub, which
+  includes those handed out to requests in flight, or None if the stub
+  cannot keep one.
+  """
+  known = getattr(stub, "_timeout_connections", None)
+  if known is None:
+    try:
+      known = stub._timeout_connections = weakref.WeakSet()
+    except Exception:
+      return None
+  return known
+
+
+def _is_longer(timeout_secs, current_secs):
+  # None is no timeout, longer than any other.
+  if current_secs is None:
+    return False
+  return timeout_secs is None or timeout_secs > current_secs
+
+
+def _set_sock_timeout(conn, timeout_secs, only_longer=False):
+  sock = getattr(conn, "sock", None)
+  if sock is None:
+    return
+  try:
+    if not only_longer or _is_longer(timeout_secs, sock.gettimeout()):
+      sock.settimeout(timeout_secs)
+  except Exception:
+    pass
+
+
+def get_stub_timeout(stub):
+  """
+  Returns the socket timeout of new connections of a SoapStubAdapter, or None
+  if it is not set.
+  """
+  return (getattr(stub, "schemeArgs", None) or {}).get("timeout")
+
+
+def set_stub_timeout(stub, timeout_secs):
+  """
+  Sets the socket timeout of a SoapStubAdapter: of the connections it opens
+  from now on, and of its idle pooled connections. Connections in use by
+  requests in flight only have their timeout lengthened, so a shorter
+  timeout does not cut a running call short, while restoring a longer one
+  after it reaches connections that were busy when it was shortened. None
+  restores the default socket timeout. Returns False if the stub does not
+  support timeouts.
+  """
+  scheme_args = getattr(stub, "schemeArgs", None)
+  if scheme_args is None:
+    return False
+  if timeout_secs is None:
+    scheme_args.pop("timeout", None)
+    timeout_secs = socket.getdefaulttimeout()
+  else:
+    scheme_args["timeout"] = timeout_secs
+  idle = list(_pooled_connections(stub))
+  for conn in idle:
+    _set_sock_timeout(conn, timeout_secs)
+  known = _known_connections(stub)
+  if known is not None:
+    for conn in list(known):
+      if not any(conn is other for other in idle):
+        _set_sock_timeout(conn, timeout_secs, only_longer=True)
+    for conn in idle:
+      try:
+        known.add(conn)
+      except TypeError:
+        pass
+  return True
+
+
+class _Overrides(object):
+  __slots__ = ("previous", "timeouts")
+
+  def __init__(self, previous):
+    # Timeout of the stub before the first active override.
+    self.previous = previous
+    # Timeouts of the active stub_timeout() contexts.
+    self.timeouts = []
+
+
+# Map of id of a stub to its _Overrides, while stub_timeout() contexts are
+# active on it.
+_overrides = {}
+_overrides_lock = threading.Lock()
+
+@contextmanager
+def stub_timeout(stub, timeout_secs):
+  """
+  Context manager running the calls made on stub within it with a socket
+  timeout of timeout_secs.
+
+  The timeout applies to the stub, i.e. to every caller sharing the session
+  while the context is active. While contexts overlap on a stub, the longest
+  of their timeouts applies, so a short one, e.g. a liveness probe, does not
+  cut the calls of a longer one short. The timeout from before the first
+  context is restored when the last one exits, whatever order they exit in.
+  """
+  if timeout_secs is None or getattr(stub, "schemeArgs", None) is None:
+    yield
+    return
+  key = id(stub)
+  with _overrides_lock:
+    overrides = _overrides.get(key)
+    if overrides is None:
+      overrides = _overrides[key] = _Overrides(get_stub_timeout(stub))
+    overrides.timeouts.append(timeout_secs)
+    set_stub_timeout(stub, max(overrides.timeouts))
+  try:
+    yield
+  finally:
+    with _overrides_lock:
+      overrides.timeouts.remove(timeout_secs)
+      if overrides.timeouts:
+        set_stub_timeout(stub, max(overrides.timeouts))
+      else:
+        del _overrides[key]
+        set_stub_timeout(stub, overrides.previous)
+
+
+def probe_session(service_instance, timeout_secs=liveness_probe_timeout_secs):
+  """
+  Returns True if the host answers a CurrentTime() call on service_instance
+  within timeout_secs, or within the timeout of a longer operation running
+  on the session meanwhile, see stub_timeout().
+  """
+  if not service_instance:
+    return False
+  try:
+    with stub_timeout(service_instance._stub, timeout_secs):
+      service_instance.CurrentTime()
+  except Exception:
+    return False
+  return True
+
+
+class LivenessProbe(object):
+  """
+  Cached liveness of one service instance.
+
+  Attributes:
+    probes (int): Number of probe round trips made.
+  """
+
+  def __init__(self, service_instance, cache_secs=liveness_cache_secs,
+               timeout_secs=liveness_probe_timeout_secs):
+    self.service_instance = service_instance
+    self.cache_secs = cache_secs
+    self.timeout_secs = timeout_secs
+    self.probes = 0
+    self._lock = threading.Lock()
+    self._checked_at = None
+    self._alive = False
+
+  def mark_alive(self):
+    """
+    Records that the host just answered a call, e.g. the login.
+    """
+    with self._lock:
+      self._checked_at = time.time()
+      self._alive = True
+
+  def is_alive(self, force=False):
+    """
+    Returns True if the host answered a probe within the last cache_secs, or
+    answers one now. A probe is always made if force is True.
+    """
+    with self._lock:
+      if (not force and self._checked_at is not None and
+          time.time() - self._checked_at < self.cache_secs):
+        return self._alive
+      self.probes += 1
+      alive = probe_session(self.service_instance, self.timeout_secs)
+      self._checked_at = time.time()
+      self._alive = alive
+      return alive
+
+
+class Keepalive(object):
+  """
+  Daemon thread probing a LivenessProbe every interval_secs, which keeps
+  idle sessions from being expired by hostd and detects dead ones early.
+  on_dead is called once, from the thread, when a probe fails.
+  """
+
+  def __init__(self, probe, interval_secs=keepalive_interval_secs,
+               on_dead=None, name="keepalive"):
+    self.probe = probe
+    self.interval_secs = interval_secs
+    self.on_dead = on_dead
+    self._stop = threading.Event()
+    self._thread = threading.Thread(target=self._run, name=name)
+    self._thread.daemon = True
+
+  def start(self):
+    self._thread.start()
+    return self
+
+  def stop(self):
+    self._stop.set()
+
+  def _run(self):
+    while not self._stop.wait(self.interval_secs):
+      if not self.probe.is_alive(force=True):
+        if self.on_dead and not self._stop.is_set():
+          self.on_dead()
+        return
@@ -1,16 +1,134 @@
-import re
+from collections import namedtuple
 
-def parse_vmknic(port_key, cmd_out):
-  VMKNIC_TABLE_ROW_RE = re.compile(r"^(vmk\d+)\s+(.*\S+)\s*IPv[46]\s+"
-                                   r"(\d+\.\d+\.\d+\.\d+)\s+"
-                                   r"(\d+\.\d+\.\d+\.\d+).*(true|false)"
-                                   r"\s+(\w+)")
-  vmknic_list = cmd_out.strip().split("\n")[1:-1]
-  for device_config_line in vmknic_list:
-    match = VMKNIC_TABLE_ROW_RE.search(device_config_line)
-    if not match:
+# Column titles of "esxcfg-vmknic -l", in order, with the titles older ESXi
+# releases use for the same column.
+VMKNIC_COLUMNS = (("Interface",), ("Port Group/DVPort/Opaque Network",
+                                   "Port Group/DVPort"),
+                  ("IP Family",), ("IP Address",), ("Netmask",),
+                  ("Broadcast",), ("MAC Address",), ("MTU",),
+                  ("TSO MSS", "TSO MTU"), ("Enabled",), ("Type",),
+                  ("NetStack",))
+# Indexes in VMKNIC_COLUMNS of the columns a header must have. Records get
+# None for the other columns when the header lacks them.
+REQUIRED_COLUMNS = (0, 1, 2, 3, 4)
+
+VmknicRecord = namedtuple("VmknicRecord", [
+    "interface", "port_key", "ip_family", "ip_address", "netmask",
+    "broadcast", "mac", "mtu", "tso_mss", "enabled", "type", "netstack"])
+
+# Map of header line to column offsets, headers rarely change.
+_column_offsets_cache = {}
+
+def _column_offsets(header):
+  """
+  Returns (index in VMKNIC_COLUMNS, start offset) of the columns of header,
+  in header order.
+
+  Raises:
+    ValueError if header lacks one of REQUIRED_COLUMNS.
+  """
+  offsets = _column_offsets_cache.get(header)
+  if offsets is not None:
+    return offsets
+  # Longest titles are located first, so "MTU" is not found inside "TSO MTU"
+  # of a header without an MTU column.
+  titles = sorted(((column, title)
+                   for column, aliases in enumerate(VMKNIC_COLUMNS)
+                   for title in aliases), key=lambda entry: -len(entry[1]))
+  found = {}
+  spans = []
+  for column, title in titles:
+    if column in found:
+      continue
+    pos = header.find(title)
+    while pos >= 0 and any(pos < end and start < pos + len(title)
+                           for start, end in spans):
+      pos = header.find(title, pos + 1)
+    if pos >= 0:
+      found[column] = pos
+      spans.append((pos, pos + len(title)))
+  for column in REQUIRED_COLUMNS:
+    if column not in found:
+      raise ValueError("esxcfg-vmknic -l header has no %s column: %r" %
+                       (VMKNIC_COLUMNS[column][0], header))
+  offsets = tuple(sorted(found.items(), key=lambda entry: entry[1]))
+  _column_offsets_cache[header] = offsets
+  return offsets
+
+def _split_row(row, offsets):
+  """
+  Slices row into column values. A value wider than its column pushes the
+  start of the next column to the following blank.
+  """
+  values = []
+  row_len = len(row)
+  start = 0
+  for index in range(len(offsets)):
+    end = offsets[index + 1] if index + 1 < len(offsets) else row_len
+    end = max(end, start)
+    # The value overflows into the next column, move the boundary.
+    while 0 < end < row_len and row[end - 1] != " ":
+      end += 1
+    values.append(row[start:end].strip())
+    start = end
+  return values
+
+def _to_int(value):
+  try:
+    return int(value)
+  except (TypeError, ValueError):
+    return None
+
+def parse_vmknic_table(cmd_out):
+  """
+  Parses the output of "esxcfg-vmknic -l", IPv4 and IPv6 rows alike.
+
+  Column offsets are read from the header line, and every row is sliced at
+  those offsets. Lines before the header, e.g. the shell prompt, are ignored.
+  Columns older releases do not print are None in the records.
+
+  Returns:
+    dict of port group name, DVPort or opaque network ID to the list of
+    VmknicRecord of the interfaces on it.
+
+  Raises:
+    ValueError if the header lacks one of REQUIRED_COLUMNS.
+  """
+  index = {}
+  columns = None
+  offsets = None
+  for line in cmd_out.splitlines():
+    if offsets is None:
+      if line.startswith(VMKNIC_COLUMNS[0][0]):
+        columns_offsets = _column_offsets(line)
+        columns = [column for column, _ in columns_offsets]
+        offsets = [offset for _, offset in columns_offsets]
       continue
-    print (match.group(1), match.group(2))
+    if not line.startswith("vmk"):
+      continue
+    values = [None] * len(VMKNIC_COLUMNS)
+    for column, value in zip(columns, _split_row(line, offsets)):
+      values[column] = value
+    (interface, port_key, ip_family, ip_address, netmask, broadcast, mac,
+     mtu, tso_mss, enabled, type_, netstack) = values
+    record = VmknicRecord(interface, port_key, ip_family, ip_address,
+                          netmask, broadcast or None, mac, _to_int(mtu),
+                          _to_int(tso_mss),
+                          None if enabled is None else enabled == "true",
+                          type_, netstack)
+    index.setdefault(port_key, []).append(record)
+  return index
+
+def parse_vmknic(port_key, cmd_out):
+  """
+  Returns the VmknicRecords of the interfaces on port_key, the port group
+  name, DVPort or opaque network ID. If port_key is None the whole index
+  returned by parse_vmknic_table() is returned.
+  """
+  index = parse_vmknic_table(cmd_out)
+  if port_key is None:
+    return index
+  return index.get(port_key, [])
 
 cmd_out='''
 
@@ -25,4 +143,7 @@ vmk2       32                                      IPv6      fe80::250:56ff:fe6f
 vmk3       e647f7a5-60f6-4e15-b796-8019ec499d9d    IPv4      172.16.8.1                              255.255.0.0     172.16.255.255  00:50:56:65:cc:82 1500    65535     true    STATIC              defaultTcpipStack
 vmk3       e647f7a5-60f6-4e15-b796-8019ec499d9d    IPv6      fe80::250:56ff:fe65:cc82                64                              00:50:56:65:cc:82 1500    65535     true    STATIC, PREFERRED   defaultTcpipStack
 '''
-parse_vmknic('e647f7a5-60f6-4e15-b796-8019ec499d9d', cmd_out) 
+
+if __name__ == "__main__":
+  for record in parse_vmknic('e647f7a5-60f6-4e15-b796-8019ec499d9d', cmd_out):
+    print (record)
@@ -0,0 +1,217 @@
+"""
+vCenter wide index of distributed virtual portgroups.
+
+Looking a portgroup up by walking every switch and every portgroup costs
+switches x portgroups lazy SOAP fetches. PortgroupIndex fetches all switches
+and portgroups with one ContainerView traversal and one RetrieveContents()
+call, and answers lookups by name or key from memory until it is invalidated
+or older than its TTL. A lookup that misses rebuilds the index once, so
+portgroups created after it was built are found.
+"""
+
+import threading
+import time
+
+from lazy_import import LazyImport
+from records import portgroup_record_from_properties
+
+vim = LazyImport("pyVmomi", "vim")
+vmodl = LazyImport("pyVmomi", "vmodl")
+
+__all__ = [
+    "PortgroupIndex",
+    "get_portgroup_index",
+]
+
+PORTGROUP_PROPERTIES = ["name", "key", "config.distributedVirtualSwitch",
+                        "config.backingType", "config.transportZoneUuid"]
+# Portgroup properties known to pyVmomi versions without NSX-T support.
+PORTGROUP_BASIC_PROPERTIES = ["name", "key", "config.distributedVirtualSwitch"]
+SWITCH_PROPERTIES = ["uuid"]
+
+# Age after which the index is rebuilt on the next lookup.
+portgroup_index_ttl_secs = 300
+# Age after which a lookup that finds nothing rebuilds the index. Keeps
+# lookups of names that do not exist from rebuilding it on every call.
+portgroup_index_miss_rebuild_secs = 5
+
+
+class PortgroupIndex(object):
+  """
+  Map of portgroup name and key to PortgroupRecord for one vCenter. The
+  index is built through the session of the stub last passed to use_stub().
+  """
+
+  def __init__(self, stub, ttl_secs=portgroup_index_ttl_secs):
+    self.ttl_secs = ttl_secs
+    self._lock = threading.Lock()
+    self._stub = stub
+    self._service_content = None
+    self._by_name = {}
+    self._by_key = {}
+    self._built_at = None
+    # Bumped by invalidate(), the index is rebuilt when it does not match the
+    # version it was built at.
+    self.version = 0
+    self._built_version = None
+
+  @property
+  def service_content(self):
+    """
+    ServiceContent of the vCenter, retrieved through the current stub.
+    """
+    with self._lock:
+      return self._service_content_locked()
+
+  def use_stub(self, stub):
+    """
+    Makes the index use stub, e.g. after the vCenter session was replaced
+    by a new login. Cached entries are kept.
+    """
+    with self._lock:
+      if stub is not self._stub:
+        self._stub = stub
+        self._service_content = None
+
+  def invalidate(self):
+    """
+    Marks the index stale, e.g. after portgroups were added or renamed.
+    """
+    with self._lock:
+      self.version += 1
+
+  def lookup(self, name, network_moids=None):
+    """
+    Returns the PortgroupRecord of the portgroup called name, or None.
+
+    Args:
+      name (str): Portgroup name.
+      network_moids (set): If given, only portgroups whose moid is in it
+        match, e.g. the networks of the host the portgroup is used on.
+        Otherwise, if several switches have a portgroup of that name, the
+        first one is returned.
+    """
+    self._refresh_if_stale()
+    entry = self._find(name, network_moids)
+    if entry is None:
+      self._refresh_if_stale(portgroup_index_miss_rebuild_secs)
+      entry = self._find(name, network_moids)
+    return entry
+
+  def lookup_all(self, name):
+    """
+    Returns the PortgroupRecord of every portgroup called name.
+    """
+    self._refresh_if_stale()
+    return list(self._by_name.get(name, ()))
+
+  def lookup_key(self, key):
+    """
+    Returns the PortgroupRecord of the portgroup with key, or None.
+    """
+    self._refresh_if_stale()
+    entry = self._by_key.get(key)
+    if entry is None:
+      self._refresh_if_stale(portgroup_index_miss_rebuild_secs)
+      entry = self._by_key.get(key)
+    return entry
+
+  def _find(self, name, network_moids):
+    for entry in self._by_name.get(name, ()):
+      if network_moids is None or entry.moid in network_moids:
+        return entry
+    return None
+
+  def _refresh_if_stale(self, max_age_secs=None):
+    """
+    Rebuilds the index if it was invalidated or is older than max_age_secs,
+    by default its TTL.
+    """
+    if max_age_secs is None:
+      max_age_secs = self.ttl_secs
+    with self._lock:
+      if (self._built_at is not None and
+          self._built_version == self.version and
+          time.time() - self._built_at < max_age_secs):
+        return
+      version = self.version
+      by_name, by_key = self._build()
+      self._by_name, self._by_key = by_name, by_key
+      self._built_at = time.time()
+      self._built_version = version
+
+  def _service_content_locked(self):
+    if self._service_content is None:
+      self._service_content = vim.ServiceInstance(
+          "ServiceInstance", self._stub).RetrieveContent()
+    return self._service_content
+
+  def _build(self):
+    """
+    Fetches all switches and portgroups in one RetrieveContents() call.
+    """
+    service_content = self._service_content_locked()
+    view = service_content.viewManager.CreateContainerView(
+        service_content.rootFolder,
+        [vim.DistributedVirtualSwitch, vim.dvs.DistributedVirtualPortgroup],
+        True)
+    try:
+      try:
+        contents = self._retrieve(service_content, view, PORTGROUP_PROPERTIES)
+      except vmodl.query.InvalidProperty:
+        contents = self._retrieve(service_content, view,
+                                  PORTGROUP_BASIC_PROPERTIES)
+    finally:
+      view.Destroy()
+
+    switch_uuids = {}
+    portgroups = []
+    for content in contents or []:
+      props = dict((prop.name, prop.val) for prop in content.propSet)
+      if isinstance(content.obj, vim.DistributedVirtualSwitch):
+        switch_uuids[content.obj._moId] = props.get("uuid")
+      else:
+        portgroups.append((content.obj, props))
+
+    by_name = {}
+    by_key = {}
+    for mor, props in portgroups:
+      entry = portgroup_record_from_properties(mor._moId, props, switch_uuids)
+      by_name.setdefault(entry.name, []).append(entry)
+      by_key[entry.key] = entry
+    return by_name, by_key
+
+  def _retrieve(self, service_content, view, portgroup_properties):
+    pc = vmodl.query.PropertyCollector
+    view_traversal = pc.TraversalSpec(name="traverseView",
+                                      type=vim.view.ContainerView,
+                                      path="view", skip=False)
+    obj_spec = pc.ObjectSpec(obj=view, skip=True, selectSet=[view_traversal])
+    prop_set = [
+      pc.PropertySpec(type=vim.DistributedVirtualSwitch, all=False,
+                      pathSet=SWITCH_PROPERTIES),
+      pc.PropertySpec(type=vim.dvs.DistributedVirtualPortgroup, all=False,
+                      pathSet=portgroup_properties),
+    ]
+    filter_spec = pc.FilterSpec(objectSet=[obj_spec], propSet=prop_set)
+    return service_content.propertyCollector.RetrieveContents(
+        [filter_spec])
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+def get_portgroup_index(stub):
+  """
+  Returns the process wide PortgroupIndex of the vCenter stub is connected
+  to. The index is rebuilt through stub, the current session, not through
+  the one it was created with.
+  """
+  key = getattr(stub, "host", id(stub))
+  with _indexes_lock:
+    index = _indexes.get(key)
+    if index is None:
+      index = PortgroupIndex(stub)
+      _indexes[key] = index
+  index.use_stub(stub)
+  return index
@@ -0,0 +1,92 @@
+"""
+Compact immutable records of the host network objects the client reads.
+
+pyVmomi VirtualNic, DistributedVirtualPortgroup and proxy switch objects drag
+their entire config trees along, and caching them for many hosts takes
+hundreds of MB. The records below are namedtuples, so they have no per
+instance __dict__ and cannot be modified, and hold only the fields the client
+uses. The converters build them from pyVmomi objects and property values.
+"""
+
+from collections import namedtuple
+
+__all__ = [
+    "PortgroupRecord",
+    "TransportZoneRecord",
+    "VnicRecord",
+    "portgroup_record_from_properties",
+    "transport_zones_from_proxy_switches",
+    "vnic_record_from_dict",
+    "vnic_record_from_vim",
+]
+
+# A vmkernel NIC. The port fields are None for vnics not on a distributed
+# switch. netstack is the key of its TCP/IP stack instance.
+VnicRecord = namedtuple("VnicRecord", [
+    "device", "ip_address", "port_key", "switch_uuid", "portgroup_key",
+    "external_id", "netmask", "mtu", "netstack"])
+
+# A distributed virtual portgroup. backing_type and transport_zone_uuid are
+# None when the portgroup does not set them.
+PortgroupRecord = namedtuple("PortgroupRecord", [
+    "moid", "name", "key", "switch_uuid", "backing_type",
+    "transport_zone_uuid"])
+
+# A transport zone of a proxy switch, type is e.g. "overlay" or "vlan".
+TransportZoneRecord = namedtuple("TransportZoneRecord", ["uuid", "type"])
+
+
+def vnic_record_from_vim(vnic):
+  """
+  Returns the VnicRecord of a vim.host.VirtualNic.
+  """
+  spec = vnic.spec
+  ip = spec.ip
+  dvport = spec.distributedVirtualPort
+  return VnicRecord(
+      vnic.device,
+      ip.ipAddress if ip else None,
+      dvport.portKey if dvport else None,
+      dvport.switchUuid if dvport else None,
+      dvport.portgroupKey if dvport else None,
+      getattr(spec, "externalId", None),
+      ip.subnetMask if ip else None,
+      getattr(spec, "mtu", None),
+      getattr(spec, "netStackInstanceKey", None))
+
+
+def vnic_record_from_dict(data):
+  """
+  Returns the VnicRecord of a dict made with VnicRecord._asdict(). Fields
+  missing from data, e.g. in dicts stored before they were added, are None.
+  """
+  return VnicRecord(*[data.get(field) for field in VnicRecord._fields])
+
+
+def portgroup_record_from_properties(moid, props, switch_uuids):
+  """
+  Returns the PortgroupRecord of the portgroup with moid from props, its
+  property values by property path. switch_uuids maps the moid of every
+  distributed switch to its uuid.
+  """
+  switch = props.get("config.distributedVirtualSwitch")
+  return PortgroupRecord(
+      moid, props.get("name"), props.get("key"),
+      switch_uuids.get(switch._moId) if switch else None,
+      props.get("config.backingType"),
+      props.get("config.transportZoneUuid"))
+
+
+def transport_zones_from_proxy_switches(proxy_switches):
+  """
+  Returns the TransportZoneRecord of all transport zones of proxy_switches,
+  vim.host.HostProxySwitch objects, or None if pyVmomi does not expose
+  transport zones.
+  """
+  transport_zones = []
+  for proxy_switch in proxy_switches or []:
+    if not hasattr(proxy_switch, "transportZones"):
+      return None
+    for tz in proxy_switch.transportZones or []:
+      transport_zones.append(TransportZoneRecord(tz.uuid, tz.type))
+  return transport_zones
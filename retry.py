@@ -1,12 +1,36 @@
 from itertools import count
+import errno
+import http.client
 import random
+import socket
+import threading
 import time
 
+from lazy_import import LazyImport
+
+log = LazyImport("util.base", "log")
+
 __all__ = [
+    "RetryBudget",
+    "async_call_with_retries",
+    "call_with_retries",
+    "is_transient_error",
+    "retry_with_deadline",
     "retry_with_delay",
     "retry_with_exp_backoff",
 ]
 
+# errnos worth retrying: the peer is there but the connection broke or is not
+# accepting yet, e.g. while hostd restarts. Unreachable hosts are not.
+TRANSIENT_ERRNOS = frozenset([
+    errno.ECONNRESET,
+    errno.ECONNABORTED,
+    errno.ECONNREFUSED,
+    errno.EPIPE,
+    errno.ETIMEDOUT,
+    errno.EAGAIN,
+])
+
 def retry_with_exp_backoff(
     slot_time_ms,
     max_delay_ms,
@@ -59,6 +83,156 @@ def retry_with_delay(
     yield retry_num
 
 
+class RetryBudget(object):
+  """
+  Token bucket shared by many callers to cap the rate of retries.
+
+  Every retry (not the first attempt) takes a token. Tokens are refilled at
+  rate_per_sec up to burst. When the bucket is empty callers stop retrying
+  instead of piling on a struggling service, e.g. when a whole rack comes
+  back at once.
+  """
+
+  def __init__(self, rate_per_sec, burst):
+    self.rate_per_sec = float(rate_per_sec)
+    self.burst = float(burst)
+    self._tokens = float(burst)
+    self._last_refill = time.time()
+    self._lock = threading.Lock()
+
+  def try_acquire(self, tokens=1):
+    """
+    Takes tokens from the bucket. Returns False if there are not enough.
+    """
+    with self._lock:
+      now = time.time()
+      self._tokens = min(self.burst, self._tokens +
+                         (now - self._last_refill) * self.rate_per_sec)
+      self._last_refill = now
+      if self._tokens < tokens:
+        return False
+      self._tokens -= tokens
+      return True
+
+def is_transient_error(ex):
+  """
+  Returns True if ex is a failure that may go away on retry: timeouts and
+  connections reset, closed or refused by the peer.
+  """
+  if isinstance(ex, (socket.timeout, ConnectionError,
+                     http.client.RemoteDisconnected)):
+    # Whatever their errno, which is None when raised by the HTTP layer.
+    return True
+  if isinstance(ex, (socket.error, IOError)):
+    return getattr(ex, "errno", None) in TRANSIENT_ERRNOS
+  return False
+
+def _decorrelated_jitter_delays(base_delay_ms, max_delay_ms, max_retries,
+                                deadline, budget):
+  """
+  Generator of the delays in seconds before each retry.
+
+  Delays use decorrelated jitter, delay = min(max, uniform(base, 3 * prev)),
+  which keeps retries of many callers from lining up. The generator stops
+  when max_retries is reached, when the next attempt would start after
+  deadline, or when budget has no tokens left.
+  """
+  base = base_delay_ms / 1e3
+  cap = max_delay_ms / 1e3
+  delay = base
+  for retry_num in count(1):
+    if max_retries is not None and retry_num > max_retries:
+      return
+    delay = min(cap, random.uniform(base, delay * 3))
+    if deadline is not None and time.time() + delay >= deadline:
+      return
+    if budget is not None and not budget.try_acquire():
+      return
+    yield delay
+
+def retry_with_deadline(
+    base_delay_ms,
+    max_delay_ms,
+    max_retries=None,
+    deadline_secs=None,
+    budget=None):
+  """
+  Generator function that backs off with decorrelated jitter between
+  iterations, within an overall deadline and a shared retry budget.
+
+  There is no delay before the first iteration.
+
+  Args:
+    base_delay_ms (int): Minimum delay in milliseconds.
+    max_delay_ms (int): Maximum delay in milliseconds.
+    max_retries (int): Maximum number of retries, or None for infinite retries.
+    deadline_secs (float): Time from now after which no retry is started, or
+      None for no deadline.
+    budget (RetryBudget): Budget each retry takes a token from, or None.
+  Yields:
+    retry_num (int), starting from 0.
+  """
+  deadline = None if deadline_secs is None else time.time() + deadline_secs
+  yield 0
+  delays = _decorrelated_jitter_delays(base_delay_ms, max_delay_ms,
+                                       max_retries, deadline, budget)
+  for retry_num, delay in enumerate(delays, 1):
+    time.sleep(delay)
+    yield retry_num
+
+def call_with_retries(
+    func,
+    base_delay_ms,
+    max_delay_ms,
+    max_retries=None,
+    deadline_secs=None,
+    budget=None,
+    is_retryable=is_transient_error):
+  """
+  Calls func() until it returns, retrying with retry_with_deadline() as long
+  as the exception raised is classified retryable by is_retryable.
+
+  Returns the value returned by func. Raises the last exception if func did
+  not succeed.
+  """
+  last_exception = None
+  for _ in retry_with_deadline(base_delay_ms, max_delay_ms, max_retries,
+                               deadline_secs, budget):
+    try:
+      return func()
+    except Exception as ex:
+      last_exception = ex
+      if not is_retryable(ex):
+        raise
+  raise last_exception
+
+async def async_call_with_retries(
+    coro_func,
+    base_delay_ms,
+    max_delay_ms,
+    max_retries=None,
+    deadline_secs=None,
+    budget=None,
+    is_retryable=is_transient_error):
+  """
+  asyncio variant of call_with_retries(). Awaits coro_func() and sleeps with
+  asyncio.sleep() between attempts, so the event loop is not blocked.
+  """
+  import asyncio
+  deadline = None if deadline_secs is None else time.time() + deadline_secs
+  delays = _decorrelated_jitter_delays(base_delay_ms, max_delay_ms,
+                                       max_retries, deadline, budget)
+  while True:
+    try:
+      return await coro_func()
+    except Exception as ex:
+      if not is_retryable(ex):
+        raise
+      delay = next(delays, None)
+      if delay is None:
+        raise
+    await asyncio.sleep(delay)
+
 def retry_meta_decorator(dec_fuc):
   def wrapper(*args, **kwargs):
     def decorator(func):
@@ -74,7 +248,8 @@ def retry_exp_without_raising(func, slot_time_ms, max_delay_ms, max_retries):
                                             max_retries):
       try:
         return func(self, *args, **kwargs)
-      except:
-        if retry_num > max_retries:
-          return None
+      except Exception as ex:
+        log.WARNING("Attempt %d of %s failed: %s" % (retry_num, func.__name__,
+                                                     ex))
+    return None
   return retry_wrapper
@@ -0,0 +1,382 @@
+"""
+Process wide pool of vSphere service instances keyed by (host_ip, user) and
+the credentials the session logged in with.
+
+Logging in to hostd with SmartConnectNoSSL is expensive, and workflows that
+validate many portgroups on the same host used to pay for it on every
+BaseEsxHostObject they created. The pool hands out live service instances,
+takes them back when the host object is done with them and only logs in when
+no healthy idle session is available. Concurrent acquirers of the same key
+share one login, and the session it produced, instead of each logging in.
+Sessions logged in with explicit credentials are only handed to callers with
+the same password, so a wrong password never gets a session that is already
+logged in.
+"""
+
+import hashlib
+import hmac
+import os
+import threading
+import time
+
+from host_inventory import stop_host_network_inventories
+from liveness import probe_session
+from singleflight import SingleFlight
+
+__all__ = [
+    "SessionPool",
+    "credentials_fingerprint",
+    "get_session_pool",
+]
+
+# Sessions idle for longer than this are logged out by evict_idle().
+session_pool_idle_timeout_secs = 600
+# acquire() and release() sweep expired idle sessions of every key at most
+# this often.
+session_pool_evict_interval_secs = 60
+# Sessions returned to the pool more recently than this are reused without
+# probing the host.
+session_pool_validate_after_secs = 30
+# Maximum number of sessions (idle and in use) per key.
+session_pool_max_sessions_per_host = 4
+
+# Key of the credential fingerprints, so they cannot be checked against
+# guessed passwords outside of this process.
+_fingerprint_key = os.urandom(32)
+
+
+def credentials_fingerprint(user, password):
+  """
+  Returns an opaque fingerprint of explicit credentials, to key the sessions
+  logged in with them.
+  """
+  return hmac.new(_fingerprint_key, ("%s\0%s" % (user, password)).encode(),
+                  hashlib.sha256).hexdigest()
+
+
+class _PooledSession(object):
+  """
+  Book keeping for a single service instance owned by the pool.
+
+  refs counts the callers the session is handed out to, it goes back to the
+  idle list when the last one releases it.
+  """
+  __slots__ = ("service_instance", "created_at", "last_used_at", "refs",
+               "discard")
+
+  def __init__(self, service_instance):
+    now = time.time()
+    self.service_instance = service_instance
+    self.created_at = now
+    self.last_used_at = now
+    self.refs = 0
+    self.discard = False
+
+
+class SessionPool(object):
+  """
+  Thread safe pool of vSphere service instances.
+
+  Idle sessions are kept per (host_ip, user, credentials_id) key and reused
+  most recently used first, so the warmest connection is handed out. A
+  session that has been idle for longer than validate_after_secs is probed
+  with CurrentTime() before it is handed out, and dropped if the probe fails. At most max_sessions_per_host
+  sessions exist per key; callers beyond that wait for one to be released.
+  Callers that acquire a key while another caller is checking a session out
+  for it share that session. Idle sessions of every key are expired by
+  acquire() and release() every evict_interval_secs.
+  """
+
+  def __init__(self,
+               max_sessions_per_host=session_pool_max_sessions_per_host,
+               idle_timeout_secs=session_pool_idle_timeout_secs,
+               validate_after_secs=session_pool_validate_after_secs,
+               evict_interval_secs=session_pool_evict_interval_secs):
+    self.max_sessions_per_host = max_sessions_per_host
+    self.idle_timeout_secs = idle_timeout_secs
+    self.validate_after_secs = validate_after_secs
+    self.evict_interval_secs = evict_interval_secs
+
+    self._cond = threading.Condition(threading.Lock())
+    # Map of key to list of idle _PooledSession, most recently used last.
+    self._idle = {}
+    # Map of key to number of sessions (idle and in use) owned by the pool.
+    self._total = {}
+    # Map of id(service_instance) to (key, _PooledSession) for handed out
+    # sessions.
+    self._in_use = {}
+
+    # Coalesces concurrent checkouts of the same key.
+    self._checkouts = SingleFlight()
+    self._last_sweep_at = time.time()
+
+    self.logins = 0
+    self.logins_avoided = 0
+    self.logins_shared = 0
+    self.evictions = 0
+
+  def acquire(self, host_ip, user, connect_func, timeout_secs=None,
+              credentials_id=None):
+    """
+    Returns a live service instance for (host_ip, user, credentials_id).
+
+    Args:
+      host_ip (str): IP address of the host.
+      user (str): User the session is logged in as. None for sessions created
+        with one time password credentials.
+      connect_func (callable): Called without arguments to log in when no idle
+        session can be reused. Returns a service instance or None on failure.
+      timeout_secs (float): Maximum time to wait for a session slot when the
+        per host limit is reached, or None to wait forever.
+      credentials_id (str): credentials_fingerprint() of the credentials
+        connect_func logs in with, or None for one time password credentials.
+
+    Returns:
+      Service instance, or None if no session is available.
+    """
+    key = (host_ip, user, credentials_id)
+    deadline = None if timeout_secs is None else time.time() + timeout_secs
+    self._maybe_sweep()
+    # _checkout() appends to leader when this caller runs it rather than
+    # sharing the checkout of a concurrent caller.
+    leader = []
+    service_instance = self._checkouts.do(
+        key, self._checkout, key, connect_func, deadline, leader)
+    if not service_instance:
+      return None
+    with self._cond:
+      entry = self._in_use.get(id(service_instance))
+      if not entry:
+        # Released by every other sharer and handed out again meanwhile.
+        return self.acquire(host_ip, user, connect_func, timeout_secs,
+                            credentials_id)
+      entry[1].refs += 1
+      if not leader:
+        self.logins_shared += 1
+    return service_instance
+
+  def _checkout(self, key, connect_func, deadline, leader):
+    """
+    Returns a session for key with no references, reusing an idle one or
+    logging in.
+    """
+    leader.append(True)
+    with self._cond:
+      while True:
+        session = self._pop_idle_locked(key)
+        if session:
+          break
+        if self._total.get(key, 0) < self.max_sessions_per_host:
+          # Reserve a slot before releasing the lock to log in.
+          self._total[key] = self._total.get(key, 0) + 1
+          break
+        remaining = None if deadline is None else deadline - time.time()
+        if remaining is not None and remaining <= 0:
+          return None
+        self._cond.wait(remaining)
+
+    if session:
+      if self._is_alive(session):
+        with self._cond:
+          self.logins_avoided += 1
+          session.last_used_at = time.time()
+          self._in_use[id(session.service_instance)] = (key, session)
+        return session.service_instance
+      # The stale session keeps its slot reserved for the new login below.
+      self._logout(session.service_instance)
+
+    service_instance = None
+    try:
+      service_instance = connect_func()
+    finally:
+      with self._cond:
+        if service_instance:
+          self.logins += 1
+          session = _PooledSession(service_instance)
+          self._in_use[id(service_instance)] = (key, session)
+        else:
+          self._release_slot_locked(key)
+    return service_instance
+
+  def release(self, service_instance, discard=False):
+    """
+    Returns a service instance obtained from acquire() to the pool.
+
+    Args:
+      service_instance: Service instance returned by acquire().
+      discard (bool): If True, the session is logged out instead of being kept
+        for reuse, e.g. because the caller saw it fail. A shared session is
+        logged out when the last caller releases it.
+
+    Returns:
+      True if the service instance was owned by the pool, False otherwise.
+    """
+    with self._cond:
+      entry = self._in_use.get(id(service_instance))
+      if not entry:
+        return False
+      key, session = entry
+      session.discard = session.discard or discard
+      session.refs -= 1
+      if session.refs > 0:
+        # Still used by callers that shared the checkout.
+        return True
+      del self._in_use[id(service_instance)]
+      if not session.discard:
+        session.last_used_at = time.time()
+        self._idle.setdefault(key, []).append(session)
+        self._cond.notify()
+      else:
+        self._release_slot_locked(key)
+    if session.discard:
+      self._logout(service_instance)
+    self._maybe_sweep()
+    return True
+
+  def evict_idle(self):
+    """
+    Logs out sessions that have been idle for longer than idle_timeout_secs.
+
+    Returns:
+      Number of sessions evicted.
+    """
+    with self._cond:
+      expired = self._expire_idle_locked()
+    for session in expired:
+      self._logout(session.service_instance)
+    return len(expired)
+
+  def _maybe_sweep(self):
+    """
+    Logs out expired idle sessions of every key in the background, at most
+    every evict_interval_secs, so sessions of hosts that are not used again
+    do not stay logged in.
+    """
+    now = time.time()
+    with self._cond:
+      if now - self._last_sweep_at < self.evict_interval_secs:
+        return
+      self._last_sweep_at = now
+      expired = self._expire_idle_locked()
+    for session in expired:
+      self._logout_async(session.service_instance)
+
+  def _expire_idle_locked(self):
+    """
+    Removes the sessions idle for longer than idle_timeout_secs from the pool
+    and returns them.
+    """
+    expired = []
+    cutoff = time.time() - self.idle_timeout_secs
+    for key, sessions in list(self._idle.items()):
+      keep = [s for s in sessions if s.last_used_at >= cutoff]
+      for session in sessions:
+        if session.last_used_at < cutoff:
+          expired.append(session)
+          self._release_slot_locked(key)
+      if keep:
+        self._idle[key] = keep
+      else:
+        del self._idle[key]
+    self.evictions += len(expired)
+    return expired
+
+  def close_all(self):
+    """
+    Logs out all idle sessions. Sessions in use are logged out when released
+    with discard=True, or kept otherwise.
+    """
+    with self._cond:
+      idle = [s for sessions in self._idle.values() for s in sessions]
+      for key, sessions in self._idle.items():
+        for _ in sessions:
+          self._release_slot_locked(key)
+      self._idle = {}
+    for session in idle:
+      self._logout(session.service_instance)
+
+  def stats(self):
+    """
+    Returns a dict with pool counters.
+    """
+    with self._cond:
+      return {
+        "logins": self.logins,
+        "logins_avoided": self.logins_avoided,
+        "logins_shared": self.logins_shared,
+        "evictions": self.evictions,
+        "idle": sum(len(s) for s in self._idle.values()),
+        "in_use": len(self._in_use),
+      }
+
+  def _pop_idle_locked(self, key):
+    """
+    Pops the most recently used idle session for key, expiring old ones.
+    """
+    sessions = self._idle.get(key)
+    cutoff = time.time() - self.idle_timeout_secs
+    while sessions:
+      session = sessions.pop()
+      if session.last_used_at >= cutoff:
+        return session
+      # Too old to trust. Its slot is released and it is logged out in the
+      # background.
+      self.evictions += 1
+      self._release_slot_locked(key)
+      self._logout_async(session.service_instance)
+    return None
+
+  def _release_slot_locked(self, key):
+    count = self._total.get(key, 0) - 1
+    if count > 0:
+      self._total[key] = count
+    else:
+      self._total.pop(key, None)
+    self._cond.notify()
+
+  def _is_alive(self, session):
+    """
+    Cheap liveness check. Recently used sessions are trusted, older ones are
+    probed with a CurrentTime() round trip under a short timeout.
+    """
+    if time.time() - session.last_used_at < self.validate_after_secs:
+      return True
+    return probe_session(session.service_instance)
+
+  def _logout_async(self, service_instance):
+    thread = threading.Thread(target=self._logout, args=(service_instance,))
+    thread.daemon = True
+    thread.start()
+
+  @staticmethod
+  def _logout(service_instance):
+    from pyVim.connect import Disconnect
+    # Host inventories following updates over the session would fail once
+    # it is logged out.
+    try:
+      stop_host_network_inventories(service_instance._stub)
+    except Exception:
+      pass
+    try:
+      Disconnect(service_instance)
+    except Exception:
+      pass
+    # Disconnect() may leave connections open.
+    try:
+      service_instance._stub.DropConnections()
+    except Exception:
+      pass
+
+
+_session_pool = None
+_session_pool_lock = threading.Lock()
+
+def get_session_pool():
+  """
+  Returns the process wide SessionPool.
+  """
+  global _session_pool
+  with _session_pool_lock:
+    if _session_pool is None:
+      _session_pool = SessionPool()
+    return _session_pool
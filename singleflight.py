@@ -0,0 +1,121 @@
+"""
+Coalescing of concurrent identical operations.
+
+Bursts of identical requests, e.g. every worker of a service fetching one
+time password credentials of the same host at startup, multiply the load on
+hostd by the number of workers. SingleFlight lets concurrent callers with the
+same key share one in-flight call of the operation and its result or
+exception. Calls made after the in-flight one finished start a new one, so
+no result outlives the call that produced it.
+"""
+
+import functools
+import threading
+
+__all__ = [
+    "SingleFlight",
+    "coalesce",
+    "get_single_flight",
+]
+
+
+class _Call(object):
+  __slots__ = ("done", "result", "error")
+
+  def __init__(self):
+    self.done = threading.Event()
+    self.result = None
+    self.error = None
+
+
+class SingleFlight(object):
+  """
+  Map of key to the in-flight call of an operation.
+
+  Attributes:
+    calls (int): Number of calls that ran the operation.
+    shared (int): Number of calls that joined an in-flight one instead.
+  """
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    self._calls = {}
+    self.calls = 0
+    self.shared = 0
+
+  def do(self, key, func, *args, **kwargs):
+    """
+    Calls func(*args, **kwargs) unless a call for key is in flight, in which
+    case its outcome is waited for instead. Returns the result of the call,
+    or raises the exception it raised.
+    """
+    with self._lock:
+      call = self._calls.get(key)
+      if call:
+        self.shared += 1
+        leader = False
+      else:
+        call = _Call()
+        self._calls[key] = call
+        self.calls += 1
+        leader = True
+
+    if leader:
+      try:
+        call.result = func(*args, **kwargs)
+      except BaseException as ex:
+        call.error = ex
+      finally:
+        with self._lock:
+          del self._calls[key]
+        call.done.set()
+    else:
+      call.done.wait()
+
+    if call.error is not None:
+      raise call.error
+    return call.result
+
+  def in_flight(self, key):
+    """
+    Returns True if a call for key is in flight.
+    """
+    with self._lock:
+      return key in self._calls
+
+  def stats(self):
+    """
+    Returns a dict with the flight counters.
+    """
+    with self._lock:
+      return {"calls": self.calls, "shared": self.shared,
+              "in_flight": len(self._calls)}
+
+
+_flights = {}
+_flights_lock = threading.Lock()
+
+def get_single_flight(name):
+  """
+  Returns the process wide SingleFlight of the operation called name.
+  """
+  with _flights_lock:
+    flight = _flights.get(name)
+    if flight is None:
+      flight = SingleFlight()
+      _flights[name] = flight
+    return flight
+
+def coalesce(name):
+  """
+  Decorator sharing the in-flight call of the decorated function among
+  concurrent callers passing the same arguments, through the process wide
+  SingleFlight called name.
+  """
+  def decorator(func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+      key = (args, tuple(sorted(kwargs.items())))
+      return get_single_flight(name).do(key, func, *args, **kwargs)
+    return wrapper
+  return decorator
@@ -0,0 +1,265 @@
+"""
+Persistent on-disk snapshots of host network state.
+
+Short lived processes otherwise log in and pull vnics, portgroups and
+transport zones before they can answer anything. SnapshotStore keeps the
+data behind validate_nsx_t_portgroup(), get_portkey_of_host_interface() and
+the esxcli interface tables in an SQLite database, one row per host UUID and
+section, tagged with a change version that is bumped whenever the content
+changes. Host IPs are mapped to host UUIDs so that a new process can find the
+snapshot of a host before logging in to it.
+
+serve_stored() implements stale-while-revalidate: until a section of a host
+was fetched live in this process, the stored snapshot is returned
+immediately and the live fetch runs in the background to refresh it.
+"""
+
+from collections import namedtuple
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from lazy_import import LazyImport
+
+log = LazyImport("util.base", "log")
+
+__all__ = [
+    "SECTION_INTERFACES",
+    "SECTION_NETWORK",
+    "SECTION_VNICS",
+    "SnapshotStore",
+    "StoredSnapshot",
+    "get_snapshot_store",
+    "save_snapshot",
+    "serve_stored",
+    "wait_for_refreshes",
+]
+
+# HostNetworkSnapshot used by validate_nsx_t_portgroup().
+SECTION_NETWORK = "network"
+# Distributed port of every vnic and the portgroups they are on, used by
+# get_portkey_of_host_interface().
+SECTION_VNICS = "vnics"
+# esxcli interface table records.
+SECTION_INTERFACES = "interfaces"
+
+# Location of the store, None disables it.
+snapshot_store_path = os.path.join(os.path.expanduser("~"), ".cache",
+                                   "vmware_client", "host_snapshots.db")
+# Stored snapshots older than this are not served.
+snapshot_max_age_secs = 24 * 3600
+
+StoredSnapshot = namedtuple("StoredSnapshot", [
+    "host_uuid", "section", "version", "updated_at", "payload"])
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS hosts (
+  host_ip TEXT PRIMARY KEY,
+  host_uuid TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS snapshots (
+  host_uuid TEXT NOT NULL,
+  section TEXT NOT NULL,
+  version INTEGER NOT NULL,
+  digest TEXT NOT NULL,
+  updated_at REAL NOT NULL,
+  payload TEXT NOT NULL,
+  PRIMARY KEY (host_uuid, section)
+);
+"""
+
+
+class SnapshotStore(object):
+  """
+  SQLite backed map of (host UUID, section) to a JSON serializable payload.
+
+  The store is a cache: database errors are logged and reported as a miss.
+  """
+
+  def __init__(self, path):
+    self.path = path
+    self._lock = threading.Lock()
+    # Map of (host_ip, host_uuid, section) to the (digest, version) last
+    # written by this process.
+    self._written = {}
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+      os.makedirs(directory)
+    self._db = sqlite3.connect(path, timeout=5, check_same_thread=False)
+    # Several processes may read and write the store concurrently.
+    self._db.execute("PRAGMA journal_mode=WAL")
+    # A snapshot lost on power failure is fetched again, no need to sync
+    # every write.
+    self._db.execute("PRAGMA synchronous=NORMAL")
+    self._db.executescript(_SCHEMA)
+    self._db.commit()
+
+  def close(self):
+    with self._lock:
+      self._db.close()
+
+  def host_uuid_of(self, host_ip):
+    """
+    Returns the UUID of the host last seen at host_ip, or None.
+    """
+    row = self._query("SELECT host_uuid FROM hosts WHERE host_ip = ?",
+                      (host_ip,))
+    return row[0] if row else None
+
+  def get(self, host_uuid, section):
+    """
+    Returns the StoredSnapshot of section of the host, or None.
+    """
+    row = self._query(
+        "SELECT version, updated_at, payload FROM snapshots "
+        "WHERE host_uuid = ? AND section = ?", (host_uuid, section))
+    if not row:
+      return None
+    version, updated_at, payload = row
+    return StoredSnapshot(host_uuid, section, version, updated_at,
+                          json.loads(payload))
+
+  def get_for_host(self, host_ip, section):
+    """
+    Returns the StoredSnapshot of section of the host last seen at host_ip,
+    or None.
+    """
+    host_uuid = self.host_uuid_of(host_ip)
+    return self.get(host_uuid, section) if host_uuid else None
+
+  def put(self, host_ip, host_uuid, section, payload):
+    """
+    Stores payload as section of the host and maps host_ip to it.
+
+    Returns the change version of the section, which is only bumped if
+    payload differs from the stored one, or None on error.
+    """
+    data = json.dumps(payload, sort_keys=True, separators=(",", ":"))
+    digest = hashlib.sha1(data.encode("utf-8")).hexdigest()
+    key = (host_ip, host_uuid, section)
+    with self._lock:
+      if key in self._written and self._written[key][0] == digest:
+        # Written by this process already, skip the transaction.
+        return self._written[key][1]
+      try:
+        with self._db:
+          self._db.execute(
+              "INSERT OR REPLACE INTO hosts (host_ip, host_uuid) "
+              "VALUES (?, ?)", (host_ip, host_uuid))
+          row = self._db.execute(
+              "SELECT version, digest FROM snapshots "
+              "WHERE host_uuid = ? AND section = ?",
+              (host_uuid, section)).fetchone()
+          version = 1
+          if row:
+            version = row[0] if row[1] == digest else row[0] + 1
+          self._db.execute(
+              "INSERT OR REPLACE INTO snapshots (host_uuid, section, version, "
+              "digest, updated_at, payload) VALUES (?, ?, ?, ?, ?, ?)",
+              (host_uuid, section, version, digest, time.time(), data))
+        self._written[key] = (digest, version)
+        return version
+      except sqlite3.Error as ex:
+        log.WARNING("Storing %s snapshot of host %s failed: %s" %
+                    (section, host_uuid, ex))
+        return None
+
+  def _query(self, sql, args):
+    with self._lock:
+      try:
+        return self._db.execute(sql, args).fetchone()
+      except sqlite3.Error as ex:
+        log.WARNING("Reading snapshot store %s failed: %s" % (self.path, ex))
+        return None
+
+
+_snapshot_store = None
+_snapshot_store_lock = threading.Lock()
+
+def get_snapshot_store():
+  """
+  Returns the process wide SnapshotStore at snapshot_store_path, or None if
+  the store is disabled or cannot be opened.
+  """
+  global _snapshot_store
+  if snapshot_store_path is None:
+    return None
+  with _snapshot_store_lock:
+    if _snapshot_store is None or _snapshot_store.path != snapshot_store_path:
+      try:
+        _snapshot_store = SnapshotStore(snapshot_store_path)
+      except (OSError, sqlite3.Error) as ex:
+        log.WARNING("Cannot open snapshot store %s: %s" %
+                    (snapshot_store_path, ex))
+        return None
+    return _snapshot_store
+
+
+# (host_ip, section) fetched live in this process.
+_fresh = set()
+# Map of (host_ip, section) to the thread refreshing it.
+_refreshing = {}
+_refresh_lock = threading.Lock()
+
+def save_snapshot(host_ip, host_uuid, section, payload):
+  """
+  Stores a section of a host that was just fetched live. Later
+  serve_stored() calls for it return None, so callers read live state.
+  """
+  with _refresh_lock:
+    _fresh.add((host_ip, section))
+  store = get_snapshot_store()
+  if store and host_uuid:
+    store.put(host_ip, host_uuid, section, payload)
+
+def serve_stored(host_ip, section, refresh, max_age_secs=None):
+  """
+  Returns the stored payload of section of host_ip if it was not fetched
+  live in this process yet, starting refresh() in the background to fetch
+  and save it. Returns None if there is nothing to serve, in which case the
+  caller fetches live state itself.
+
+  Args:
+    max_age_secs (float): Age after which the stored payload is not served,
+      snapshot_max_age_secs by default.
+  """
+  if max_age_secs is None:
+    max_age_secs = snapshot_max_age_secs
+  key = (host_ip, section)
+  if key in _fresh:
+    return None
+  store = get_snapshot_store()
+  stored = store.get_for_host(host_ip, section) if store else None
+  if not stored or time.time() - stored.updated_at > max_age_secs:
+    return None
+  with _refresh_lock:
+    if key not in _refreshing:
+      thread = threading.Thread(target=_refresh, args=(key, refresh),
+                                name="snapshot-refresh-%s-%s" % key)
+      thread.daemon = True
+      _refreshing[key] = thread
+      thread.start()
+  return stored.payload
+
+def _refresh(key, refresh):
+  try:
+    refresh()
+  except Exception as ex:
+    log.WARNING("Refreshing %s snapshot of host %s failed: %s" %
+                (key[1], key[0], ex))
+  finally:
+    with _refresh_lock:
+      _refreshing.pop(key, None)
+
+def wait_for_refreshes(timeout_secs=None):
+  """
+  Waits for the background refreshes started so far to finish.
+  """
+  deadline = None if timeout_secs is None else time.time() + timeout_secs
+  with _refresh_lock:
+    threads = list(_refreshing.values())
+  for thread in threads:
+    thread.join(None if deadline is None else max(0, deadline - time.time()))
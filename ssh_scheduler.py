@@ -0,0 +1,433 @@
+"""
+Admission control and session reuse for SSH commands to hosts.
+
+ESXi sshd refuses connections beyond a small number of concurrent sessions,
+and parallel callers that each opened their own SSHClient failed with session
+limit errors and backed off. SSHScheduler caps the number of commands running
+per host and in the process, and queues the callers beyond that. Waiting
+callers are granted a slot by priority first, so credential fetches go ahead
+of diagnostics, and round robin across hosts among equal priorities, so a
+host with a long queue does not starve the others.
+
+Sessions are persistent: after a command the session is kept idle for the
+next command to the host with the same credentials instead of being closed.
+ScheduledSSHClient leases a session for each command only, so any number of
+clients share the few sessions the caps allow.
+"""
+
+from collections import deque
+import heapq
+import itertools
+import threading
+import time
+
+from instrumentation import record
+
+__all__ = [
+    "PRIORITY_CREDENTIALS",
+    "PRIORITY_DEFAULT",
+    "PRIORITY_DIAGNOSTICS",
+    "SSHScheduler",
+    "ScheduledSSHClient",
+    "get_ssh_scheduler",
+]
+
+# Priorities of SSH commands, lower runs first.
+PRIORITY_CREDENTIALS = 0
+PRIORITY_DEFAULT = 1
+PRIORITY_DIAGNOSTICS = 2
+PRIORITY_NAMES = {
+  PRIORITY_CREDENTIALS: "credentials",
+  PRIORITY_DEFAULT: "default",
+  PRIORITY_DIAGNOSTICS: "diagnostics",
+}
+
+# Maximum number of sessions (idle and in use) per host. Leaves room below
+# the sshd limits of the host for other clients.
+ssh_max_sessions_per_host = 3
+# Maximum number of commands running at once in the process, across hosts.
+ssh_max_sessions = 64
+# Idle sessions older than this are closed instead of being reused.
+ssh_session_idle_timeout_secs = 120
+# Commands returning their session close expired idle sessions of every host
+# at most this often.
+ssh_session_evict_interval_secs = 30
+# Maximum time a command waits for a slot before it fails.
+ssh_queue_timeout_secs = 300
+
+# ssh exits with 255 when the connection failed or was lost.
+SSH_CONNECTION_ERROR_RET = 255
+# Returned by ScheduledSSHClient.execute() when no slot was granted in time.
+SSH_QUEUE_TIMEOUT_RET = -1
+
+
+class _Waiter(object):
+  __slots__ = ("host_ip", "priority", "enqueued_at", "granted", "cancelled")
+
+  def __init__(self, host_ip, priority):
+    self.host_ip = host_ip
+    self.priority = priority
+    self.enqueued_at = time.time()
+    self.granted = False
+    self.cancelled = False
+
+
+class _Session(object):
+  __slots__ = ("key", "ssh_client", "last_used_at")
+
+  def __init__(self, key, ssh_client):
+    self.key = key
+    self.ssh_client = ssh_client
+    self.last_used_at = time.time()
+
+
+class SSHScheduler(object):
+  """
+  Thread safe scheduler of SSH commands to hosts.
+
+  A slot is one command running on one session. At most max_sessions_per_host
+  sessions are open per host and at most max_sessions commands run at once.
+  Sessions are keyed by the credentials they were opened with, and reused
+  most recently used first. Idle sessions of every host are expired when a
+  command returns its session, at most every evict_interval_secs, so
+  sessions to hosts that get no more commands do not stay open.
+
+  Attributes:
+    granted (int): Number of slots granted.
+    timeouts (int): Number of callers that gave up waiting for a slot.
+    sessions_opened (int): Number of sessions opened.
+    sessions_reused (int): Number of commands run on an idle session.
+    sessions_closed (int): Number of sessions closed.
+    max_wait_secs (float): Longest time a caller waited for a slot.
+  """
+
+  def __init__(self, max_sessions_per_host=ssh_max_sessions_per_host,
+               max_sessions=ssh_max_sessions,
+               idle_timeout_secs=ssh_session_idle_timeout_secs,
+               evict_interval_secs=ssh_session_evict_interval_secs):
+    self.max_sessions_per_host = max_sessions_per_host
+    self.max_sessions = max_sessions
+    self.idle_timeout_secs = idle_timeout_secs
+    self.evict_interval_secs = evict_interval_secs
+
+    self._cond = threading.Condition(threading.Lock())
+    self._seq = itertools.count()
+    # Map of host_ip to heap of (priority, seq, _Waiter).
+    self._waiting = {}
+    # Hosts with waiters, in the order they are served among equal
+    # priorities.
+    self._rotation = deque()
+    # Map of host_ip to number of running commands.
+    self._active = {}
+    self._total_active = 0
+    # Map of host_ip to number of open sessions, idle and in use.
+    self._open = {}
+    # Map of host_ip to list of idle _Session, most recently used last.
+    self._idle = {}
+    self._last_sweep_at = time.time()
+
+    self.granted = 0
+    self.timeouts = 0
+    self.sessions_opened = 0
+    self.sessions_reused = 0
+    self.sessions_closed = 0
+    self.max_wait_secs = 0.0
+
+  def run(self, host_ip, key, connect_func, func, priority=PRIORITY_DEFAULT,
+          timeout_secs=ssh_queue_timeout_secs, discard_if=None):
+    """
+    Runs func with a session to host_ip once a slot is granted.
+
+    Args:
+      host_ip (str): IP address of the host.
+      key (tuple): Credentials of the session, sessions are only reused for
+        the same key.
+      connect_func (callable): Called without arguments to open a session
+        when no idle one with key is available. Returns an SSHClient.
+      func (callable): Called with the SSHClient, returns the result.
+      priority (int): One of the PRIORITY_* values.
+      timeout_secs (float): Maximum time to wait for a slot, or None to wait
+        forever.
+      discard_if (callable): Called with the result of func, the session is
+        closed instead of being kept if it returns True.
+
+    Returns:
+      (True, result of func), or (False, error message) if no slot was
+      granted in time. Exceptions raised by connect_func or func are
+      propagated and the session is closed.
+    """
+    if not self._acquire_slot(host_ip, priority, timeout_secs):
+      return (False, "Timed out waiting %s secs for an ssh session to host %s"
+              % (timeout_secs, host_ip))
+    session = None
+    keep = False
+    try:
+      session = self._checkout(host_ip, key, connect_func)
+      result = func(session.ssh_client)
+      keep = not (discard_if and discard_if(result))
+      return (True, result)
+    finally:
+      self._checkin(host_ip, session, keep)
+
+  def _acquire_slot(self, host_ip, priority, timeout_secs):
+    waiter = _Waiter(host_ip, priority)
+    deadline = (None if timeout_secs is None else
+                waiter.enqueued_at + timeout_secs)
+    with self._cond:
+      heap = self._waiting.get(host_ip)
+      if heap is None:
+        heap = self._waiting[host_ip] = []
+        self._rotation.append(host_ip)
+      heapq.heappush(heap, (priority, next(self._seq), waiter))
+      self._dispatch_locked()
+      while not waiter.granted:
+        remaining = None if deadline is None else deadline - time.time()
+        if remaining is not None and remaining <= 0:
+          waiter.cancelled = True
+          self.timeouts += 1
+          break
+        self._cond.wait(remaining)
+      wait_secs = time.time() - waiter.enqueued_at
+      self.max_wait_secs = max(self.max_wait_secs, wait_secs)
+    record("ssh_queue", host_ip, PRIORITY_NAMES.get(priority, str(priority)),
+           "granted" if waiter.granted else "timeout", wait_secs)
+    return waiter.granted
+
+  def _dispatch_locked(self):
+    """
+    Grants slots to waiters while capacity is left. The waiter with the best
+    priority among the hosts below their cap goes first, ties go to the host
+    that was served least recently.
+    """
+    granted_any = False
+    while self._total_active < self.max_sessions:
+      best_host = None
+      best_priority = None
+      for host_ip in list(self._rotation):
+        heap = self._waiting[host_ip]
+        while heap and heap[0][2].cancelled:
+          heapq.heappop(heap)
+        if not heap:
+          del self._waiting[host_ip]
+          self._rotation.remove(host_ip)
+          continue
+        if self._active.get(host_ip, 0) >= self.max_sessions_per_host:
+          continue
+        if best_priority is None or heap[0][0] < best_priority:
+          best_host, best_priority = host_ip, heap[0][0]
+      if best_host is None:
+        break
+      _, _, waiter = heapq.heappop(self._waiting[best_host])
+      waiter.granted = True
+      self._active[best_host] = self._active.get(best_host, 0) + 1
+      self._total_active += 1
+      self.granted += 1
+      granted_any = True
+      # Served, goes behind the other hosts.
+      self._rotation.remove(best_host)
+      self._rotation.append(best_host)
+    if granted_any:
+      self._cond.notify_all()
+
+  def _checkout(self, host_ip, key, connect_func):
+    """
+    Returns an idle session of host_ip with key, or opens one. The caller
+    holds a slot of host_ip.
+    """
+    stale = []
+    try:
+      with self._cond:
+        session = self._pop_idle_locked(host_ip, key, stale)
+        if session:
+          self.sessions_reused += 1
+          return session
+        if self._open.get(host_ip, 0) >= self.max_sessions_per_host:
+          # Every slot but ours is idle or in use, make room by closing the
+          # least recently used idle session of other credentials.
+          stale.append(self._idle[host_ip].pop(0))
+          self._forget_locked(host_ip)
+        # Reserve the session before releasing the lock to connect.
+        self._open[host_ip] = self._open.get(host_ip, 0) + 1
+    finally:
+      for old in stale:
+        self._close(old)
+
+    try:
+      ssh_client = connect_func()
+    except BaseException:
+      with self._cond:
+        self._forget_locked(host_ip)
+      raise
+    with self._cond:
+      self.sessions_opened += 1
+    return _Session(key, ssh_client)
+
+  def _checkin(self, host_ip, session, keep):
+    expired = []
+    with self._cond:
+      self._active[host_ip] -= 1
+      if not self._active[host_ip]:
+        del self._active[host_ip]
+      self._total_active -= 1
+      if session and keep:
+        session.last_used_at = time.time()
+        self._idle.setdefault(host_ip, []).append(session)
+        session = None
+      elif session:
+        self._forget_locked(host_ip)
+      now = time.time()
+      if now - self._last_sweep_at >= self.evict_interval_secs:
+        self._last_sweep_at = now
+        self._expire_idle_locked(expired)
+      self._dispatch_locked()
+    if session:
+      expired.append(session)
+    for old in expired:
+      self._close(old)
+
+  def _pop_idle_locked(self, host_ip, key, stale):
+    """
+    Pops the most recently used idle session of host_ip with key. Expired
+    idle sessions of the host are moved to stale.
+    """
+    sessions = self._idle.get(host_ip)
+    if not sessions:
+      return None
+    cutoff = time.time() - self.idle_timeout_secs
+    for session in [s for s in sessions if s.last_used_at < cutoff]:
+      sessions.remove(session)
+      stale.append(session)
+      self._forget_locked(host_ip)
+    found = None
+    for index in range(len(sessions) - 1, -1, -1):
+      if sessions[index].key == key:
+        found = sessions.pop(index)
+        break
+    if not sessions:
+      self._idle.pop(host_ip, None)
+    return found
+
+  def _forget_locked(self, host_ip):
+    count = self._open.get(host_ip, 0) - 1
+    if count > 0:
+      self._open[host_ip] = count
+    else:
+      self._open.pop(host_ip, None)
+    if not self._idle.get(host_ip):
+      self._idle.pop(host_ip, None)
+
+  def evict_idle(self):
+    """
+    Closes sessions that have been idle for longer than idle_timeout_secs.
+
+    Returns:
+      Number of sessions closed.
+    """
+    expired = []
+    with self._cond:
+      self._expire_idle_locked(expired)
+    for session in expired:
+      self._close(session)
+    return len(expired)
+
+  def _expire_idle_locked(self, expired):
+    """
+    Moves the idle sessions of every host expired for longer than
+    idle_timeout_secs to expired.
+    """
+    for host_ip in list(self._idle):
+      self._pop_idle_locked(host_ip, None, expired)
+
+  def close_all(self):
+    """
+    Closes all idle sessions. Sessions in use are kept until their command
+    finishes.
+    """
+    with self._cond:
+      idle = [(host_ip, session) for host_ip, sessions in self._idle.items()
+              for session in sessions]
+      self._idle = {}
+      for host_ip, _ in idle:
+        self._forget_locked(host_ip)
+    for _, session in idle:
+      self._close(session)
+
+  def stats(self):
+    """
+    Returns a dict with scheduler counters.
+    """
+    with self._cond:
+      return {
+        "granted": self.granted,
+        "timeouts": self.timeouts,
+        "sessions_opened": self.sessions_opened,
+        "sessions_reused": self.sessions_reused,
+        "sessions_closed": self.sessions_closed,
+        "max_wait_secs": self.max_wait_secs,
+        "waiting": sum(len(heap) for heap in self._waiting.values()),
+        "active": self._total_active,
+        "open": sum(self._open.values()),
+      }
+
+  def _close(self, session):
+    with self._cond:
+      self.sessions_closed += 1
+    close = getattr(session.ssh_client, "close", None)
+    if close:
+      try:
+        close()
+      except Exception:
+        pass
+
+
+class ScheduledSSHClient(object):
+  """
+  SSHClient stand-in running every command through the SSHScheduler on a
+  leased persistent session.
+
+  execute() returns (SSH_QUEUE_TIMEOUT_RET, "", error message) and
+  transfer_to() returns False if no slot was granted in time.
+  """
+
+  def __init__(self, host_ip, key, connect_func, priority=PRIORITY_DEFAULT,
+               timeout_secs=ssh_queue_timeout_secs, scheduler=None):
+    self.host_ip = host_ip
+    self._key = key
+    self._connect_func = connect_func
+    self._priority = priority
+    self._timeout_secs = timeout_secs
+    self._scheduler = scheduler
+
+  def _run(self, func, discard_if=None):
+    scheduler = self._scheduler or get_ssh_scheduler()
+    return scheduler.run(self.host_ip, self._key, self._connect_func, func,
+                         priority=self._priority,
+                         timeout_secs=self._timeout_secs,
+                         discard_if=discard_if)
+
+  def execute(self, cmd, *args, **kwargs):
+    ret, result = self._run(
+        lambda ssh_client: ssh_client.execute(cmd, *args, **kwargs),
+        discard_if=lambda result: result[0] == SSH_CONNECTION_ERROR_RET)
+    if not ret:
+      return (SSH_QUEUE_TIMEOUT_RET, "", result)
+    return result
+
+  def transfer_to(self, *args, **kwargs):
+    ret, result = self._run(
+        lambda ssh_client: ssh_client.transfer_to(*args, **kwargs))
+    return result if ret else False
+
+
+_ssh_scheduler = None
+_ssh_scheduler_lock = threading.Lock()
+
+def get_ssh_scheduler():
+  """
+  Returns the process wide SSHScheduler.
+  """
+  global _ssh_scheduler
+  with _ssh_scheduler_lock:
+    if _ssh_scheduler is None:
+      _ssh_scheduler = SSHScheduler()
+    return _ssh_scheduler
@@ -0,0 +1,23 @@
+"""
+Test setup. The client runs against the vSphere and SSH stand-ins of
+benchmarks/fakes.py, and every test starts with cold process wide state.
+"""
+
+import os
+import sys
+
+import pytest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+sys.path.insert(0, os.path.join(os.path.dirname(TESTS_DIR), "benchmarks"))
+
+# Installs the fakes before any client module is imported.
+import run_benchmarks
+
+
+@pytest.fixture(autouse=True)
+def cold_state():
+  run_benchmarks.reset_process_state()
+  yield
+  run_benchmarks.reset_process_state()
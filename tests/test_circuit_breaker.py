@@ -0,0 +1,61 @@
+import sys
+
+import pytest
+
+import client
+from circuit_breaker import CircuitBreaker, get_host_circuit_breaker
+
+
+def test_opens_after_threshold_and_probes_after_timeout(monkeypatch):
+  now = [1000.0]
+  monkeypatch.setattr("circuit_breaker.time.time", lambda: now[0])
+  breaker = CircuitBreaker(failure_threshold=2, reset_timeout_secs=30)
+  breaker.record_failure()
+  assert breaker.allow()
+  breaker.record_failure()
+  assert breaker.state == CircuitBreaker.OPEN
+  assert not breaker.allow()
+
+  now[0] += 30
+  assert breaker.allow()
+  # Only one probe at a time.
+  assert not breaker.allow()
+  breaker.record_failure()
+  assert breaker.state == CircuitBreaker.OPEN
+
+  now[0] += 30
+  assert breaker.allow()
+  breaker.record_success()
+  assert breaker.state == CircuitBreaker.CLOSED
+  assert breaker.allow()
+
+
+@pytest.fixture
+def rejected_logins(monkeypatch):
+  vim = sys.modules["pyVmomi"].vim
+  logins = []
+
+  def connect(user, pwd, host, socketTimeout=None):
+    logins.append((user, pwd))
+    raise vim.fault.InvalidLogin()
+
+  monkeypatch.setattr(sys.modules["pyVim.connect"], "SmartConnectNoSSL",
+                      connect)
+  return logins
+
+
+def test_wrong_explicit_password_is_not_retried(rejected_logins):
+  for _ in range(10):
+    obj = client.BaseEsxHostObject("10.0.0.1", user="root", password="wrong")
+    assert not obj.is_connected(probe=False)
+  assert len(rejected_logins) == 10
+  # Other callers of the host are not locked out.
+  breaker = get_host_circuit_breaker("10.0.0.1")
+  assert breaker.state == CircuitBreaker.CLOSED
+  assert breaker.allow()
+
+
+def test_rejected_one_time_password_is_retried(rejected_logins):
+  obj = client.BaseEsxHostObject("10.0.0.1")
+  assert not obj.is_connected(probe=False)
+  assert len(rejected_logins) > 1
@@ -0,0 +1,23 @@
+import pytest
+
+import cli
+import client
+import fakes
+
+
+def test_gflags_are_parsed_before_ssh(monkeypatch):
+  hosts = []
+
+  def new_ssh_client(host_ip, **kwargs):
+    hosts.append(host_ip)
+    return fakes.FakeSSHClient(host_ip, "root")
+
+  monkeypatch.setattr(client.FLAGS, "hypervisor_internal_ip", "192.168.5.1")
+  monkeypatch.setattr(client, "new_ssh_client", new_ssh_client)
+  cli.main(["list-vmknics", "--hypervisor_internal_ip=10.0.0.7"])
+  assert hosts == ["10.0.0.7"]
+
+
+def test_unknown_arguments_are_rejected():
+  with pytest.raises(SystemExit):
+    cli.main(["list-vmknics", "--no-such-flag"])
@@ -0,0 +1,56 @@
+import client
+import fakes
+import portgroup_index
+from cluster_validation import (ambiguous_host_msg, host_not_found_msg,
+                                retrieve_validation_matrix)
+
+
+def add_internal_vnic(host):
+  network_info = host._props["config"].network
+  network_info.vnic = network_info.vnic + [
+      fakes.ENV._make_vnic("vmk9", "192.168.5.1", "255.255.255.0", None)]
+
+
+def matrix():
+  stub = fakes.FakeStub(fakes.ENV, "vcenter")
+  content = fakes.ServiceInstance("ServiceInstance", stub).RetrieveContent()
+  return retrieve_validation_matrix(content)
+
+
+def test_hosts_are_found_by_management_address():
+  for index in range(3):
+    host = fakes.ENV.host("10.0.0.%d" % (index + 1))
+    host._props["name"] = "esx-%d.local" % (index + 1)
+    add_internal_vnic(host)
+  result = matrix()
+  assert result.host_name("10.0.0.2") == "esx-2.local"
+  assert result.host_name("esx-3.local") == "esx-3.local"
+  # Not a management vnic, and every host has it.
+  assert result.host_name("192.168.5.1") is None
+  ret, msg = result.validate("192.168.5.1", "DPG-HOST-BP")
+  assert not ret and msg.endswith(host_not_found_msg)
+  assert result.validate("10.0.0.2", "DPG-HOST-BP")[0]
+
+
+def test_management_address_of_several_hosts_is_ambiguous():
+  for index in range(2):
+    host = fakes.ENV.host("10.0.0.%d" % (index + 1))
+    host._props["name"] = "esx-%d.local" % (index + 1)
+    host._props["config"].network.vnic[0].spec.ip.ipAddress = "10.0.0.9"
+  result = matrix()
+  assert result.host_name("10.0.0.9") is None
+  ret, msg = result.validate("10.0.0.9", "DPG-HOST-BP")
+  assert not ret and msg.endswith(ambiguous_host_msg)
+
+
+def test_cluster_validation_does_not_build_portgroup_index(monkeypatch):
+  builds = []
+  monkeypatch.setattr(portgroup_index.PortgroupIndex, "_build",
+                      lambda self: builds.append(self))
+  hosts = ["10.0.0.1", "10.0.0.2"]
+  for host_ip in hosts:
+    fakes.ENV.host(host_ip)
+  ret, results = client.validate_nsx_t_portgroups_in_cluster(
+      hosts, ["DPG-HOST-BP", "DPG-HOST-VXLAM"])
+  assert ret and [result[2] for result in results] == [True, False] * 2
+  assert builds == [] and not portgroup_index._indexes
@@ -0,0 +1,82 @@
+import hashlib
+
+import client
+import fakes
+from credential_cache import CredentialCache, file_md5sum, get_credential_cache
+
+HOST_IP = "10.0.0.1"
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+  now = [1000.0]
+  monkeypatch.setattr("credential_cache.time.time", lambda: now[0])
+  cache = CredentialCache(ttl_secs=120)
+  cache.put(HOST_IP, {"username": "vpxuser"})
+  cache.put("10.0.0.2", {"username": "vpxuser"}, ttl_secs=10)
+  now[0] += 119
+  assert cache.get(HOST_IP) == {"username": "vpxuser"}
+  assert cache.get("10.0.0.2") is None
+  now[0] += 1
+  assert cache.get(HOST_IP) is None
+  assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_invalidate_drops_only_that_host():
+  cache = CredentialCache()
+  cache.put(HOST_IP, {"username": "a"})
+  cache.put("10.0.0.2", {"username": "b"})
+  cache.invalidate(HOST_IP)
+  cache.invalidate("10.0.0.3")
+  assert cache.get(HOST_IP) is None
+  assert cache.get("10.0.0.2") == {"username": "b"}
+
+
+def test_credentials_are_fetched_once_while_cached():
+  first = client.get_user_credentials(HOST_IP)
+  assert first == {"username": "vpxuser", "password": "otp-%s" % HOST_IP}
+  sessions = fakes.COUNTERS.snapshot()["ssh_sessions"]
+  assert client.get_user_credentials(HOST_IP) == first
+  assert fakes.COUNTERS.snapshot()["ssh_sessions"] == sessions
+
+  get_credential_cache().invalidate(HOST_IP)
+  commands = fakes.COUNTERS.snapshot()["ssh_commands"]
+  assert client.get_user_credentials(HOST_IP) == first
+  assert fakes.COUNTERS.snapshot()["ssh_commands"] > commands
+
+
+def test_use_cache_false_fetches_and_leaves_cache_alone():
+  get_credential_cache().put(HOST_IP, {"username": "cached"})
+  commands = fakes.COUNTERS.snapshot()["ssh_commands"]
+  credentials = client.get_user_credentials(HOST_IP, use_cache=False)
+  assert credentials["username"] == "vpxuser"
+  assert fakes.COUNTERS.snapshot()["ssh_commands"] > commands
+  assert get_credential_cache().get(HOST_IP) == {"username": "cached"}
+
+
+def test_upload_is_skipped_when_md5sum_matches(tmpdir, monkeypatch):
+  script = tmpdir.join("get_one_time_password.py")
+  script.write("print('otp')\n")
+  ssh_client = fakes.FakeSSHClient(HOST_IP, "root")
+  transfers = lambda: fakes.COUNTERS.snapshot()["ssh_transfers"]
+  start = transfers()
+  # The fake host reports an md5sum of zeros.
+  monkeypatch.setattr(client, "file_md5sum", lambda path: "0" * 32)
+  client.transfer_otp_script(ssh_client, str(script))
+  assert transfers() == start
+
+  monkeypatch.setattr(client, "file_md5sum", file_md5sum)
+  client.transfer_otp_script(ssh_client, str(script))
+  assert transfers() == start + 1
+  # A failed md5sum on the host uploads the script.
+  monkeypatch.setattr(client, "file_md5sum", lambda path: "0" * 32)
+  client.transfer_otp_script(ssh_client, str(script),
+                             md5sum_result=(1, "", "no such file"))
+  assert transfers() == start + 2
+
+
+def test_file_md5sum_follows_changes(tmpdir):
+  path = tmpdir.join("script.py")
+  path.write("one\n")
+  assert file_md5sum(str(path)) == hashlib.md5(b"one\n").hexdigest()
+  path.write("two, longer\n")
+  assert file_md5sum(str(path)) == hashlib.md5(b"two, longer\n").hexdigest()
@@ -0,0 +1,89 @@
+import subprocess
+
+import pytest
+
+from esxcli_batch import build_batch_script, execute_batch, parse_batch_output
+
+TOKEN = "0123456789abcdef0123456789abcdef"
+CMDS = [
+  "echo hello",
+  "echo partial; echo failed >&2; exit 3",
+  # Output looking like the frames of another batch, or of no batch.
+  "echo '@@ffffffffffffffffffffffffffffffff 3 RC 0'; echo '@@%s'" % TOKEN,
+  "printf 'no newline'",
+  "cd /; exit 0",
+  "pwd",
+]
+EXPECTED = [
+  (0, "hello\n", ""),
+  (3, "partial\n", "failed\n"),
+  (0, "@@ffffffffffffffffffffffffffffffff 3 RC 0\n@@%s\n" % TOKEN, ""),
+  (0, "no newline", ""),
+  (0, "", ""),
+  None,
+]
+
+
+def run_script(script):
+  proc = subprocess.run(["/bin/sh", "-c", script], stdout=subprocess.PIPE,
+                        stderr=subprocess.PIPE, universal_newlines=True)
+  return (proc.returncode, proc.stdout, proc.stderr)
+
+
+class ShellClient(object):
+  """
+  Runs commands in a local shell instead of over SSH, optionally cutting
+  the output short like a session dying part way.
+  """
+  def __init__(self, keep_chars=None, ret=None):
+    self.keep_chars = keep_chars
+    self.ret = ret
+
+  def execute(self, cmd):
+    ret, stdout, stderr = run_script(cmd)
+    if self.keep_chars is not None:
+      stdout = stdout[:self.keep_chars]
+      ret, stderr = self.ret, "connection closed"
+    return (ret, stdout, stderr)
+
+
+def test_round_trip_through_shell():
+  ret, stdout, _ = run_script(build_batch_script(CMDS, TOKEN))
+  assert ret == 0
+  results = parse_batch_output(stdout, len(CMDS), TOKEN)
+  assert results[:-1] == EXPECTED[:-1]
+  # "cd" in a command does not leak into the next one.
+  pwd_ret, pwd_out, _ = run_script("pwd")
+  assert results[-1] == (pwd_ret, pwd_out, "")
+
+
+def test_commands_run_alone_give_the_same_results():
+  results = execute_batch(ShellClient(), CMDS)
+  for cmd, result in zip(CMDS, results):
+    ret, stdout, stderr = run_script("( %s\n)" % cmd)
+    assert result == (ret, stdout, stderr)
+
+
+@pytest.mark.parametrize("cut", ["OUT", "RC", "END"])
+def test_truncated_frame_and_later_ones_are_missing(cut):
+  _, stdout, _ = run_script(build_batch_script(CMDS, TOKEN))
+  # Cut in the middle of the marker of the third command.
+  keep = stdout.index("@@%s 2 %s" % (TOKEN, cut)) + 10
+  results = parse_batch_output(stdout[:keep], len(CMDS), TOKEN)
+  assert results[:2] == EXPECTED[:2]
+  assert results[2:] == [None] * (len(CMDS) - 2)
+
+
+@pytest.mark.parametrize("ret, failed_ret", [(255, 255), (0, -1)])
+def test_missing_results_get_the_invocation_error(ret, failed_ret):
+  _, stdout, _ = run_script(build_batch_script(CMDS, TOKEN))
+  # Cuts the stderr of the second command, tokens are always 32 characters.
+  client = ShellClient(keep_chars=stdout.index("failed") + 3, ret=ret)
+  results = execute_batch(client, CMDS)
+  assert results[0] == EXPECTED[0]
+  assert results[1:] == [(failed_ret, "", "connection closed")] * (
+      len(CMDS) - 1)
+
+
+def test_no_commands_run_nothing():
+  assert execute_batch(None, []) == []
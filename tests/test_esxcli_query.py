@@ -0,0 +1,90 @@
+import esxcli_query
+import fakes
+from esxcli_query import (FORMATTER_CSV, FORMATTER_JSON, FORMATTER_XML,
+                          TYPE_BOOLEAN, TYPE_INTEGER, EsxcliSchema,
+                          decode_esxcli_output, run_queries)
+from interface_table import INTERFACE_QUERIES
+
+SCHEMA = EsxcliSchema("Name,MTU,Enabled",
+                      {"MTU": TYPE_INTEGER, "Enabled": TYPE_BOOLEAN})
+
+
+class SSHClient(fakes.FakeSSHClient):
+  """
+  Fails the commands in a given formatter with ret and err.
+  """
+  def __init__(self, formatter, ret, err):
+    fakes.FakeSSHClient.__init__(self, "10.0.0.1", "root")
+    self.failing = "--formatter=%s " % formatter
+    self.ret = ret
+    self.err = err
+    self.commands = []
+
+  def execute(self, cmd, escape_cmd=False, timeout_secs=None):
+    if self.ret == 255 and self.failing in cmd:
+      # The connection dropped, no command reported a result.
+      return (255, "", self.err)
+    return fakes.FakeSSHClient.execute(self, cmd)
+
+  def respond(self, cmd):
+    self.commands.append(cmd)
+    if self.failing in cmd:
+      return (self.ret, "", self.err)
+    return fakes.FakeSSHClient.respond(self, cmd)
+
+
+def test_empty_values_decode_to_none():
+  csv_rows = decode_esxcli_output("Name,MTU,Enabled,\nvmk0,,,\n", SCHEMA)
+  json_rows = decode_esxcli_output(
+      '[{"Name": "vmk0", "MTU": "", "Enabled": ""}]', SCHEMA)
+  assert csv_rows == json_rows == [
+      {"Name": "vmk0", "MTU": None, "Enabled": None}]
+  assert decode_esxcli_output("Name,MTU,Enabled,\nvmk0,9000,false,\n",
+                              SCHEMA) == [
+      {"Name": "vmk0", "MTU": 9000, "Enabled": False}]
+
+
+def test_formatters_decode_alike():
+  query = INTERFACE_QUERIES[0]
+  rows = [decode_esxcli_output(
+              fakes._esxcli_output(query.command, formatter), query.schema,
+              query.fields)
+          for formatter in (FORMATTER_JSON, FORMATTER_CSV, FORMATTER_XML)]
+  assert rows[0] and rows[0] == rows[1] == rows[2]
+
+
+def test_formatter_error_falls_back_to_xml():
+  ssh_client = SSHClient(FORMATTER_JSON, 1, "Invalid formatter json")
+  results = run_queries(ssh_client, INTERFACE_QUERIES)
+  assert all(ret for ret, _ in results)
+  assert ("10.0.0.1", INTERFACE_QUERIES[0].command) in esxcli_query._xml_only
+  ssh_client.commands = []
+  run_queries(ssh_client, INTERFACE_QUERIES)
+  assert all("--formatter=xml" in cmd for cmd in ssh_client.commands)
+
+
+def test_ssh_failure_does_not_fall_back_to_xml():
+  ssh_client = SSHClient(FORMATTER_JSON, 255, "Connection reset")
+  results = run_queries(ssh_client, INTERFACE_QUERIES)
+  assert not any(ret for ret, _ in results)
+  assert "ret 255" in results[0][1]
+  assert not esxcli_query._xml_only
+
+
+def test_other_command_failure_does_not_fall_back_to_xml():
+  ssh_client = SSHClient(FORMATTER_JSON, 1,
+                         "Error: Unknown command or namespace network ip")
+  results = run_queries(ssh_client, INTERFACE_QUERIES)
+  assert not any(ret for ret, _ in results)
+  assert not any("--formatter=xml" in cmd for cmd in ssh_client.commands)
+  assert not esxcli_query._xml_only
+
+
+def test_undecodable_output_falls_back_to_xml():
+  ssh_client = SSHClient(FORMATTER_JSON, 0, "")
+  ssh_client.respond = lambda cmd: (
+      (0, "[{\"Name\": ", "") if "--formatter=json" in cmd
+      else fakes.FakeSSHClient.respond(ssh_client, cmd))
+  results = run_queries(ssh_client, INTERFACE_QUERIES)
+  assert all(ret and rows for ret, rows in results)
+  assert ("10.0.0.1", INTERFACE_QUERIES[0].command) in esxcli_query._xml_only
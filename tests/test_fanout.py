@@ -0,0 +1,90 @@
+import threading
+import time
+
+from fanout import deadline_exceeded_msg, validate_portgroups_on_hosts
+
+
+class Tracker(object):
+  """
+  validate_func recording the peak number of validations in flight, overall
+  and per host.
+  """
+
+  def __init__(self, secs=0.01, fail=()):
+    self.secs = secs
+    self.fail = fail
+    self.lock = threading.Lock()
+    self.running = 0
+    self.peak = 0
+    self.per_host = {}
+    self.peak_per_host = 0
+
+  def __call__(self, host_ip, portgroup):
+    with self.lock:
+      self.running += 1
+      self.per_host[host_ip] = self.per_host.get(host_ip, 0) + 1
+      self.peak = max(self.peak, self.running)
+      self.peak_per_host = max(self.peak_per_host, self.per_host[host_ip])
+    time.sleep(self.secs)
+    with self.lock:
+      self.running -= 1
+      self.per_host[host_ip] -= 1
+    if (host_ip, portgroup) in self.fail:
+      raise RuntimeError("boom")
+    return (True, None)
+
+
+def test_host_major_work_fills_the_vcenter_limit():
+  hosts = ["10.0.0.%d" % index for index in range(16)]
+  portgroups = ["pg%d" % index for index in range(10)]
+  tracker = Tracker()
+  results = list(validate_portgroups_on_hosts(
+      hosts, portgroups, validate_func=tracker, max_workers=32,
+      max_per_vcenter=8, max_per_host=2))
+  assert len(results) == len(hosts) * len(portgroups)
+  assert all(ret for _, _, ret, _ in results)
+  assert tracker.peak == 8
+  assert tracker.peak_per_host <= 2
+
+
+def test_few_hosts_are_capped_per_host():
+  tracker = Tracker()
+  results = list(validate_portgroups_on_hosts(
+      ["10.0.0.1", "10.0.0.2"], ["pg%d" % index for index in range(6)],
+      validate_func=tracker, max_per_vcenter=16, max_per_host=2))
+  assert len(results) == 12
+  assert tracker.peak == 4
+  assert tracker.peak_per_host == 2
+
+
+def test_limits_per_vcenter_are_separate():
+  hosts = ["10.0.0.%d" % index for index in range(8)]
+  tracker = Tracker()
+  results = list(validate_portgroups_on_hosts(
+      hosts, ["pg0", "pg1"], validate_func=tracker,
+      vcenter_of=lambda host_ip: int(host_ip.split(".")[-1]) % 2,
+      max_per_vcenter=2, max_per_host=1))
+  assert len(results) == 16
+  assert tracker.peak == 4
+
+
+def test_errors_are_reported_per_pair():
+  tracker = Tracker(secs=0, fail=[("10.0.0.1", "pg1")])
+  results = dict(((host_ip, portgroup), (ret, msg)) for host_ip, portgroup,
+                 ret, msg in validate_portgroups_on_hosts(
+                     ["10.0.0.1"], ["pg0", "pg1"], validate_func=tracker))
+  assert results[("10.0.0.1", "pg0")] == (True, None)
+  assert not results[("10.0.0.1", "pg1")][0]
+  assert "boom" in results[("10.0.0.1", "pg1")][1]
+
+
+def test_deadline_fails_running_and_waiting_validations():
+  tracker = Tracker(secs=0.5)
+  start = time.time()
+  results = list(validate_portgroups_on_hosts(
+      ["10.0.0.1"], ["pg0", "pg1", "pg2"], validate_func=tracker,
+      max_per_host=1, deadline_secs=0.1))
+  assert time.time() - start < 0.4
+  assert sorted(portgroup for _, portgroup, _, _ in results) == [
+      "pg0", "pg1", "pg2"]
+  assert all(msg == deadline_exceeded_msg for _, _, _, msg in results)
@@ -0,0 +1,89 @@
+from concurrent.futures.process import BrokenProcessPool
+import os
+import threading
+
+import pytest
+
+import fakes
+import fleet_ingest
+from fleet_ingest import ingest_interface_tables
+from interface_table import INTERFACE_QUERIES
+
+EXTERNAL_ID = "e05d2b07-346f-48cc-b3b6-a58e48f92bcd"
+HOSTS = ["10.0.0.%d" % number for number in range(1, 9)]
+
+
+class WorkerKiller(object):
+  """
+  esxcli output that kills the worker process unpickling it.
+  """
+  def __len__(self):
+    return 1
+
+  def __reduce__(self):
+    return (os._exit, (1,))
+
+
+def fetch(host_ip):
+  return (True, [("json", fakes._esxcli_output(query.command, "json"))
+                 for query in INTERFACE_QUERIES])
+
+
+def ingest(hosts, fetch_func, **kwargs):
+  """
+  Runs ingest_interface_tables() on a thread, failing if it hangs.
+  """
+  result = []
+  thread = threading.Thread(target=lambda: result.append(
+      ingest_interface_tables(hosts, fetch_func, **kwargs)))
+  thread.daemon = True
+  thread.start()
+  thread.join(60)
+  assert result, "ingestion did not finish"
+  return result[0]
+
+
+@pytest.mark.parametrize("parse_workers", [0, 1])
+def test_tables_of_every_host_are_indexed(parse_workers):
+  index, stats = ingest(HOSTS, fetch, parse_workers=parse_workers)
+  assert sorted(index.tables) == HOSTS and not index.errors
+  assert len(index.lookup("external_id", EXTERNAL_ID)) == len(HOSTS)
+  assert stats["index"].items == len(HOSTS)
+
+
+def test_process_pool_is_reused():
+  ingest(HOSTS[:1], fetch, parse_workers=1)
+  pool = fleet_ingest._parse_pool
+  ingest(HOSTS[:1], fetch, parse_workers=1)
+  assert pool is not None and fleet_ingest._parse_pool is pool
+
+
+def test_killed_worker_fails_hosts_without_hanging():
+  def fetch_killing(host_ip):
+    if host_ip == HOSTS[2]:
+      return (True, [("json", WorkerKiller())])
+    return fetch(host_ip)
+
+  index, stats = ingest(HOSTS, fetch_killing, parse_workers=1, queue_size=2)
+  assert HOSTS[2] in index.errors
+  assert len(index.tables) + len(index.errors) == len(HOSTS)
+  assert stats["index"].items == len(HOSTS)
+  # The broken pool is replaced on the next ingestion.
+  index, _ = ingest(HOSTS, fetch, parse_workers=1)
+  assert not index.errors
+
+
+def test_failed_submit_fails_hosts_without_hanging(monkeypatch):
+  class BrokenExecutor(object):
+    def submit(self, *args):
+      raise BrokenProcessPool("worker died")
+
+    def shutdown(self, wait=True):
+      pass
+
+  monkeypatch.setattr(fleet_ingest, "_parse_executor",
+                      lambda parse_workers: BrokenExecutor())
+  index, stats = ingest(HOSTS, fetch, parse_workers=1, queue_size=1)
+  assert sorted(index.errors) == HOSTS
+  assert "worker died" in index.errors[HOSTS[0]]
+  assert stats["index"].failures == len(HOSTS)
@@ -0,0 +1,101 @@
+import threading
+import time
+import types
+
+import pytest
+
+import client
+import fakes
+import host_inventory
+from host_inventory import get_host_network_inventory
+
+
+def host_obj(host_ip):
+  return client.BaseEsxHostObject(host_ip).host_obj
+
+
+def test_inventory_follows_changes():
+  obj = host_obj("10.0.0.1")
+  inventory = get_host_network_inventory(obj, host_ip="10.0.0.1")
+  assert get_host_network_inventory(obj) is inventory
+  assert host_inventory.find_host_network_inventory("10.0.0.1") is inventory
+  version = inventory.snapshot().version
+  vnics = len(inventory.snapshot().vnics)
+  ret, _ = client.create_vnic("10.0.0.1", "172.20.0.1", "255.255.0.0",
+                              "DPG-HOST-VXLAM")
+  assert ret
+  snapshot = inventory.wait_for_version(version, timeout_secs=5)
+  assert len(snapshot.vnics) == vnics + 1
+
+
+def test_slow_host_does_not_hold_up_other_hosts(monkeypatch):
+  slow, fast = host_obj("10.0.0.1"), host_obj("10.0.0.2")
+  release = threading.Event()
+  wait_for_updates = fakes.PropertyCollector.WaitForUpdatesEx
+
+  def black_holed(self, version, options=None):
+    if self._stub.host == "10.0.0.1":
+      release.wait(10)
+    return wait_for_updates(self, version, options)
+
+  monkeypatch.setattr(fakes.PropertyCollector, "WaitForUpdatesEx",
+                      black_holed)
+  thread = threading.Thread(target=get_host_network_inventory, args=(slow,))
+  thread.start()
+  try:
+    time.sleep(0.1)
+    start = time.time()
+    assert get_host_network_inventory(fast).snapshot()
+    assert time.time() - start < 2
+  finally:
+    release.set()
+    thread.join()
+
+
+def test_failed_start_destroys_collector(monkeypatch):
+  obj = host_obj("10.0.0.1")
+  destroyed = []
+  destroy = fakes.PropertyCollector.Destroy
+
+  def failing(self, version, options=None):
+    raise RuntimeError("connection reset")
+
+  def tracking_destroy(self):
+    destroyed.append(self)
+    destroy(self)
+
+  monkeypatch.setattr(fakes.PropertyCollector, "WaitForUpdatesEx", failing)
+  monkeypatch.setattr(fakes.PropertyCollector, "Destroy", tracking_destroy)
+  with pytest.raises(RuntimeError):
+    get_host_network_inventory(obj)
+  assert len(destroyed) == 1
+  assert not host_inventory._inventories
+
+
+@pytest.mark.parametrize("evict", [True, False])
+def test_inventory_stops_with_its_session(monkeypatch, evict):
+  errors = []
+  monkeypatch.setattr(host_inventory, "log", types.SimpleNamespace(
+      ERROR=errors.append, WARNING=errors.append, INFO=lambda msg: None))
+  obj = client.BaseEsxHostObject("10.0.0.1")
+  obj.get_network_snapshot()
+  inventory = host_inventory.find_host_network_inventory("10.0.0.1")
+  assert inventory and inventory.host_obj._stub is obj.host_obj._stub
+  pool = client.get_session_pool()
+  if evict:
+    obj.disconnect()
+    pool._idle[("10.0.0.1", None, None)][0].last_used_at -= (
+        pool.idle_timeout_secs + 1)
+    assert pool.evict_idle() == 1
+  else:
+    obj.disconnect(discard=True)
+  assert not inventory.is_current() and inventory.error is None
+  assert host_inventory.find_host_network_inventory("10.0.0.1") is None
+  inventory._thread.join(5)
+  assert not inventory._thread.is_alive()
+  assert errors == []
+
+  # The next use starts an inventory on the new session.
+  obj = client.BaseEsxHostObject("10.0.0.1")
+  obj.get_network_snapshot()
+  assert host_inventory.find_host_network_inventory("10.0.0.1") is not inventory
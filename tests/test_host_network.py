@@ -0,0 +1,130 @@
+import sys
+
+import pytest
+
+import client
+import fakes
+from host_network import (retrieve_host_network_snapshot, snapshot_from_dict,
+                          snapshot_to_dict, validate_portgroup_in_snapshot)
+
+HOST_IP = "10.0.0.1"
+PORTGROUPS = ["DPG-HOST-BP", "DPG-HOST-VXLAM", "DPG-HOST-VLAN", "VM Network",
+              "DPG-MISSING"]
+UNSUPPORTED = "pvVmomi version does not support nsx-t attributes"
+
+
+@pytest.fixture(autouse=True)
+def no_soap_latency(monkeypatch):
+  # Walking the attributes of every filler portgroup is a round trip each.
+  monkeypatch.setitem(fakes.LATENCY, "soap", 0)
+
+
+def validate_by_attributes(host_obj, port_group, err_msg):
+  """
+  validate_nsx_t_portgroup() as it was, reading one attribute at a time.
+  """
+  vim = sys.modules["pyVmomi"].vim
+  nets = host_obj.network
+  if not nets:
+    return (False, err_msg + "network prop retreival failed")
+  nsx_tz_to_validate = None
+  backing_type = None
+  for net in nets:
+    if (isinstance(net, vim.dvs.DistributedVirtualPortgroup) and
+        net.name == port_group):
+      if not hasattr(net.config, "backingType"):
+        return (False, UNSUPPORTED)
+      if net.config.backingType == "nsx":
+        backing_type = "nsx"
+        if not hasattr(net.config, "transportZoneUuid"):
+          return (False, UNSUPPORTED)
+        nsx_tz_to_validate = net.config.transportZoneUuid
+        break
+  if backing_type == "nsx" and not nsx_tz_to_validate:
+    return (False, UNSUPPORTED)
+  elif not nsx_tz_to_validate:
+    return (True, None)
+  network_info = host_obj.configManager.networkSystem.networkInfo
+  for proxy_switch in network_info.proxySwitch:
+    if not hasattr(proxy_switch, "transportZones"):
+      return (False, UNSUPPORTED)
+    for tz in proxy_switch.transportZones:
+      if tz.uuid == nsx_tz_to_validate and tz.type != "vlan":
+        return (False, err_msg + "transport type is %s" % tz.type)
+  return (True, nsx_tz_to_validate)
+
+
+def assert_matches_attribute_walk():
+  host_obj = client.BaseEsxHostObject(HOST_IP).host_obj
+  snapshot = retrieve_host_network_snapshot(host_obj)
+  stored = snapshot_from_dict(snapshot_to_dict(snapshot))
+  results = []
+  for port_group in PORTGROUPS:
+    err_msg = "host: %s portgroup: %s " % (HOST_IP, port_group)
+    expected = validate_by_attributes(host_obj, port_group, err_msg)
+    assert validate_portgroup_in_snapshot(snapshot, port_group,
+                                          err_msg) == expected
+    assert validate_portgroup_in_snapshot(stored, port_group,
+                                          err_msg) == expected
+    assert client.validate_nsx_t_portgroup(HOST_IP, port_group) == expected
+    results.append(expected)
+  return results
+
+
+def test_nsx_and_other_portgroups():
+  results = dict(zip(PORTGROUPS, assert_matches_attribute_walk()))
+  assert results["DPG-HOST-BP"] == (True, None)
+  assert results["DPG-HOST-VXLAM"][0] is False
+  assert "overlay" in results["DPG-HOST-VXLAM"][1]
+  assert results["DPG-HOST-VLAN"] == (True, "tz-vlan")
+  assert results["VM Network"] == (True, None)
+  assert results["DPG-MISSING"] == (True, None)
+
+
+def test_transport_zone_missing_on_host():
+  proxy_switch = fakes.ENV.host(HOST_IP)._props["config"].network.proxySwitch[0]
+  proxy_switch.transportZones = [tz for tz in proxy_switch.transportZones
+                                 if tz.uuid != "tz-overlay"]
+  results = dict(zip(PORTGROUPS, assert_matches_attribute_walk()))
+  assert results["DPG-HOST-VXLAM"] == (True, "tz-overlay")
+
+
+def test_proxy_switch_without_transport_zones():
+  proxy_switch = fakes.ENV.host(HOST_IP)._props["config"].network.proxySwitch[0]
+  del proxy_switch.transportZones
+  results = dict(zip(PORTGROUPS, assert_matches_attribute_walk()))
+  assert results["DPG-HOST-VXLAM"] == (False, UNSUPPORTED)
+  assert results["DPG-HOST-BP"] == (True, None)
+
+
+def test_nsx_portgroup_without_transport_zone_uuid():
+  fakes.ENV.portgroup("DPG-HOST-VXLAM")._props["config"].transportZoneUuid = None
+  results = dict(zip(PORTGROUPS, assert_matches_attribute_walk()))
+  assert results["DPG-HOST-VXLAM"] == (False, UNSUPPORTED)
+
+
+def test_invalid_property_falls_back_to_names(monkeypatch):
+  # pyVmomi predating NSX-T knows neither attribute of any portgroup.
+  for portgroup in fakes.ENV.portgroups:
+    config = portgroup._props["config"]
+    del config.backingType
+    del config.transportZoneUuid
+  retrieve = fakes.PropertyCollector.RetrieveContents
+  calls = []
+
+  def counting(self, specs):
+    calls.append(specs)
+    return retrieve(self, specs)
+
+  monkeypatch.setattr(fakes.PropertyCollector, "RetrieveContents", counting)
+  results = dict(zip(PORTGROUPS, assert_matches_attribute_walk()))
+  assert results["DPG-HOST-BP"] == (False, UNSUPPORTED)
+  assert results["VM Network"] == (True, None)
+  # Every snapshot was retrieved again with the names only.
+  assert len(calls) % 2 == 0 and calls
+
+
+def test_host_without_networks():
+  fakes.ENV.host(HOST_IP)._props["network"] = []
+  for result in assert_matches_attribute_walk():
+    assert result[0] is False and "network prop retreival failed" in result[1]
@@ -0,0 +1,128 @@
+import types
+
+import pytest
+
+import fakes
+import instrumentation
+from instrumentation import (LATENCY_BUCKETS, export_json, export_prometheus,
+                             instrument_ssh_client, instrument_stub, record,
+                             timed)
+
+
+@pytest.fixture
+def enabled(monkeypatch):
+  monkeypatch.setattr(instrumentation, "_enabled", True)
+
+
+class Stub(object):
+  def __init__(self):
+    self.calls = []
+
+  def InvokeMethod(self, mo, info, *args):
+    self.calls.append(info.name)
+    return "result"
+
+
+def test_nothing_is_wrapped_or_recorded_while_disabled():
+  assert not instrumentation.is_enabled()
+  stub = Stub()
+  invoke = stub.InvokeMethod
+  assert instrument_stub(stub, "10.0.0.1") is stub
+  assert stub.InvokeMethod == invoke and "InvokeMethod" not in vars(stub)
+  assert not hasattr(stub, "_instrumented")
+  ssh_client = fakes.FakeSSHClient("10.0.0.1", "root")
+  assert instrument_ssh_client(ssh_client, "10.0.0.1") is ssh_client
+  assert timed("soap", "10.0.0.1", "op") is timed("ssh", "10.0.0.2", "op")
+  with timed("soap", "10.0.0.1", "op") as timer:
+    timer.set_outcome("error")
+  record("soap", "10.0.0.1", "op", "ok", 0.1)
+  assert export_json() == {"counters": [], "histograms": []}
+
+
+def test_bucket_boundaries_are_inclusive(enabled):
+  for latency in (0, LATENCY_BUCKETS[0], 0.0011, LATENCY_BUCKETS[-1],
+                  LATENCY_BUCKETS[-1] + 1):
+    record("soap", "10.0.0.1", "op", "ok", latency)
+  histogram, = export_json()["histograms"]
+  buckets = histogram["buckets"]
+  assert buckets["0.001"] == 2
+  assert buckets["0.005"] == 1
+  assert buckets["300.0"] == 1
+  assert buckets["+Inf"] == 1
+  assert sum(buckets.values()) == histogram["count"] == 5
+  assert histogram["sum"] == pytest.approx(0.0021 + 300.0 + 301.0)
+
+
+def test_export_json(enabled):
+  record("retry", "10.0.0.1", "connect", "circuit_open")
+  record("soap", "10.0.0.1", "login", "ok", 0.02)
+  record("soap", "10.0.0.1", "login", "ok", 0.03)
+  data = export_json()
+  assert data["counters"] == [
+    {"kind": "retry", "host": "10.0.0.1", "op": "connect",
+     "outcome": "circuit_open", "value": 1},
+    {"kind": "soap", "host": "10.0.0.1", "op": "login", "outcome": "ok",
+     "value": 2},
+  ]
+  histogram, = data["histograms"]
+  assert histogram["op"] == "login" and histogram["count"] == 2
+  assert histogram["buckets"]["0.025"] == 1
+  assert histogram["buckets"]["0.05"] == 1
+
+
+def test_export_prometheus(enabled):
+  record("ssh", 'host"1\\', "echo", "ok", 0.002)
+  lines = export_prometheus().splitlines()
+  labels = 'kind="ssh",host="host\\"1\\\\",op="echo",outcome="ok"'
+  assert "vmware_client_operations_total{%s} 1" % labels in lines
+  buckets = [line for line in lines
+             if line.startswith("vmware_client_operation_latency_seconds_"
+                                "bucket")]
+  assert len(buckets) == len(LATENCY_BUCKETS) + 1
+  # Buckets are cumulative.
+  assert buckets[0].endswith('le="0.001"} 0')
+  assert buckets[1].endswith('le="0.005"} 1')
+  assert buckets[-1].endswith('le="+Inf"} 1')
+  assert ("vmware_client_operation_latency_seconds_count{%s} 1" % labels
+          in lines)
+  assert ("vmware_client_operation_latency_seconds_sum{%s} 0.002000" % labels
+          in lines)
+  assert lines[0].startswith("# HELP vmware_client_operations_total")
+
+
+def test_timed_records_outcome(enabled):
+  with timed("otp", "10.0.0.1", "get_user_credentials"):
+    pass
+  with pytest.raises(ValueError):
+    with timed("otp", "10.0.0.1", "get_user_credentials"):
+      raise ValueError()
+  with timed("otp", "10.0.0.1", "get_user_credentials") as timer:
+    timer.set_outcome("cache_hit")
+  outcomes = dict((counter["outcome"], counter["value"])
+                  for counter in export_json()["counters"])
+  assert outcomes == {"ok": 1, "error": 1, "cache_hit": 1}
+
+
+def test_stub_and_ssh_client_are_recorded(enabled):
+  stub = Stub()
+  instrument_stub(stub, "10.0.0.1")
+  instrument_stub(stub, "10.0.0.1")
+  assert stub.InvokeMethod(None, types.SimpleNamespace(name="Retrieve")) == (
+      "result")
+  assert stub.calls == ["Retrieve"]
+
+  ssh_client = instrument_ssh_client(fakes.FakeSSHClient("10.0.0.1", "root"),
+                                     "10.0.0.1")
+  ssh_client.execute("USER=vpxuser localcli --formatter=xml network ip "
+                     "interface list")
+  ssh_client.execute("no-such-command --help")
+  ssh_client.transfer_to("/tmp/a", "/")
+  assert ssh_client.host_ip == "10.0.0.1"
+  counters = set((c["kind"], c["op"], c["outcome"], c["value"])
+                 for c in export_json()["counters"])
+  assert counters == {
+    ("soap", "Retrieve", "ok", 1),
+    ("ssh", "localcli network ip", "ok", 1),
+    ("ssh", "no-such-command", "error", 1),
+    ("ssh", "transfer_to", "ok", 1),
+  }
@@ -0,0 +1,42 @@
+import os
+
+import pytest
+
+import fakes
+from interface_table import HostInterfaceTable
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EXTERNAL_ID = "e05d2b07-346f-48cc-b3b6-a58e48f92bcd"
+COMMANDS = ("network ip interface list", "network ip interface ipv4 get")
+
+
+def outputs(formatter):
+  return [fakes._esxcli_output(command, formatter) for command in COMMANDS]
+
+
+def test_files_and_data_decode_alike():
+  from_files = HostInterfaceTable.from_esxcli_files(
+      os.path.join(REPO_DIR, "network_ip_interface_list.xml"),
+      os.path.join(REPO_DIR, "ipv4_addr.xml"))
+  from_data = HostInterfaceTable.from_esxcli_output(*outputs("xml"))
+  assert from_files.to_dicts() == from_data.to_dicts()
+  assert from_files.by_external_id(EXTERNAL_ID).name
+
+
+@pytest.mark.parametrize("formatter", ["json", "csv"])
+def test_formatters_decode_like_xml(tmpdir, formatter):
+  expected = HostInterfaceTable.from_esxcli_output(*outputs("xml")).to_dicts()
+  assert HostInterfaceTable.from_esxcli_output(
+      *outputs(formatter)).to_dicts() == expected
+  paths = []
+  for name, output in zip(("list", "ipv4"), outputs(formatter)):
+    path = tmpdir.join("%s.%s" % (name, formatter))
+    path.write(output)
+    paths.append(str(path))
+  assert HostInterfaceTable.from_esxcli_files(*paths).to_dicts() == expected
+
+
+def test_single_line_data_is_not_taken_for_a_path():
+  # A csv header without rows is output of no interfaces, not a file name.
+  table = HostInterfaceTable.from_esxcli_output("Name,MACAddress,", "Name,")
+  assert table.records == []
@@ -0,0 +1,112 @@
+import socket
+import threading
+
+import client
+import fakes
+import host_inventory
+from host_inventory import get_host_network_inventory
+from liveness import get_stub_timeout, stub_timeout
+
+
+def test_overlapping_timeouts_restore_the_original():
+  stub = fakes.FakeStub(fakes.ENV, "10.0.0.1")
+  stub.schemeArgs["timeout"] = 120
+  long_call = stub_timeout(stub, 300)
+  probe = stub_timeout(stub, 5)
+  long_call.__enter__()
+  probe.__enter__()
+  # The probe does not cut the long call short.
+  assert get_stub_timeout(stub) == 300
+  long_call.__exit__(None, None, None)
+  assert get_stub_timeout(stub) == 5
+  probe.__exit__(None, None, None)
+  assert get_stub_timeout(stub) == 120
+
+
+def test_concurrent_timeouts_restore_the_original():
+  stub = fakes.FakeStub(fakes.ENV, "10.0.0.1")
+  stub.schemeArgs["timeout"] = 120
+  barrier = threading.Barrier(8)
+  seen = []
+
+  def operation(timeout_secs):
+    with stub_timeout(stub, timeout_secs):
+      barrier.wait(5)
+      seen.append(get_stub_timeout(stub))
+      barrier.wait(5)
+
+  threads = [threading.Thread(target=operation, args=(5 + index,))
+             for index in range(8)]
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join(5)
+  # All contexts were active at once, the longest timeout applied.
+  assert seen == [12] * 8
+  assert get_stub_timeout(stub) == 120
+
+
+def test_is_connected_does_not_probe_by_default():
+  obj = client.BaseEsxHostObject("10.0.0.1")
+  probes = obj.liveness.probes
+  assert obj.is_connected()
+  assert obj.liveness.probes == probes
+  assert obj.is_connected(probe=True)
+
+
+class Connection(object):
+  def __init__(self, timeout_secs):
+    self.sock = socket.socket()
+    self.sock.settimeout(timeout_secs)
+
+
+def test_restore_reaches_connections_busy_meanwhile():
+  stub = fakes.FakeStub(fakes.ENV, "10.0.0.1")
+  stub.schemeArgs["timeout"] = 120
+  idle, busy = Connection(120), Connection(120)
+  stub.pool = [(idle, 0), (busy, 0)]
+  try:
+    with stub_timeout(stub, 300):
+      # Taken by a request while the longer timeout applies.
+      stub.pool = [(idle, 0)]
+      with stub_timeout(stub, 5):
+        pass
+      assert busy.sock.gettimeout() == 300
+    # Shortening leaves the request in flight alone.
+    assert idle.sock.gettimeout() == 120
+    assert busy.sock.gettimeout() == 300
+    with stub_timeout(stub, 5):
+      assert idle.sock.gettimeout() == 5
+      # Taken by a request during the probe.
+      stub.pool = []
+    # Not left with the timeout of the probe.
+    assert idle.sock.gettimeout() == 120
+    stub.pool = [(idle, 0), (busy, 0)]
+    with stub_timeout(stub, 60):
+      pass
+    assert idle.sock.gettimeout() == busy.sock.gettimeout() == 120
+  finally:
+    idle.sock.close()
+    busy.sock.close()
+
+
+def test_inventory_long_poll_outlasts_probes(monkeypatch):
+  obj = client.BaseEsxHostObject("10.0.0.1")
+  stub = obj.host_obj._stub
+  timeouts = []
+  wait_for_updates = fakes.PropertyCollector.WaitForUpdatesEx
+
+  def recording(self, version, options=None):
+    timeouts.append(get_stub_timeout(stub))
+    return wait_for_updates(self, version, options)
+
+  monkeypatch.setattr(fakes.PropertyCollector, "WaitForUpdatesEx", recording)
+  with stub_timeout(stub, 5):
+    inventory = get_host_network_inventory(obj.host_obj)
+    version = inventory.snapshot().version
+    assert client.create_vnic("10.0.0.1", "172.20.0.1", "255.255.0.0",
+                              "DPG-HOST-VXLAM")[0]
+    inventory.wait_for_version(version, timeout_secs=5)
+  expected = (host_inventory.inventory_max_wait_secs +
+              host_inventory.inventory_wait_margin_secs)
+  assert len(timeouts) >= 2 and set(timeouts) == {expected}
@@ -0,0 +1,44 @@
+import pytest
+
+from parse_vmknic import cmd_out, parse_vmknic, parse_vmknic_table
+
+# esxcfg-vmknic -l of an older release, without NetStack and with "TSO MTU".
+OLD_CMD_OUT = """\
+Interface  Port Group/DVPort   IP Family IP Address      Netmask         Broadcast       MAC Address       MTU     TSO MTU   Enabled Type
+vmk0       Management Network  IPv4      10.47.242.69    255.255.240.0   10.47.255.255   00:25:90:dd:e4:04 1500    65535     true    STATIC
+vmk1       17                  IPv4      172.17.0.1      255.255.0.0     172.17.255.255  00:50:56:6f:ed:28 9000    65535     false   DHCP
+"""
+
+
+def test_current_output():
+  records = parse_vmknic("e647f7a5-60f6-4e15-b796-8019ec499d9d", cmd_out)
+  assert [(r.interface, r.ip_family, r.ip_address) for r in records] == [
+      ("vmk3", "IPv4", "172.16.8.1"),
+      ("vmk3", "IPv6", "fe80::250:56ff:fe65:cc82")]
+  ipv4 = records[0]
+  assert ipv4.netmask == "255.255.0.0"
+  assert ipv4.mac == "00:50:56:65:cc:82"
+  assert ipv4.mtu == 1500 and ipv4.tso_mss == 65535
+  assert ipv4.enabled is True
+  assert ipv4.netstack == "defaultTcpipStack"
+  assert records[1].type == "STATIC, PREFERRED"
+  assert records[1].broadcast is None
+
+
+def test_older_output_without_optional_columns():
+  index = parse_vmknic_table(OLD_CMD_OUT)
+  management = index["Management Network"][0]
+  assert management.interface == "vmk0"
+  assert management.ip_address == "10.47.242.69"
+  assert management.mtu == 1500
+  assert management.tso_mss == 65535
+  assert management.type == "STATIC"
+  assert management.netstack is None
+  vmk1 = index["17"][0]
+  assert (vmk1.mtu, vmk1.enabled, vmk1.type) == (9000, False, "DHCP")
+
+
+def test_missing_required_column_raises():
+  header = "Interface  Port Group/DVPort   IP Family Netmask\n"
+  with pytest.raises(ValueError):
+    parse_vmknic_table(header + "vmk0       2                   IPv4      x\n")
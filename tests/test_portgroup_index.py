@@ -0,0 +1,66 @@
+import fakes
+import portgroup_index
+from portgroup_index import get_portgroup_index
+
+
+def add_portgroup(name, moid, switch):
+  config = fakes._Data(distributedVirtualSwitch=switch, backingType="standard",
+                       transportZoneUuid=None)
+  portgroup = fakes.DistributedVirtualPortgroup(
+      moid, None, {"name": name, "key": moid, "config": config})
+  fakes.ENV.portgroups.append(portgroup)
+  return portgroup
+
+
+def count_builds(monkeypatch):
+  builds = []
+  build = portgroup_index.PortgroupIndex._build
+
+  def counted(self):
+    builds.append(self)
+    return build(self)
+
+  monkeypatch.setattr(portgroup_index.PortgroupIndex, "_build", counted)
+  return builds
+
+
+def test_lookup_is_filtered_by_host_networks():
+  switch = fakes.DistributedVirtualSwitch("dvs-2", None, {"uuid": "uuid-2"})
+  fakes.ENV.switch = switch
+  other = add_portgroup("DPG-HOST-BP", "dvportgroup-other", switch)
+  index = get_portgroup_index(fakes.FakeStub(fakes.ENV, "vcenter"))
+  moids = [entry.moid for entry in index.lookup_all("DPG-HOST-BP")]
+  assert moids == ["dvportgroup-0", "dvportgroup-other"]
+  assert index.lookup("DPG-HOST-BP").moid == "dvportgroup-0"
+  entry = index.lookup("DPG-HOST-BP", frozenset([other._moId]))
+  assert entry.moid == "dvportgroup-other"
+  assert entry.switch_uuid == "uuid-2"
+  assert index.lookup("DPG-HOST-BP", frozenset(["network-1"])) is None
+
+
+def test_index_is_rebuilt_through_current_session():
+  first = fakes.FakeStub(fakes.ENV, "vcenter")
+  second = fakes.FakeStub(fakes.ENV, "vcenter")
+  index = get_portgroup_index(first)
+  assert index.lookup("DPG-HOST-BP")
+  assert get_portgroup_index(second) is index
+  assert index.service_content.propertyCollector._stub is second
+
+
+def test_miss_rebuilds_once(monkeypatch):
+  builds = count_builds(monkeypatch)
+  index = get_portgroup_index(fakes.FakeStub(fakes.ENV, "vcenter"))
+  assert index.lookup("DPG-HOST-BP")
+  assert len(builds) == 1
+
+  # Created after the index was built.
+  add_portgroup("DPG-NEW", "dvportgroup-new", fakes.ENV.switch)
+  monkeypatch.setattr(portgroup_index, "portgroup_index_miss_rebuild_secs", 0)
+  assert index.lookup("DPG-NEW").moid == "dvportgroup-new"
+  assert len(builds) == 2
+
+  # Names that do not exist do not rebuild the index on every lookup.
+  monkeypatch.setattr(portgroup_index, "portgroup_index_miss_rebuild_secs", 60)
+  assert index.lookup("DPG-MISSING") is None
+  assert index.lookup("DPG-MISSING") is None
+  assert len(builds) == 2
@@ -0,0 +1,57 @@
+import threading
+import time
+
+import client
+import fakes
+
+
+def track_adds(monkeypatch):
+  """
+  Records the vnics added and the peak of concurrent adds per host.
+  """
+  lock = threading.Lock()
+  stats = {"added": [], "running": {}, "peak": {}}
+  add_virtual_nic = fakes.HostNetworkSystem.AddVirtualNic
+
+  def tracked(self, portgroup, nic):
+    host = self._props["host"]._props["name"]
+    with lock:
+      stats["added"].append((host, nic.ip.ipAddress))
+      running = stats["running"].get(host, 0) + 1
+      stats["running"][host] = running
+      stats["peak"][host] = max(stats["peak"].get(host, 0), running)
+    time.sleep(0.02)
+    try:
+      return add_virtual_nic(self, portgroup, nic)
+    finally:
+      with lock:
+        stats["running"][host] -= 1
+
+  monkeypatch.setattr(fakes.HostNetworkSystem, "AddVirtualNic", tracked)
+  return stats
+
+
+def test_duplicate_specs_add_one_vnic(monkeypatch):
+  stats = track_adds(monkeypatch)
+  spec = ("10.0.0.1", "172.20.0.1", "255.255.0.0", "DPG-HOST-VXLAM")
+  results = client.provision_vnics([spec, spec, spec])
+  assert stats["added"] == [("10.0.0.1", "172.20.0.1")]
+  assert results[0][0] and results[0] == results[1] == results[2]
+
+
+def test_adds_are_limited_per_host(monkeypatch):
+  stats = track_adds(monkeypatch)
+  specs = [(host_ip, "172.20.0.%d" % number, "255.255.0.0", "DPG-HOST-VXLAM")
+           for host_ip in ("10.0.0.1", "10.0.0.2") for number in range(6)]
+  results = client.provision_vnics(specs, max_per_host=2, max_workers=8)
+  assert all(ret for ret, _ in results)
+  assert len(stats["added"]) == len(specs)
+  assert stats["peak"] == {"10.0.0.1": 2, "10.0.0.2": 2}
+
+
+def test_unknown_portgroup_fails_its_specs_only():
+  results = client.provision_vnics([
+      ("10.0.0.1", "172.20.0.1", "255.255.0.0", "DPG-MISSING"),
+      ("10.0.0.1", "172.20.0.2", "255.255.0.0", "DPG-HOST-VXLAM")])
+  assert results[0] == (False, "port group DPG-MISSING not found")
+  assert results[1][0]
@@ -0,0 +1,78 @@
+import client
+import fakes
+from portgroup_index import get_portgroup_index
+from records import (PortgroupRecord, TransportZoneRecord, VnicRecord,
+                     portgroup_record_from_properties,
+                     transport_zones_from_proxy_switches,
+                     vnic_record_from_dict, vnic_record_from_vim)
+
+HOST_IP = "10.0.0.1"
+
+
+def network_info():
+  return fakes.ENV.host(HOST_IP)._props["config"].network
+
+
+def test_vnic_records():
+  vmk0, vmk1 = network_info().vnic
+  assert vnic_record_from_vim(vmk0) == VnicRecord(
+      "vmk0", HOST_IP, None, None, None, None, "255.255.240.0", 1500,
+      "defaultTcpipStack")
+  record = vnic_record_from_vim(vmk1)
+  assert record == VnicRecord(
+      "vmk1", "172.16.0.1", "0", fakes.FakeVSphere.SWITCH_UUID,
+      fakes.ENV.portgroup("DPG-HOST-BP")._props["key"], None, "255.255.0.0",
+      1500, "defaultTcpipStack")
+  assert vnic_record_from_dict(record._asdict()) == record
+
+
+def test_vnic_without_address_or_newer_fields():
+  vnic = fakes.ENV._make_vnic("vmk2", None, None, None)
+  vnic.spec.ip = None
+  for name in ("externalId", "mtu", "netStackInstanceKey"):
+    delattr(vnic.spec, name)
+  assert vnic_record_from_vim(vnic) == VnicRecord(
+      "vmk2", None, None, None, None, None, None, None, None)
+  # Dicts stored before fields were added.
+  assert vnic_record_from_dict({"device": "vmk2"}) == VnicRecord(
+      "vmk2", None, None, None, None, None, None, None, None)
+
+
+def test_transport_zones():
+  assert transport_zones_from_proxy_switches(network_info().proxySwitch) == [
+      TransportZoneRecord("tz-overlay", "overlay"),
+      TransportZoneRecord("tz-vlan", "vlan")]
+  assert transport_zones_from_proxy_switches(None) == []
+  assert transport_zones_from_proxy_switches(
+      [fakes._Data(transportZones=None)]) == []
+  # pyVmomi without NSX-T support.
+  assert transport_zones_from_proxy_switches([fakes._Data()]) is None
+
+
+def test_portgroup_records():
+  switch_uuids = {"dvs-1": fakes.FakeVSphere.SWITCH_UUID}
+  props = {"name": "DPG-HOST-VXLAM", "key": "dvportgroup-1",
+           "config.distributedVirtualSwitch": fakes.ENV.switch,
+           "config.backingType": "nsx",
+           "config.transportZoneUuid": "tz-overlay"}
+  assert portgroup_record_from_properties("dvportgroup-1", props,
+                                          switch_uuids) == PortgroupRecord(
+      "dvportgroup-1", "DPG-HOST-VXLAM", "dvportgroup-1",
+      fakes.FakeVSphere.SWITCH_UUID, "nsx", "tz-overlay")
+  # Properties pyVmomi without NSX-T support does not return.
+  assert portgroup_record_from_properties(
+      "dvportgroup-9", {"name": "old", "key": "dvportgroup-9"},
+      switch_uuids) == PortgroupRecord(
+      "dvportgroup-9", "old", "dvportgroup-9", None, None, None)
+
+
+def test_portgroup_index_records_without_nsx_fields():
+  for portgroup in fakes.ENV.portgroups:
+    config = portgroup._props["config"]
+    del config.backingType
+    del config.transportZoneUuid
+  host_obj = client.BaseEsxHostObject(HOST_IP).host_obj
+  record = get_portgroup_index(host_obj._stub).lookup("DPG-HOST-VXLAM")
+  assert record == PortgroupRecord(
+      "dvportgroup-1", "DPG-HOST-VXLAM", "dvportgroup-1",
+      fakes.FakeVSphere.SWITCH_UUID, None, None)
@@ -0,0 +1,64 @@
+import errno
+import http.client
+import socket
+
+import pytest
+
+from retry import (RetryBudget, call_with_retries, is_transient_error,
+                   retry_with_deadline)
+
+
+@pytest.mark.parametrize("ex", [
+    socket.timeout("timed out"),
+    ConnectionResetError(),
+    ConnectionResetError(errno.ECONNRESET, "reset"),
+    ConnectionRefusedError(),
+    BrokenPipeError(),
+    http.client.RemoteDisconnected("closed"),
+    OSError(errno.ETIMEDOUT, "timed out"),
+])
+def test_transient_errors(ex):
+  assert is_transient_error(ex)
+
+
+@pytest.mark.parametrize("ex", [
+    OSError(errno.EHOSTUNREACH, "unreachable"),
+    socket.gaierror(socket.EAI_NONAME, "unknown"),
+    ValueError("bad"),
+])
+def test_permanent_errors(ex):
+  assert not is_transient_error(ex)
+
+
+def test_budget_caps_retries():
+  budget = RetryBudget(rate_per_sec=0, burst=2)
+  attempts = list(retry_with_deadline(1, 1, max_retries=10, budget=budget))
+  assert attempts == [0, 1, 2]
+  assert not budget.try_acquire()
+
+
+def test_deadline_stops_retries():
+  attempts = list(retry_with_deadline(200, 200, deadline_secs=0.1))
+  assert attempts == [0]
+
+
+def test_call_with_retries_retries_transient_errors_only():
+  calls = []
+
+  def flaky():
+    calls.append(1)
+    if len(calls) < 3:
+      raise http.client.RemoteDisconnected("closed")
+    return "ok"
+
+  assert call_with_retries(flaky, 1, 1, max_retries=5) == "ok"
+  assert len(calls) == 3
+
+  def broken():
+    calls.append(1)
+    raise ValueError("bad")
+
+  del calls[:]
+  with pytest.raises(ValueError):
+    call_with_retries(broken, 1, 1, max_retries=5)
+  assert len(calls) == 1
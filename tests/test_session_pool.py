@@ -0,0 +1,85 @@
+import sys
+import time
+
+import client
+from session_pool import SessionPool, credentials_fingerprint
+
+
+class Session(object):
+  def __init__(self, name):
+    self.name = name
+
+
+def test_idle_session_is_reused():
+  pool = SessionPool()
+  si = pool.acquire("10.0.0.1", "root", lambda: Session("a"))
+  assert pool.release(si)
+  assert pool.acquire("10.0.0.1", "root", lambda: Session("b")) is si
+  assert pool.stats()["logins"] == 1
+
+
+def test_sessions_of_other_credentials_are_not_reused():
+  pool = SessionPool()
+  right = credentials_fingerprint("root", "right")
+  si = pool.acquire("10.0.0.1", "root", lambda: Session("a"),
+                    credentials_id=right)
+  pool.release(si)
+  assert credentials_fingerprint("root", "wrong") != right
+  assert pool.acquire("10.0.0.1", "root", lambda: None,
+                      credentials_id=credentials_fingerprint(
+                          "root", "wrong")) is None
+  assert pool.acquire("10.0.0.1", "root", lambda: None,
+                      credentials_id=right) is si
+
+
+def test_wrong_password_does_not_get_pooled_session(monkeypatch):
+  vim = sys.modules["pyVmomi"].vim
+  connect = sys.modules["pyVim.connect"].SmartConnectNoSSL
+
+  def check_password(user, pwd, host, socketTimeout=None):
+    if pwd != "right":
+      raise vim.fault.InvalidLogin()
+    return connect(user, pwd, host, socketTimeout)
+
+  monkeypatch.setattr(sys.modules["pyVim.connect"], "SmartConnectNoSSL",
+                      check_password)
+  obj = client.BaseEsxHostObject("10.0.0.1", user="root", password="right")
+  assert obj.is_connected()
+  obj.disconnect()
+  assert client.get_session_pool().stats()["idle"] == 1
+
+  obj = client.BaseEsxHostObject("10.0.0.1", user="root", password="wrong")
+  assert not obj.is_connected()
+  assert client.get_session_pool().stats()["idle"] == 1
+
+
+def test_release_sweeps_expired_sessions_of_other_keys(monkeypatch):
+  logged_out = []
+  monkeypatch.setattr(SessionPool, "_logout_async",
+                      lambda self, si: logged_out.append(si))
+  pool = SessionPool(idle_timeout_secs=60, evict_interval_secs=0)
+  stale = pool.acquire("10.0.0.1", "root", lambda: Session("stale"))
+  pool.release(stale)
+  pool._idle[("10.0.0.1", "root", None)][0].last_used_at -= 120
+
+  # Only another host is used from now on.
+  other = pool.acquire("10.0.0.2", "root", lambda: Session("other"))
+  pool.release(other)
+  assert logged_out == [stale]
+  assert pool.stats()["idle"] == 1
+  assert pool._total == {("10.0.0.2", "root", None): 1}
+
+
+def test_sweep_is_rate_limited(monkeypatch):
+  logged_out = []
+  monkeypatch.setattr(SessionPool, "_logout_async",
+                      lambda self, si: logged_out.append(si))
+  pool = SessionPool(idle_timeout_secs=60, evict_interval_secs=3600)
+  stale = pool.acquire("10.0.0.1", "root", lambda: Session("stale"))
+  pool.release(stale)
+  pool._idle[("10.0.0.1", "root", None)][0].last_used_at -= 120
+  pool.release(pool.acquire("10.0.0.2", "root", lambda: Session("other")))
+  assert logged_out == []
+  pool._last_sweep_at = time.time() - 3600
+  pool.release(pool.acquire("10.0.0.2", "root", lambda: Session("other")))
+  assert logged_out == [stale]
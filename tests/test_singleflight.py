@@ -0,0 +1,90 @@
+import threading
+import time
+
+import pytest
+
+from singleflight import SingleFlight, coalesce, get_single_flight
+
+
+def run_concurrently(func, count):
+  results = [None] * count
+
+  def run(index):
+    try:
+      results[index] = func()
+    except Exception as ex:
+      results[index] = ex
+
+  threads = [threading.Thread(target=run, args=(index,))
+             for index in range(count)]
+  for thread in threads:
+    thread.start()
+  return threads, results
+
+
+def wait_until(predicate, timeout_secs=5):
+  deadline = time.time() + timeout_secs
+  while not predicate():
+    assert time.time() < deadline
+    time.sleep(0.001)
+
+
+def test_concurrent_callers_share_one_call():
+  flight = SingleFlight()
+  release = threading.Event()
+  calls = []
+
+  def fetch():
+    calls.append(1)
+    release.wait(5)
+    return "result"
+
+  threads, results = run_concurrently(lambda: flight.do("key", fetch), 8)
+  wait_until(lambda: flight.stats()["shared"] == 7)
+  release.set()
+  for thread in threads:
+    thread.join(5)
+  assert calls == [1]
+  assert results == ["result"] * 8
+  assert flight.stats() == {"calls": 1, "shared": 7, "in_flight": 0}
+
+
+def test_exception_is_raised_to_every_caller():
+  flight = SingleFlight()
+  release = threading.Event()
+
+  def fail():
+    release.wait(5)
+    raise ValueError("boom")
+
+  threads, results = run_concurrently(lambda: flight.do("key", fail), 4)
+  wait_until(lambda: flight.stats()["shared"] == 3)
+  release.set()
+  for thread in threads:
+    thread.join(5)
+  assert all(isinstance(result, ValueError) for result in results)
+  assert not flight.in_flight("key")
+
+
+def test_finished_call_is_not_reused():
+  flight = SingleFlight()
+  values = iter(range(10))
+  assert flight.do("key", lambda: next(values)) == 0
+  assert flight.do("key", lambda: next(values)) == 1
+  with pytest.raises(KeyError):
+    flight.do("key", lambda: {}["missing"])
+  assert flight.do("key", lambda: next(values)) == 2
+
+
+def test_coalesce_keys_by_arguments():
+  calls = []
+
+  @coalesce("test_fetch")
+  def fetch(host_ip, section=None):
+    calls.append((host_ip, section))
+    return host_ip
+
+  assert fetch("10.0.0.1", section="a") == "10.0.0.1"
+  assert fetch("10.0.0.2") == "10.0.0.2"
+  assert calls == [("10.0.0.1", "a"), ("10.0.0.2", None)]
+  assert get_single_flight("test_fetch").stats()["calls"] == 2
@@ -0,0 +1,45 @@
+import cli
+import client
+import snapshot_store
+from parse_vmknic import cmd_out
+from snapshot_store import (SECTION_VNICS, get_snapshot_store, save_snapshot,
+                            serve_stored)
+
+
+def store_cold(host_ip, section, payload):
+  """
+  Stores payload as if a previous process had fetched it.
+  """
+  save_snapshot(host_ip, "uuid-%s" % host_ip, section, payload)
+  snapshot_store._fresh.clear()
+
+
+def test_stored_payload_is_served_until_max_age():
+  refreshed = []
+  store_cold("10.0.0.1", SECTION_VNICS, {"vnics": [], "portgroups": {}})
+  assert serve_stored("10.0.0.1", SECTION_VNICS, lambda: None,
+                      max_age_secs=0) is None
+  assert serve_stored("10.0.0.1", SECTION_VNICS,
+                      lambda: refreshed.append(1)) == {"vnics": [],
+                                                       "portgroups": {}}
+  snapshot_store.wait_for_refreshes(5)
+  assert refreshed == [1]
+
+
+def test_interface_record_falls_back_to_live_state():
+  # Stored before the host had a vnic on DPG-HOST-BP.
+  store_cold("10.0.0.1", SECTION_VNICS, {"vnics": [], "portgroups": {}})
+  ret, vnic = client.get_host_interface_record("10.0.0.1", "DPG-HOST-BP")
+  assert ret
+  assert vnic.device == "vmk1"
+  assert get_snapshot_store().get_for_host(
+      "10.0.0.1", SECTION_VNICS).payload["portgroups"]["DPG-HOST-BP"]
+
+
+def test_cli_waits_for_refreshes(monkeypatch, tmpdir):
+  waits = []
+  monkeypatch.setattr(snapshot_store, "wait_for_refreshes", waits.append)
+  path = tmpdir.join("vmknics.txt")
+  path.write(cmd_out)
+  assert cli.main(["list-vmknics", "--file", str(path)]) == 0
+  assert waits == [cli.REFRESH_WAIT_SECS]
@@ -0,0 +1,71 @@
+import threading
+import time
+
+from ssh_scheduler import SSHScheduler
+
+
+class Client(object):
+  def __init__(self, host_ip):
+    self.host_ip = host_ip
+    self.closed = False
+
+  def close(self):
+    self.closed = True
+
+
+def run(scheduler, host_ip, func=lambda ssh_client: ssh_client):
+  return scheduler.run(host_ip, ("root",), lambda: Client(host_ip), func)
+
+
+def test_session_is_reused():
+  scheduler = SSHScheduler()
+  _, first = run(scheduler, "10.0.0.1")
+  _, second = run(scheduler, "10.0.0.1")
+  assert first is second
+  assert scheduler.stats()["sessions_opened"] == 1
+
+
+def test_returning_a_session_expires_idle_sessions_of_other_hosts():
+  scheduler = SSHScheduler(idle_timeout_secs=60, evict_interval_secs=0)
+  _, stale = run(scheduler, "10.0.0.1")
+  scheduler._idle["10.0.0.1"][0].last_used_at -= 120
+
+  # Only another host is used from now on.
+  run(scheduler, "10.0.0.2")
+  assert stale.closed
+  assert scheduler._open == {"10.0.0.2": 1}
+
+
+def test_expiry_is_rate_limited():
+  scheduler = SSHScheduler(idle_timeout_secs=60, evict_interval_secs=3600)
+  _, stale = run(scheduler, "10.0.0.1")
+  scheduler._idle["10.0.0.1"][0].last_used_at -= 120
+  run(scheduler, "10.0.0.2")
+  assert not stale.closed
+  scheduler._last_sweep_at -= 3600
+  run(scheduler, "10.0.0.2")
+  assert stale.closed
+
+
+def test_sessions_per_host_are_capped():
+  scheduler = SSHScheduler(max_sessions_per_host=2)
+  lock = threading.Lock()
+  running = [0, 0]
+
+  def command(ssh_client):
+    with lock:
+      running[0] += 1
+      running[1] = max(running[1], running[0])
+    time.sleep(0.02)
+    with lock:
+      running[0] -= 1
+
+  threads = [threading.Thread(target=run, args=(scheduler, "10.0.0.1",
+                                                command))
+             for _ in range(6)]
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join(5)
+  assert running[1] == 2
+  assert scheduler.stats()["sessions_opened"] == 2
@@ -0,0 +1,62 @@
+import client
+from records import PortgroupRecord, VnicRecord
+from vnic_reconciler import (ACTION_ADD, ACTION_REMOVE, ACTION_UPDATE,
+                             VnicSpec, plan_vnic_changes)
+
+BP = PortgroupRecord("dvportgroup-0", "DPG-BP", "dvportgroup-0", "dvs", None,
+                     None)
+VLAN = PortgroupRecord("dvportgroup-1", "DPG-VLAN", "dvportgroup-1", "dvs",
+                       None, None)
+PORTGROUPS = {"DPG-BP": BP, "DPG-VLAN": VLAN}
+
+
+def vnic(device, ip_address, portgroup, netstack="defaultTcpipStack"):
+  return VnicRecord(device, ip_address, "1", portgroup.switch_uuid,
+                    portgroup.key, None, "255.255.0.0", 1500, netstack)
+
+
+def actions(plan):
+  return [(change.action, change.device) for change in plan]
+
+
+def test_matching_vnics_need_no_changes():
+  vnics = [vnic("vmk1", "172.16.0.1", BP)]
+  assert plan_vnic_changes(
+      vnics, [VnicSpec("DPG-BP", "172.16.0.1", "255.255.0.0")],
+      PORTGROUPS) == []
+
+
+def test_adds_go_before_updates_and_removes():
+  vnics = [vnic("vmk1", "172.16.0.1", BP), vnic("vmk2", "172.17.0.1", VLAN),
+           vnic("vmk3", "172.18.0.1", VLAN, netstack="vmotion")]
+  specs = [VnicSpec("DPG-BP", "172.16.0.2", "255.255.0.0"),
+           VnicSpec("DPG-VLAN", "172.18.0.1", "255.255.0.0",
+                    netstack="defaultTcpipStack"),
+           VnicSpec("DPG-BP", "172.16.0.3", "255.255.0.0")]
+  plan = plan_vnic_changes(vnics, specs, PORTGROUPS, remove_unmatched=True)
+  assert actions(plan) == [
+      (ACTION_ADD, None), (ACTION_ADD, None), (ACTION_UPDATE, "vmk1"),
+      (ACTION_REMOVE, "vmk3"), (ACTION_REMOVE, "vmk2")]
+  assert plan[2].changes == ("ip_address",)
+
+
+def test_unmatched_vnics_are_kept_unless_asked():
+  vnics = [vnic("vmk1", "172.16.0.1", BP), vnic("vmk2", "172.16.0.9", BP),
+           vnic("vmk3", "10.0.0.1", VLAN)]
+  specs = [VnicSpec("DPG-BP", "172.16.0.1", "255.255.0.0")]
+  assert plan_vnic_changes(vnics, specs, PORTGROUPS) == []
+  # vmk3 is not on a portgroup of the specs.
+  assert actions(plan_vnic_changes(vnics, specs, PORTGROUPS,
+                                   remove_unmatched=True)) == [
+      (ACTION_REMOVE, "vmk2")]
+
+
+def test_reconcile_returns_added_devices():
+  desired = {"10.0.0.1": [
+      VnicSpec("DPG-HOST-BP", "172.16.0.1", "255.255.0.0"),
+      VnicSpec("DPG-HOST-VXLAM", "172.20.0.1", "255.255.0.0")]}
+  ret, plan = client.reconcile_vnics(desired)["10.0.0.1"]
+  assert ret
+  assert [(change.action, change.device) for change in plan] == [
+      (ACTION_ADD, "vmk2")]
+  assert client.reconcile_vnics(desired) == {"10.0.0.1": (True, [])}
@@ -0,0 +1,132 @@
+import io
+import os
+import xml.etree.ElementTree as ET
+
+import pytest
+
+from xml_parse_interface_list import (find_esxcli_structure,
+                                      get_ipv4_address_for_device,
+                                      iter_esxcli_structures,
+                                      parse_interface_list)
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLES = [os.path.join(REPO_DIR, name)
+           for name in ("network_ip_interface_list.xml", "ipv4_addr.xml")]
+
+
+def dom_structures(path):
+  """
+  Rows of esxcli XML output read from the whole document tree.
+  """
+  rows = []
+  for structure in ET.parse(path).getroot().find("root")[0]:
+    row = {}
+    for field in structure.findall("field"):
+      value = field[0]
+      if not value.text:
+        row[field.get("name")] = None
+      elif value.tag == "integer":
+        row[field.get("name")] = int(value.text)
+      elif value.tag == "boolean":
+        row[field.get("name")] = value.text == "true"
+      else:
+        row[field.get("name")] = value.text
+    rows.append(row)
+  return rows
+
+
+def read(path):
+  with open(path) as fd:
+    return fd.read()
+
+
+@pytest.mark.parametrize("path", SAMPLES)
+def test_rows_match_document_tree(path):
+  expected = dom_structures(path)
+  assert len(expected) > 1
+  assert list(iter_esxcli_structures(path)) == expected
+  assert list(iter_esxcli_structures(read(path))) == expected
+  assert list(iter_esxcli_structures(read(path).encode())) == expected
+  assert list(iter_esxcli_structures(path, fields=("Name",))) == [
+      {"Name": row["Name"]} for row in expected]
+
+
+def test_lookups_match_document_tree():
+  interfaces, addresses = [dom_structures(path) for path in SAMPLES]
+  for row in interfaces:
+    if row["External ID"] == "N/A":
+      continue
+    assert parse_interface_list(row["External ID"], SAMPLES[0]) == (
+        True, row["Name"])
+  for row in addresses:
+    assert get_ipv4_address_for_device(row["Name"], SAMPLES[1]) == (
+        True, {"address": row["IPv4 Address"], "mask": row["IPv4 Netmask"]})
+  assert not parse_interface_list("no-such-id", SAMPLES[0])[0]
+  assert not get_ipv4_address_for_device("vmk99", SAMPLES[1])[0]
+
+
+class CountingReader(io.BytesIO):
+  def __init__(self, data):
+    io.BytesIO.__init__(self, data)
+    self.bytes_read = 0
+
+  def read(self, size=-1):
+    data = io.BytesIO.read(self, size)
+    self.bytes_read += len(data)
+    return data
+
+
+def test_lookup_stops_at_the_match():
+  text = read(SAMPLES[0])
+  head, rest = text.split("<list type=\"structure\">", 1)
+  rows, tail = rest.rsplit("</list>", 1)
+  # The first row matches, thousands of rows follow it.
+  data = (head + "<list type=\"structure\">" + rows * 1000 + "</list>" +
+          tail).encode()
+  first = dom_structures(SAMPLES[0])[0]
+  source = CountingReader(data)
+  assert find_esxcli_structure(source, "Name", first["Name"]) == first
+  assert source.bytes_read < len(data) // 10
+
+  # Nothing after the match is parsed, not even a broken document.
+  truncated = data[:data.index(b"</structure>") + len(b"</structure>") + 1]
+  assert find_esxcli_structure(truncated, "Name", first["Name"]) == first
+  with pytest.raises(ET.ParseError):
+    list(iter_esxcli_structures(truncated))
+
+
+NESTED = """<?xml version="1.0"?>
+<output xmlns:esxcli="http://www.vmware.com/Products/ESX/5.0/esxcli">
+  <root>
+    <list type="structure">
+      <structure typeName="Row">
+        <field name="Name"><string>vmk0</string></field>
+        <field name="Address">
+          <structure typeName="Address">
+            <field name="Name"><string>nested</string></field>
+          </structure>
+        </field>
+        <field name="Routes">
+          <list type="structure">
+            <structure typeName="Route">
+              <field name="Name"><string>nested-in-list</string></field>
+            </structure>
+          </list>
+        </field>
+        <field name="MTU"><integer>9000</integer></field>
+      </structure>
+      <structure typeName="Row">
+        <field name="Name"><string>vmk1</string></field>
+        <field name="MTU"><integer></integer></field>
+      </structure>
+    </list>
+  </root>
+</output>
+"""
+
+
+def test_nested_structures_are_not_rows():
+  rows = list(iter_esxcli_structures(NESTED, fields=("Name", "MTU")))
+  assert rows == [{"Name": "vmk0", "MTU": 9000}, {"Name": "vmk1", "MTU": None}]
+  assert find_esxcli_structure(NESTED, "Name", "nested") is None
+  assert find_esxcli_structure(NESTED, "Name", "nested-in-list") is None
@@ -0,0 +1,207 @@
+"""
+Desired state reconciliation of the vmkernel NICs of a host.
+
+Setting up the network of a cluster used to call AddVirtualNic for every
+vmknic on every run, creating duplicates or failing on the ones that already
+existed. plan_vnic_changes() compares the desired VnicSpec of a host with
+one snapshot of its vnics and returns the minimal list of changes: vnics
+that only differ in address, netmask, MTU or portgroup are updated in place,
+only missing ones are added, and vnics on the managed portgroups that no
+spec asks for are removed only if the caller asks for it. apply_vnic_changes()
+carries a plan out.
+"""
+
+from collections import namedtuple
+
+from lazy_import import LazyImport
+
+log = LazyImport("util.base", "log")
+vim = LazyImport("pyVmomi", "vim")
+
+__all__ = [
+    "ACTION_ADD",
+    "ACTION_REMOVE",
+    "ACTION_UPDATE",
+    "VnicChange",
+    "VnicSpec",
+    "apply_vnic_changes",
+    "build_virtual_nic_spec",
+    "plan_vnic_changes",
+]
+
+ACTION_ADD = "add"
+ACTION_UPDATE = "update"
+ACTION_REMOVE = "remove"
+# Order changes are applied in. Adding first keeps the host reachable when a
+# vnic is replaced, and a plan failing half way has removed nothing yet.
+ACTION_ORDER = (ACTION_ADD, ACTION_UPDATE, ACTION_REMOVE)
+
+# Desired vmkernel NIC on a distributed portgroup, by name. mtu and netstack
+# are left as they are, or to the host defaults for new vnics, if None.
+VnicSpec = namedtuple("VnicSpec", [
+    "portgroup", "ip_address", "netmask", "mtu", "netstack"])
+VnicSpec.__new__.__defaults__ = (None, None)
+
+# A change of a plan. device is None for vnics to add, until the plan is
+# applied. changes lists the fields an update sets, e.g. ("ip_address",
+# "mtu").
+VnicChange = namedtuple("VnicChange", [
+    "action", "device", "spec", "portgroup", "changes"])
+
+
+def _on_portgroup(vnic, portgroup):
+  return (vnic.switch_uuid == portgroup.switch_uuid and
+          vnic.portgroup_key == portgroup.key)
+
+
+def _diff(vnic, spec, portgroup):
+  """
+  Returns the fields of vnic to change to match spec on portgroup.
+  """
+  changes = []
+  if not _on_portgroup(vnic, portgroup):
+    changes.append("portgroup")
+  if vnic.ip_address != spec.ip_address:
+    changes.append("ip_address")
+  if vnic.netmask != spec.netmask:
+    changes.append("netmask")
+  if spec.mtu is not None and vnic.mtu != spec.mtu:
+    changes.append("mtu")
+  if spec.netstack is not None and vnic.netstack != spec.netstack:
+    changes.append("netstack")
+  return tuple(changes)
+
+
+def plan_vnic_changes(vnics, specs, portgroups, remove_unmatched=False):
+  """
+  Returns the changes making vnics match specs.
+
+  Only vnics on the portgroups of specs are managed, others are left alone.
+  Each spec is matched with, in order of preference, a managed vnic on its
+  portgroup with its address, a managed vnic with its address on another
+  portgroup, or any other managed vnic on its portgroup. Matched vnics that
+  differ are updated, except that a vnic changes its TCP/IP stack only by
+  being added again and the old one removed. Specs left unmatched are added.
+  Managed vnics left unmatched are removed if remove_unmatched is True, and
+  kept otherwise.
+
+  Args:
+    vnics (iterable): VnicRecord of the vnics of the host.
+    specs (list): VnicSpec of the desired vnics.
+    portgroups (dict): Map of portgroup name to PortgroupRecord, for the
+      portgroups of specs.
+    remove_unmatched (bool): Whether to remove the managed vnics no spec
+      asks for.
+
+  Returns:
+    list of VnicChange, in the order they are to be applied.
+  """
+  managed_portgroups = [portgroups[spec.portgroup] for spec in specs]
+  managed = [vnic for vnic in vnics
+             if any(_on_portgroup(vnic, pg) for pg in managed_portgroups)]
+  matches = {}
+  for rule in (
+      lambda vnic, spec, pg: (_on_portgroup(vnic, pg) and
+                              vnic.ip_address == spec.ip_address),
+      lambda vnic, spec, pg: vnic.ip_address == spec.ip_address,
+      lambda vnic, spec, pg: _on_portgroup(vnic, pg)):
+    for index, spec in enumerate(specs):
+      if index in matches:
+        continue
+      for vnic in managed:
+        if (vnic.device not in matches.values() and
+            rule(vnic, spec, portgroups[spec.portgroup])):
+          matches[index] = vnic.device
+          break
+
+  by_device = dict((vnic.device, vnic) for vnic in managed)
+  plan = []
+  for index, spec in enumerate(specs):
+    portgroup = portgroups[spec.portgroup]
+    if index not in matches:
+      plan.append(VnicChange(ACTION_ADD, None, spec, portgroup, ()))
+      continue
+    vnic = by_device[matches[index]]
+    changes = _diff(vnic, spec, portgroup)
+    if "netstack" in changes:
+      # The stack of a vnic is fixed when it is added.
+      plan.append(VnicChange(ACTION_ADD, None, spec, portgroup, ()))
+      plan.append(VnicChange(ACTION_REMOVE, vnic.device, None, None, ()))
+    elif changes:
+      plan.append(VnicChange(ACTION_UPDATE, vnic.device, spec, portgroup,
+                             changes))
+  matched = set(matches.values())
+  for vnic in managed:
+    if remove_unmatched and vnic.device not in matched:
+      plan.append(VnicChange(ACTION_REMOVE, vnic.device, None, None, ()))
+  plan.sort(key=lambda change: ACTION_ORDER.index(change.action))
+  return plan
+
+
+def build_virtual_nic_spec(portgroup=None, ip_address=None, netmask=None,
+                           mtu=None, netstack=None):
+  """
+  Returns a vim.host.VirtualNic.Specification setting the given fields.
+  portgroup is a PortgroupRecord. Fields left None are not set, so
+  UpdateVirtualNic leaves them unchanged.
+  """
+  vmk = vim.host.VirtualNic.Specification()
+  if ip_address is not None or netmask is not None:
+    vmk.ip = vim.host.IpConfig()
+    vmk.ip.ipAddress = ip_address
+    vmk.ip.subnetMask = netmask
+  if portgroup is not None:
+    dvs_port = vim.dvs.PortConnection()
+    dvs_port.switchUuid = portgroup.switch_uuid
+    dvs_port.portgroupKey = portgroup.key
+    vmk.distributedVirtualPort = dvs_port
+  if mtu is not None:
+    vmk.mtu = mtu
+  if netstack is not None:
+    vmk.netStackInstanceKey = netstack
+  return vmk
+
+
+def _update_spec(change):
+  spec = change.spec
+  address_changed = ("ip_address" in change.changes or
+                     "netmask" in change.changes)
+  return build_virtual_nic_spec(
+      portgroup=change.portgroup if "portgroup" in change.changes else None,
+      ip_address=spec.ip_address if address_changed else None,
+      netmask=spec.netmask if address_changed else None,
+      mtu=spec.mtu if "mtu" in change.changes else None)
+
+
+def apply_vnic_changes(network_system, plan):
+  """
+  Applies plan, made by plan_vnic_changes(), through network_system, the
+  vim.host.NetworkSystem of the host. Stops at the first failure.
+
+  Returns:
+    (True, list of the devices added, in plan order) on success,
+    (False, error message) otherwise.
+  """
+  added = []
+  for change in plan:
+    try:
+      if change.action == ACTION_REMOVE:
+        network_system.RemoveVirtualNic(device=change.device)
+      elif change.action == ACTION_UPDATE:
+        network_system.UpdateVirtualNic(device=change.device,
+                                        nic=_update_spec(change))
+      else:
+        spec = change.spec
+        added.append(network_system.AddVirtualNic(
+            portgroup="", nic=build_virtual_nic_spec(
+                change.portgroup, spec.ip_address, spec.netmask, spec.mtu,
+                spec.netstack)))
+    except Exception as ex:
+      msg = "vmkernel %s of %s failed: %s" % (
+          change.action, change.device or change.spec.ip_address, ex)
+      log.ERROR(msg)
+      return (False, msg)
+    log.INFO("vmkernel %s of %s: %s" % (
+        change.action, change.device or added[-1],
+        ", ".join(change.changes) or "done"))
+  return (True, added)
@@ -1,62 +1,101 @@
+import io
 import xml.etree.ElementTree as ET
 ext_id='e05d2b07-346f-48cc-b3b6-a58e48f92bcd'
 
-def parse_interface_list(external_id):
-    tree = ET.parse('network_ip_interface_list.xml')
-    root = tree.find('root')[0] 
-    nics = root.findall('structure')
-    nic_index = 0
-    nic_name_ext_id_maps = []
-    for nic in nics:
-        nameId = {}
-        for nic_field in nic.findall('field'):
-            #print(nic_field.attrib)
-            if nic_field.attrib['name'] == 'Name':
-                for name_val in nic_field.findall('string'):
-                    nameId["name"] = name_val.text
-            if nic_field.attrib['name'] == 'External ID':
-                for ext_id in nic_field.findall('string'):
-                    nameId["ext_id"] = ext_id.text
-        if nameId:
-            nic_name_ext_id_maps.append(nameId)
-    for index, nic_name_ext_id_map in enumerate(nic_name_ext_id_maps):
-        if nic_name_ext_id_map['ext_id'] == external_id:
-            return (True, nic_name_ext_id_maps[index]['name'])
+def _decode_value(value_elem):
+    """
+    Converts an esxcli XML value element to the matching python value.
+    """
+    if not value_elem.text:
+        return None
+    if value_elem.tag == 'integer':
+        return int(value_elem.text)
+    if value_elem.tag == 'boolean':
+        return value_elem.text == 'true'
+    return value_elem.text
+
+def _as_source(source):
+    """
+    Returns something iterparse accepts. esxcli output passed in as text is
+    wrapped in a file object, anything else is assumed to be a path or file.
+    """
+    if isinstance(source, bytes):
+        return io.BytesIO(source)
+    if isinstance(source, str) and source.lstrip().startswith('<'):
+        return io.BytesIO(source.encode('utf-8'))
+    return source
+
+def iter_esxcli_structures(source, fields=None):
+    """
+    Streams the rows of esxcli --formatter=xml output.
+
+    Each top level <structure> is turned into a dict of field name to value
+    as soon as it has been parsed, and its elements are released before the
+    next row is read, so memory use does not grow with the output size.
+
+    Args:
+      source: esxcli output as str/bytes, or a path or file object.
+      fields (iterable): Field names to keep, or None to keep all fields.
+    Yields:
+      dict of field name to value for each structure.
+    """
+    wanted = frozenset(fields) if fields is not None else None
+    # Stack of open elements, used to find the list a structure belongs to.
+    stack = []
+    for event, elem in ET.iterparse(_as_source(source),
+                                    events=('start', 'end')):
+        if event == 'start':
+            stack.append(elem)
+            continue
+        stack.pop()
+        # Only rows of the top level list, not structures nested in fields.
+        if (elem.tag != 'structure' or len(stack) < 2 or
+                stack[-1].tag != 'list' or stack[-2].tag != 'root'):
+            continue
+        record = {}
+        for field in elem:
+            name = field.get('name')
+            if wanted is not None and name not in wanted:
+                continue
+            if len(field):
+                record[name] = _decode_value(field[0])
+        elem.clear()
+        stack[-1].remove(elem)
+        yield record
+
+def find_esxcli_structure(source, field, value, fields=None):
+    """
+    Returns the first row of esxcli XML output whose field equals value, or
+    None. Parsing stops as soon as the row is found.
+    """
+    for record in iter_esxcli_structures(source, fields):
+        if record.get(field) == value:
+            return record
+    return None
+
+def parse_interface_list(external_id, source='network_ip_interface_list.xml'):
+    nic = find_esxcli_structure(source, 'External ID', external_id,
+                                fields=('Name', 'External ID'))
+    if nic:
+        return (True, nic['Name'])
 
     return (False, "Can not find device_id for external ID: %s" % external_id)
 
-def get_ipv4_address_for_device(device_name):
-    tree = ET.parse('ipv4_addr.xml')
-    root = tree.find('root')[0] 
-    ipv4_addresses = root.findall('structure')
-    ipv4_address_maps = []
-    for ipv4_address in ipv4_addresses:
-        ipv4_address_map = {}
-        for ipv4_field in ipv4_address.findall('field'):
-            #print(ipv4_field.attrib)
-            if ipv4_field.attrib['name'] == 'IPv4 Address':
-                for unicast_addr in ipv4_field.findall('string'):
-                    ipv4_address_map['address'] = unicast_addr.text
-            if ipv4_field.attrib['name'] == 'IPv4 Netmask':
-                for mask in ipv4_field.findall('string'):
-                    ipv4_address_map['mask'] = mask.text
-            if ipv4_field.attrib['name'] == 'Name':
-                for name in ipv4_field.findall('string'):
-                    ipv4_address_map['name'] = name.text
-        if ipv4_address_map:
-            ipv4_address_maps.append(ipv4_address_map)
-
-    for i, addr_map in enumerate(ipv4_address_maps):
-        if addr_map['name'] == device_name:
-            return (True, {"address": ipv4_address_maps[i]["address"],
-                "mask": ipv4_address_maps[i]["mask"]})
+def get_ipv4_address_for_device(device_name, source='ipv4_addr.xml'):
+    addr_map = find_esxcli_structure(
+        source, 'Name', device_name,
+        fields=('Name', 'IPv4 Address', 'IPv4 Netmask'))
+    if addr_map:
+        return (True, {"address": addr_map.get("IPv4 Address"),
+            "mask": addr_map.get("IPv4 Netmask")})
 
     return (False, "Can not find ipv4 address on device:%s" % device_name)
 
-ret, device_name = parse_interface_list(ext_id)
-if not ret:
-   print(device_name)
-   exit()
-print(ret, device_name)
-ret, ipv4_addr = get_ipv4_address_for_device(device_name)
-print(ret, ipv4_addr)
+if __name__ == "__main__":
+    ret, device_name = parse_interface_list(ext_id)
+    if not ret:
+       print(device_name)
+       exit()
+    print(ret, device_name)
+    ret, ipv4_addr = get_ipv4_address_for_device(device_name)
+    print(ret, ipv4_addr)